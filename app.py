@@ -20,7 +20,19 @@
 ################################################################################
 
 import pandas as pd  # Librería para manipulación y análisis de datos estructurados (DataFrames)
+import numpy as np  # Librería de cálculo numérico vectorizado (arrays en C, sin bucles Python)
 import os  # Permite interactuar con el sistema operativo (rutas de archivos, limpiar pantalla)
+import re  # Expresiones regulares: validación rápida de la entrada numérica
+import sys  # Acceso directo a stdout para emitir el informe con pocas escrituras
+import io  # Buffers binarios explícitos para la exportación a disco
+import csv  # Escritor CSV de la librería estándar (implementado en C)
+import gzip  # Compresión opcional del CSV exportado (nivel 1: rápido y suficiente)
+import time  # Edad de los archivos de caché (caducidad de 24 horas)
+import hashlib  # Huella sha1 de los parámetros de búsqueda para nombrar la caché
+import asyncio  # Orquestación asíncrona: lanza las ramas de la pipeline y espera a todas de golpe
+import threading  # Hilo en segundo plano para precalentar la conexión mientras el usuario teclea
+import requests  # Peticiones HTTP: aquí solo para crear la sesión compartida de la pipeline
+from requests.adapters import HTTPAdapter, Retry  # Pool de conexiones keep-alive y política de reintentos
 
 # Importamos los módulos personalizados del proyecto
 import p1_busqueda_local as p1  # Módulo de scraping y geolocalización de inmuebles
@@ -31,8 +43,119 @@ import p4_transporte as p4  # Módulo de análisis de conectividad y transporte
 pd.set_option('display.max_columns', None)  # Fuerza a mostrar todas las columnas al imprimir el DataFrame
 pd.set_option('display.width', 1000)  # Amplía el ancho de visualización para evitar saltos de línea en consola
 
+# Numba es OPCIONAL: si está instalado compilamos el núcleo de notas a código máquina,
+# y si no lo está seguimos con la versión vectorizada de NumPy sin más cambios
+try:
+    from numba import njit  # Compilador JIT que traduce bucles numéricos a C
+    TIENE_NUMBA = True  # Marcamos que podemos usar el camino compilado
+except ImportError:  # Si numba no está instalado en el entorno
+    TIENE_NUMBA = False  # Nos quedamos con el camino NumPy puro
+
+# numexpr es OPCIONAL: fusiona la cadena de ufuncs de la nota final en un solo
+# bucle multihilo que libera el GIL (sin arrays temporales intermedios)
+try:
+    import numexpr as ne  # Evaluador de expresiones numéricas compiladas
+    TIENE_NUMEXPR = True  # Podemos fusionar la mezcla final de notas
+except ImportError:  # Si numexpr no está instalado
+    TIENE_NUMEXPR = False  # Usamos la mezcla con np.where de siempre
+
+# pyarrow también es OPCIONAL: su escritor CSV multihilo en C++ gana al camino manual
+try:
+    import pyarrow as pa  # Tablas columnares en memoria
+    import pyarrow.csv as pa_csv  # Escritor CSV nativo de Arrow
+    TIENE_PYARROW = True  # Podemos delegar la exportación en Arrow
+except ImportError:  # Si pyarrow no está instalado
+    TIENE_PYARROW = False  # Usamos nuestro escritor manual de siempre
+
+def nucleo_notas(precios, trans, comp):
+
+    ################################################################################
+    # Núcleo numérico puro del cálculo de notas, escrito como UN solo bucle sobre
+    # arrays planos para que Numba pueda compilarlo y vectorizarlo (una pasada de
+    # memoria, sin arrays intermedios). Replica exactamente las fórmulas de
+    # calcular_puntuacion: normalización Min-Max y ponderación dinámica.
+    #
+    # RECIBE: precios (N,), trans (N,3) y comp (N,4) como arrays float32.
+    # DEVUELVE: Array (N,) float32 con la NOTA_FINAL sin redondear.
+    ################################################################################
+
+    n = precios.shape[0]  # Número de locales a puntuar
+    notas = np.empty(n, dtype=np.float32)  # Reservamos el array de salida de una vez
+
+    # Pasada 1: escaneo de mínimos y máximos para las normalizaciones
+    max_precio = precios[0]  # Inicializamos el techo de precios con el primer valor
+    min_precio = precios[0]  # Inicializamos el suelo de precios con el primer valor
+    max_transporte = 0.0  # Máximo del score ponderado de transporte
+    max_oport = -1e30  # Máximo del score de oportunidad
+    min_oport = 1e30  # Mínimo del score de oportunidad
+    for i in range(n):  # Recorremos una única vez todos los locales
+        if precios[i] > max_precio: max_precio = precios[i]  # Actualizamos el techo de precios
+        if precios[i] < min_precio: min_precio = precios[i]  # Actualizamos el suelo de precios
+        raw_t = trans[i, 0] + trans[i, 1] * 3.0 + trans[i, 2]  # Pesos: Metro triple, Bus y Bici simple
+        if raw_t > max_transporte: max_transporte = raw_t  # Actualizamos el máximo de transporte
+        raw_o = comp[i, 2] * 2.0 + comp[i, 0] * 0.5 - comp[i, 1] * 3.0  # Malos suman, Buenos restan
+        if raw_o > max_oport: max_oport = raw_o  # Actualizamos el máximo de oportunidad
+        if raw_o < min_oport: min_oport = raw_o  # Actualizamos el mínimo de oportunidad
+
+    rango_precio = max_precio - min_precio  # Rango de precios para la normalización
+    if max_transporte <= 0.0: max_transporte = 1.0  # Evitamos dividir por cero si nadie tiene transporte
+    rango_oport = max_oport - min_oport  # Rango de oportunidad
+    if rango_oport == 0.0: rango_oport = 1.0  # Evitamos la división por cero
+
+    # Pasada 2: cálculo de las tres notas y la ponderación dinámica en línea
+    for i in range(n):  # Segundo barrido, ya con los rangos conocidos
+        if rango_precio == 0.0:  # Si todos los locales valen lo mismo
+            nota_precio = 10.0  # Nota máxima para todos
+        else:
+            nota_precio = 10.0 * (max_precio - precios[i]) / rango_precio  # Más barato = más nota
+        raw_t = trans[i, 0] + trans[i, 1] * 3.0 + trans[i, 2]  # Score crudo de transporte
+        nota_conec = 10.0 * raw_t / max_transporte  # Normalizamos la conectividad
+        raw_o = comp[i, 2] * 2.0 + comp[i, 0] * 0.5 - comp[i, 1] * 3.0  # Score crudo de oportunidad
+        nota_oport = 10.0 * (raw_o - min_oport) / rango_oport  # Normalizamos la oportunidad
+        if comp[i, 0] > 0:  # ESCENARIO A: hay competencia en la zona
+            notas[i] = nota_precio * 0.40 + nota_oport * 0.30 + nota_conec * 0.30  # 40/30/30
+        else:  # ESCENARIO B: zona desierta o sin datos
+            notas[i] = nota_precio * 0.50 + nota_conec * 0.50 - 2.0  # 50/50 con penalización de -2
+    return notas  # Devolvemos las notas sin redondear
+
+if TIENE_NUMBA:  # Solo si numba está disponible
+    nucleo_notas = njit(cache=True, fastmath=True)(nucleo_notas)  # Compilamos el núcleo (cache=True evita recompilar en cada ejecución)
+
+PATRON_ENTERO = re.compile(r'^\s*\d+\s*$')  # Patrón precompilado para validar enteros sin disparar excepciones
+
+# Plantilla única del informe TOP 5: un solo format + una sola escritura por local
+PLANTILLA_LOCAL = (
+    "LOCAL Nº {n}: {nombre}\n"
+    "Dirección: {direccion}, {cp}\n"
+    "Precio: {precio} €\n"
+    "Nota final: {nota} sobre 10\n"
+    "Nº de locales de competencia cerca: {comp_total}\n"
+    "Nº de locales con buenas reseñas: {comp_buenos}\n"
+    "Nº de locales con malas reseñas: {comp_malos}\n"
+    "Nota media de la competencia cerca: {media}/5\n"
+    "Nº de paradas de bus cerca: {bus}\n"
+    "Nº de paradas de metro/tren cerca: {metro}\n"
+    "Nº de paradas de bici cerca: {bici}\n"
+    + "-" * 40 + "\n\n"
+)
+
+def precalentar_conexion():
+
+    ################################################################################
+    # Se lanza en un hilo daemon nada más conocer la ciudad: hace una petición
+    # ligera a pisos.com para resolver el DNS y calentar la ruta de red mientras
+    # el usuario sigue tecleando el resto de respuestas. Cualquier fallo se
+    # ignora: es solo un precalentamiento oportunista.
+    ################################################################################
+
+    try:  # El precalentamiento nunca debe molestar al usuario
+        requests.head("https://www.pisos.com/", timeout=5)  # Petición mínima: resuelve DNS y negocia TLS
+    except Exception:  # Sin red, timeout... da igual
+        pass  # El scraping real hará su conexión normal
+
 def limpiar_pantalla():
-    os.system('cls' if os.name == 'nt' else 'clear')  # Ejecuta el comando de limpieza según el SO por buenas prácticas (sacado de la IA)
+    sys.stdout.write("\033[2J\033[H")  # Secuencia ANSI: borra la pantalla y lleva el cursor al origen (sin lanzar proceso hijo)
+    sys.stdout.flush()  # Forzamos el volcado para que el borrado sea inmediato
 
 def obtener_inputs():
 
@@ -52,22 +175,27 @@ def obtener_inputs():
     print("            recuerda que funciona mejor con ciudades grandes            ")
     print("========================================================================")
     
-    ciudad = input("1. Ciudad (ej. Madrid, Valencia): ").strip()  # Solicitamos la ciudad y eliminamos espacios extra
+    ciudad = input("1. Ciudad (ej. Madrid, Valencia): ")  # Solicitamos la ciudad
+
+    # Mientras el usuario contesta el resto, un hilo daemon precalienta la conexión al portal
+    threading.Thread(target=precalentar_conexion, daemon=True).start()  # El tiempo de tecleo se solapa con el arranque de red
+
+    subtipo = input('''2. Tipo de inmueble:
+            Opciones: 'Locales comerciales', 'Oficinas', 'Naves', 'Edificios': ''')  # Solicitamos el tipo de inmueble
+
+    operacion = input("3. Operación (Alquiler/Venta): ")  # Solicitamos el tipo de contrato
 
-    subtipo = input('''2. Tipo de inmueble: 
-            Opciones: 'Locales comerciales', 'Oficinas', 'Naves', 'Edificios': ''').strip()  # Solicitamos el tipo de inmueble
-    
-    operacion = input("3. Operación (Alquiler/Venta): ").strip()  # Solicitamos el tipo de contrato
-    
     while True:  # Iniciamos un bucle infinito para validar el presupuesto
-        try:
-            presupuesto = int(input("4. Presupuesto Máximo (€): "))  # Intentamos convertir la entrada a número entero
-            break  # Si funciona, rompemos el bucle
-        except ValueError:  # Si el usuario introduce texto en vez de números
-            print("   Por favor, introduce un número válido.")
+        entrada = input("4. Presupuesto Máximo (€): ")  # Leemos la entrada como texto
+        if PATRON_ENTERO.match(entrada):  # Validamos con el patrón precompilado (sin coste de excepciones)
+            presupuesto = int(entrada)  # La conversión ya no puede fallar
+            break  # Entrada válida: salimos del bucle
+        print("   Por favor, introduce un número válido.")  # Si no es un entero, pedimos de nuevo
             
-    negocio = input("5. ¿Qué negocio vas a montar? (ej. pizzeria, farmacia): ").strip()  # Solicitamos la actividad comercial
-    
+    negocio = input("5. ¿Qué negocio vas a montar? (ej. pizzeria, farmacia): ")  # Solicitamos la actividad comercial
+
+    # Limpiamos todas las entradas de texto de una sola pasada al final
+    ciudad, subtipo, operacion, negocio = (s.strip() for s in (ciudad, subtipo, operacion, negocio))
     return ciudad, subtipo, operacion, presupuesto, negocio  # Devolvemos todos los datos recolectados
 
 def calcular_puntuacion(df, presupuesto_max):
@@ -84,64 +212,143 @@ def calcular_puntuacion(df, presupuesto_max):
     ################################################################################
 
     print("\n--- CALCULANDO NOTAS FINALES ---")
-    notas = []  # Inicializamos la lista para guardar las puntuaciones calculadas
-    
-    # Pre-cálculo para normalización (Min-Max)
-    precios = df['PRECIO'].tolist()  # Extraemos la lista de precios de todos los locales
-    max_precio = max(precios) if precios else presupuesto_max  # Buscamos el precio más alto para el techo de la escala
-    min_precio = min(precios) if precios else 0  # Buscamos el precio más bajo para el suelo de la escala
-    
-    # Transporte
-    scores_transporte = []  # Lista temporal para valores crudos de transporte
-    for t in df['NUM_TRANS_PUB']:  # Iteramos sobre la tupla (Bus, Metro, Bici)
-        val = (t[0] * 1) + (t[1] * 3) + (t[2] * 1)  # Asignamos pesos: Metro vale triple, Bus y Bici simple
-        scores_transporte.append(val)  # Guardamos el valor ponderado
-    max_transporte = max(scores_transporte) if scores_transporte and max(scores_transporte) > 0 else 1  # Hallamos el máximo para normalizar
-    
-    # Competencia (Oportunidad)
-    scores_oportunidad = []  # Lista temporal para valores crudos de oportunidad
-    for c in df['NUM_COMPETENCIA']:  # Iteramos sobre la tupla (Total, Buenos, Malos, Media)
-        total, buenos, malos, _ = c  # Desempaquetamos los valores relevantes
-        val = (malos * 2) + (total * 0.5) - (buenos * 3)  # Aplicamos fórmula: Malos suman (oportunidad), Buenos restan (amenaza)
-        scores_oportunidad.append(val)  # Guardamos el score de oportunidad
-    
-    max_oport = max(scores_oportunidad) if scores_oportunidad else 1  # Máximo del grupo para normalizar
-    min_oport = min(scores_oportunidad) if scores_oportunidad else 0  # Mínimo del grupo
-    rango_oport = max_oport - min_oport if max_oport != min_oport else 1  # Rango total para evitar división por cero
-
-    # --- BUCLE DE CÁLCULO ---
-    for i, row in df.iterrows():  # Recorremos el DataFrame fila a fila
-        # 1. Nota PRECIO (0-10)
-        precio = row['PRECIO']  # Obtenemos precio del local actual
-        if max_precio == min_precio:  # Si todos valen lo mismo
-            nota_precio = 10  # Asignamos nota máxima
-        else:
-            nota_precio = 10 * (max_precio - precio) / (max_precio - min_precio)  # Fórmula inversa: más barato = más nota
-        
-        # 2. Nota CONECTIVIDAD (0-10)
-        raw_trans = scores_transporte[i]  # Recuperamos el valor crudo calculado antes
-        nota_conec = 10 * (raw_trans / max_transporte)  # Normalizamos sobre el máximo encontrado (regla de tres)
-        
-        # 3. Nota OPORTUNIDAD (0-10)
-        raw_oport = scores_oportunidad[i]  # Recuperamos el valor crudo de oportunidad
-        nota_oport = 10 * ((raw_oport - min_oport) / rango_oport)  # Normalizamos entre 0 y 10 usando el rango min-max
-        
-        # --- PONDERACIÓN DINÁMICA ---
-        comp_data = row['NUM_COMPETENCIA']  # Obtenemos datos de competencia
-        hay_competencia = comp_data[0] > 0  # Verificamos si existen rivales en la zona (Total > 0)
-        
-        if hay_competencia:  # ESCENARIO A: Zona con mercado activo
-            # Fórmula A: 40% Precio, 30% Oportunidad, 30% Conectividad
-            nota_final = (nota_precio * 0.40) + (nota_oport * 0.30) + (nota_conec * 0.30)  # Cálculo ponderado completo
-        else:  # ESCENARIO B: Zona desierta o sin datos
-            # Fórmula B (Sin competencia): 50% Precio, 50% Conectividad
-            nota_final = (nota_precio * 0.50) + (nota_conec * 0.50) - 2 # Repartimos el peso entre lo tangible (precio y transporte) y penalizamos con -2 puntos
-            
-        notas.append(round(nota_final, 2))  # Redondeamos a 2 decimales y guardamos
-        
-    df['NOTA_FINAL'] = notas  # Insertamos la columna de notas en el DataFrame
+
+    # Extraemos las columnas UNA sola vez como arrays de NumPy (sin bucles fila a fila)
+    precios = df['PRECIO'].to_numpy(dtype=float)  # Vector de precios de todos los locales
+    trans = df[['BUS', 'METRO', 'BICI']].to_numpy(dtype=float)  # Matriz (N,3) ya en columnas escalares (SoA)
+    comp = df[['COMP_TOTAL', 'COMP_BUENOS', 'COMP_MALOS', 'COMP_MEDIA']].to_numpy(dtype=float)  # Matriz (N,4) en columnas escalares
+
+    # CAMINO RÁPIDO: si numba está instalado delegamos en el núcleo compilado (una sola pasada)
+    if TIENE_NUMBA and precios.size:  # Solo si hay filas que puntuar
+        notas = nucleo_notas(precios.astype(np.float32), trans.astype(np.float32), comp.astype(np.float32))  # Kernel JIT en float32 (SoA)
+        df['NOTA_FINAL'] = np.round(notas.astype(float), 2)  # Redondeamos e insertamos la columna
+        return df  # Devolvemos el DataFrame puntuado
+
+    # Pre-cálculo para normalización (Min-Max): una sola pasada C por columna, sin listas intermedias
+    max_precio = float(precios.max()) if precios.size else presupuesto_max  # Techo de la escala (calculado una única vez)
+    rango_precio = np.ptp(precios) if precios.size else 0  # Rango Min-Max de precios en una sola llamada
+
+    # Transporte: pesos (Metro vale triple, Bus y Bici simple) aplicados con un producto matricial
+    scores_transporte = trans @ np.array([1.0, 3.0, 1.0])  # Vector de valores crudos de transporte
+    max_transporte = (float(scores_transporte.max()) if scores_transporte.size else 0.0) or 1.0  # Máximo saneado: nunca cero
+
+    # Competencia (Oportunidad): Malos suman (oportunidad), Buenos restan (amenaza)
+    total_arr, buenos_arr, malos_arr = comp[:, 0], comp[:, 1], comp[:, 2]  # Columnas relevantes de la matriz
+    scores_oportunidad = (malos_arr * 2) + (total_arr * 0.5) - (buenos_arr * 3)  # Vector de scores de oportunidad
+
+    min_oport = float(scores_oportunidad.min()) if scores_oportunidad.size else 0  # Mínimo del grupo
+    rango_oport = (float(np.ptp(scores_oportunidad)) if scores_oportunidad.size else 0.0) or 1.0  # Rango saneado: nunca cero
+
+    # --- CÁLCULO VECTORIZADO ---
+    # 1. Nota PRECIO (0-10): fórmula inversa, más barato = más nota (si todos valen igual, nota máxima)
+    nota_precio = np.where(rango_precio == 0, 10.0,  # Caso degenerado resuelto dentro del propio ufunc
+                           10 * (max_precio - precios) / (rango_precio or 1.0))  # Denominador saneado: sin rama Python
+
+    # 2. Nota CONECTIVIDAD (0-10)
+    nota_conec = 10 * (scores_transporte / max_transporte)  # Normalizamos sobre el máximo encontrado (regla de tres)
+
+    # 3. Nota OPORTUNIDAD (0-10)
+    nota_oport = 10 * ((scores_oportunidad - min_oport) / rango_oport)  # Normalizamos entre 0 y 10 usando el rango min-max
+
+    # --- PONDERACIÓN DINÁMICA (sin ramas Python) ---
+    # Fórmula A (con competencia): 40% Precio, 30% Oportunidad, 30% Conectividad
+    # Fórmula B (sin competencia): 50% Precio, 50% Conectividad, penalizado con -2 puntos
+    if TIENE_NUMEXPR:  # numexpr fusiona toda la mezcla en un único bucle multihilo sin temporales
+        nota_final = ne.evaluate(
+            "where(total > 0, 0.40*np_ + 0.30*no_ + 0.30*nc_, 0.50*np_ + 0.50*nc_ - 2.0)",
+            local_dict={'total': total_arr, 'np_': nota_precio, 'no_': nota_oport, 'nc_': nota_conec})
+    else:  # Mezcla clásica con np.where (un temporal por subexpresión)
+        nota_final = np.where(total_arr > 0,  # Máscara booleana: hay rivales en la zona (Total > 0)
+                              0.40 * nota_precio + 0.30 * nota_oport + 0.30 * nota_conec,  # Fórmula A
+                              0.50 * nota_precio + 0.50 * nota_conec - 2.0)  # Fórmula B
+
+    df['NOTA_FINAL'] = np.round(nota_final, 2)  # Redondeamos a 2 decimales e insertamos la columna en el DataFrame
     return df  # Devolvemos el DataFrame puntuado
 
+def crear_sesion_http():
+
+    ################################################################################
+    # Crea la sesión HTTP compartida de toda la pipeline. Con keep-alive las
+    # conexiones a Overpass/ArcGIS/CityBikes se reutilizan en vez de pagar
+    # DNS + TLS en cada petición, y los reintentos con backoff quedan
+    # centralizados aquí en lugar de repartidos por los módulos.
+    #
+    # RECIBE: Nada.
+    # DEVUELVE: requests.Session configurada con pool de 64 conexiones.
+    ################################################################################
+
+    sesion = requests.Session()  # Creamos la sesión con keep-alive activado por defecto
+    adaptador = HTTPAdapter(pool_connections=64, pool_maxsize=64,  # Pool amplio para los hilos de la pipeline
+                            max_retries=Retry(total=3, backoff_factor=0.5))  # 3 reintentos con espera creciente
+    sesion.mount('https://', adaptador)  # Aplicamos el pool a todas las URLs https
+    sesion.mount('http://', adaptador)  # Y también a las http (CityBikes)
+    return sesion  # Devolvemos la sesión lista para compartir
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "business_explorer")  # Carpeta de caché entre ejecuciones
+CACHE_TTL = 24 * 3600  # Caducidad de la caché en segundos (24 horas: los anuncios cambian poco en un día)
+
+def buscar_con_cache(ciudad, subtipo, operacion, presupuesto):
+
+    ################################################################################
+    # Envuelve p1.busqueda con una caché en disco: si el usuario repite la misma
+    # búsqueda (misma ciudad, tipo, operación y presupuesto) en menos de 24 horas
+    # —por ejemplo para probar otro negocio— reutilizamos el scraping anterior en
+    # vez de volver a lanzar el navegador, que es la etapa más lenta de todas.
+    #
+    # RECIBE: Los mismos parámetros que p1.busqueda.
+    # DEVUELVE: DataFrame de locales (de caché o recién scrapeado).
+    ################################################################################
+
+    clave = hashlib.sha1(f"{ciudad}|{subtipo}|{operacion}|{presupuesto}".encode()).hexdigest()  # Huella única de la búsqueda
+    ruta_cache = os.path.join(CACHE_DIR, f"p1_{clave}.pkl")  # Archivo de caché asociado a esta búsqueda
+
+    try:  # Intentamos leer la caché (si falla por lo que sea, simplemente scrapeamos)
+        if os.path.exists(ruta_cache) and (time.time() - os.path.getmtime(ruta_cache)) < CACHE_TTL:  # Existe y no ha caducado
+            df_cache = pd.read_pickle(ruta_cache)  # Recuperamos el DataFrame guardado
+            print(f"\n--- P1: Reutilizando búsqueda cacheada ({len(df_cache)} locales) ---")
+            return df_cache  # Devolvemos el resultado sin tocar la red
+    except Exception:  # Caché corrupta o ilegible
+        pass  # La ignoramos y regeneramos
+
+    df_1 = p1.busqueda(ciudad, subtipo, operacion, presupuesto)  # Ejecutamos el scraping real
+    if not df_1.empty:  # Solo cacheamos resultados útiles
+        try:  # El guardado de caché nunca debe tumbar el programa
+            os.makedirs(CACHE_DIR, exist_ok=True)  # Nos aseguramos de que la carpeta exista
+            df_1.to_pickle(ruta_cache)  # Guardamos el DataFrame completo (conserva las tuplas de coordenadas)
+        except Exception:  # Disco lleno, permisos, etc.
+            pass  # Seguimos sin caché
+    return df_1  # Devolvemos el resultado fresco
+
+def exportar_csv(df, ruta):
+
+    ################################################################################
+    # Exportación rápida a CSV sin pasar por los formateadores fila a fila de
+    # pandas (lentos con columnas object). El camino manual usa el csv.writer de
+    # la librería estándar (implementado en C, con el quoting resuelto) sobre un
+    # BufferedWriter de 1 MiB, de modo que los write(2) al disco salen en bloques
+    # grandes. Si la ruta termina en .gz, comprime al vuelo con gzip nivel 1.
+    #
+    # RECIBE: df (DataFrame final), ruta (str con la ruta destino).
+    # DEVUELVE: Nada (escribe el archivo en disco).
+    ################################################################################
+
+    if TIENE_PYARROW and not ruta.endswith('.gz'):  # CAMINO RÁPIDO: escritor C++ de Arrow (si está disponible)
+        try:  # Ante cualquier pega (tipos raros, etc.) caemos al escritor manual
+            pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), ruta)  # Conversión columnar + volcado nativo
+            return  # Archivo escrito: terminamos aquí
+        except Exception:  # Columna no convertible u otro problema de Arrow
+            pass  # Seguimos con el camino manual
+
+    if ruta.endswith('.gz'):  # Variante comprimida: mismo flujo pasado por gzip
+        crudo = gzip.open(ruta, 'wb', compresslevel=1)  # Nivel 1: compresión rápida, casi sin coste de CPU
+    else:
+        crudo = io.BufferedWriter(io.FileIO(ruta, 'wb'), buffer_size=1 << 20)  # Buffer explícito de 1 MiB: pocos syscalls
+
+    with io.TextIOWrapper(crudo, encoding='utf-8', newline='') as f:  # Capa de texto sobre el flujo binario
+        escritor = csv.writer(f)  # Escritor CSV en C con el quoting resuelto
+        escritor.writerow(df.columns)  # Línea de cabecera con los nombres de columna
+        escritor.writerows(df.itertuples(index=False, name=None))  # Todas las filas en una sola llamada C
+
 def main():
     
     ################################################################################
@@ -160,20 +367,37 @@ def main():
     
     # 2. EJECUCIÓN PIPELINE
     # P1: Búsqueda
-    df_1 = p1.busqueda(ciudad, subtipo, operacion, presupuesto)  # Llamamos al módulo de scraping
+    df_1 = buscar_con_cache(ciudad, subtipo, operacion, presupuesto)  # Scraping con caché de 24h entre ejecuciones
     if df_1.empty:  # Si no hay resultados
         print("No se encontraron locales con esos criterios. Fin del programa.")
         return  # Terminamos la ejecución
 
-    # P2: Competencia
-    df_2 = p2.busqueda_competencia(df_1, radio=500, negocio=negocio)  # Llamamos al módulo de competencia
-    
-    # P3: Reputación
-    df_3 = p3.analizar_reputacion(df_2)  # Llamamos al módulo de reputación online
-    
-    # P4: Transporte
-    df_4 = p4.analizar_transporte(df_3, ciudad=ciudad)  # Llamamos al módulo de transporte
-    
+    sesion = crear_sesion_http()  # Sesión HTTP compartida con pool de conexiones para toda la pipeline
+
+    # P2+P3 y P4 en PARALELO: ambas ramas solo dependen de las coordenadas de P1,
+    # y como las tres etapas son puro I/O de red (APIs, scraping) los hilos liberan el GIL
+    def rama_competencia(df):  # Rama A: competencia (P2) seguida de reputación (P3)
+        df_2 = p2.busqueda_competencia(df, radio=500, negocio=negocio, session=sesion)  # Llamamos al módulo de competencia
+        return p3.analizar_reputacion(df_2)  # Encadenamos el módulo de reputación online
+
+    async def ejecutar_ramas(df):  # Orquestador asíncrono: lanza ambas ramas y espera a las dos de golpe
+        return await asyncio.gather(  # gather ejecuta las corrutinas en paralelo y conserva el orden de resultados
+            asyncio.to_thread(rama_competencia, df),  # Rama A: P2 -> P3 (módulos síncronos en hilo aparte)
+            asyncio.to_thread(p4.analizar_transporte, df, ciudad, sesion),  # Rama B: P4 (solo necesita coordenadas)
+        )
+
+    df_3, df_transporte = asyncio.run(ejecutar_ramas(df_1))  # Arrancamos el bucle de eventos y esperamos ambas ramas
+    df_4 = df_3  # Partimos del DataFrame con competencia y reputación
+    df_4['NUM_TRANS_PUB'] = df_transporte['NUM_TRANS_PUB']  # Fusionamos la columna de transporte (mismo índice)
+
+    # CONVERSIÓN AoS -> SoA: troceamos las columnas de tuplas (dtype object) en columnas
+    # escalares float32 contiguas, que es lo que NumPy puede vectorizar de verdad
+    df_4[['COMP_TOTAL', 'COMP_BUENOS', 'COMP_MALOS', 'COMP_MEDIA']] = pd.DataFrame(
+        df_4['NUM_COMPETENCIA'].tolist(), index=df_4.index, dtype='float32')  # Descomponemos (Total, Buenos, Malos, Media)
+    df_4[['BUS', 'METRO', 'BICI']] = pd.DataFrame(
+        df_4['NUM_TRANS_PUB'].tolist(), index=df_4.index, dtype='float32')  # Descomponemos (Bus, Metro, Bici)
+    df_4 = df_4.drop(columns=['NUM_COMPETENCIA', 'NUM_TRANS_PUB'])  # Las tuplas originales ya no hacen falta
+
     # 3. CÁLCULO DE NOTA FINAL
     df_final = calcular_puntuacion(df_4, presupuesto)  # Ejecutamos el algoritmo de decisión
     
@@ -187,7 +411,7 @@ def main():
         nombre_archivo = "resultados_finales_ranking.csv"  # Definimos el nombre del archivo
         ruta_completa = os.path.join(ruta_descargas, nombre_archivo)  # Unimos ruta y nombre
         
-        df_final.to_csv(ruta_completa, index=False)  # Guardamos el CSV sin índice numérico
+        exportar_csv(df_final, ruta_completa)  # Guardamos el CSV con la ruta rápida (sin índice numérico)
         print(f"\nResultados guardados EXITOSAMENTE en:\n   {ruta_completa}")
         
     except PermissionError:  # Capturamos error si el archivo está abierto por el usuario
@@ -196,38 +420,29 @@ def main():
     except Exception as e:  # Capturamos cualquier otro error de ruta
         # Fallback: Si falla Descargas, intenta en la carpeta local
         print(f"\nNo se encontró la carpeta Descargas ({e}). Guardando en carpeta actual...")
-        df_final.to_csv("resultados_finales_ranking.csv", index=False)  # Guardamos en la carpeta del script como respaldo
+        exportar_csv(df_final, "resultados_finales_ranking.csv")  # Guardamos en la carpeta del script como respaldo
     
     # 5. PRINT TOP 5
     print("\n" + "="*60)
     print("¡¡¡ TOP 5 LOCALES RECOMENDADOS !!!")
     print("="*60 + "\n")
     
-    top_5 = df_final.head(5)  # Seleccionamos las 5 primeras filas
-    contador = 1  # Inicializamos contador visual
-    
-    for idx, row in top_5.iterrows():  # Iteramos sobre el top 5 para mostrar detalles
-        comp = row['NUM_COMPETENCIA']  # Extraemos tupla de competencia
-        trans = row['NUM_TRANS_PUB']  # Extraemos tupla de transporte
-        
-        print(f"LOCAL Nº {contador}: {row['NOMBRE']}")
-        print(f"Dirección: {row['DIRECCION']}, {row['CODIGO_POSTAL']}")
-        print(f"Precio: {row['PRECIO']} €")
-        print(f"Nota final: {row['NOTA_FINAL']} sobre 10")
-        
-        print(f"Nº de locales de competencia cerca: {comp[0]}")
-        print(f"Nº de locales con buenas reseñas: {comp[1]}")
-        print(f"Nº de locales con malas reseñas: {comp[2]}")
-        
-        media_str = str(comp[3]) if comp[3] > 0 else "N/A (Sin datos)"  # Formateamos la nota media para que no salga 0.0 si no hay
-        print(f"Nota media de la competencia cerca: {media_str}/5")
-        
-        print(f"Nº de paradas de bus cerca: {trans[0]}")
-        print(f"Nº de paradas de metro/tren cerca: {trans[1]}")
-        print(f"Nº de paradas de bici cerca: {trans[2]}")
-        
-        print("-" * 40 + "\n")
-        contador += 1  # Incrementamos contador
+    top_5 = df_final.nlargest(5, 'NOTA_FINAL').copy()  # Selección parcial O(N): evita reordenar todo solo para quedarnos con 5
+
+    # Pre-formateo vectorizado de las columnas de presentación (fuera del bucle de impresión)
+    columnas_enteras = ['COMP_TOTAL', 'COMP_BUENOS', 'COMP_MALOS', 'BUS', 'METRO', 'BICI']  # Contadores que se muestran como enteros
+    top_5[columnas_enteras] = top_5[columnas_enteras].astype(int)  # Conversión de golpe en vez de 6 int() por fila
+    medias = top_5['COMP_MEDIA'].round(2)  # Redondeamos la media una sola vez
+    top_5['MEDIA_STR'] = np.where(medias > 0, medias.astype(str), "N/A (Sin datos)")  # Texto final (que no salga 0.0 si no hay datos)
+
+    for contador, row in enumerate(top_5.itertuples(index=False), 1):  # itertuples: namedtuples ligeros, sin construir Series por fila
+        # Un único format sobre la plantilla y una única escritura por local (en vez de ~12 prints)
+        sys.stdout.write(PLANTILLA_LOCAL.format(
+            n=contador, nombre=row.NOMBRE, direccion=row.DIRECCION, cp=row.CODIGO_POSTAL,
+            precio=row.PRECIO, nota=row.NOTA_FINAL,
+            comp_total=row.COMP_TOTAL, comp_buenos=row.COMP_BUENOS, comp_malos=row.COMP_MALOS,
+            media=row.MEDIA_STR, bus=row.BUS, metro=row.METRO, bici=row.BICI))
+    sys.stdout.flush()  # Un único flush al terminar el informe completo
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
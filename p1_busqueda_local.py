@@ -31,32 +31,73 @@
 from selenium import webdriver  # Controla el navegador web (abrir Chrome, navegar, etc.)
 from selenium.webdriver.common.by import By  # Permite buscar elementos en la web (por ID, clase, CSS, etc.)
 from selenium.webdriver.common.keys import Keys  # Simula pulsaciones de teclado (Enter, borrar, escribir)
-from selenium.webdriver.support.ui import Select  # Maneja los menús desplegables de las webs
+from selenium.webdriver.support.ui import Select, WebDriverWait  # Desplegables y esperas explícitas hasta que el DOM esté listo
+from selenium.webdriver.support import expected_conditions as EC  # Condiciones de espera (elemento clicable, presente...)
 from bs4 import BeautifulSoup  # Analiza el HTML de la página para extraer datos (scraping puro)
+# selectolax es OPCIONAL: parser HTML5 en C (lexbor) mucho más rápido que html.parser
+try:
+    from selectolax.lexbor import LexborHTMLParser  # Motor nativo de parseo HTML
+    TIENE_SELECTOLAX = True  # Podemos usar el camino rápido de parseo
+except ImportError:  # Si selectolax no está instalado
+    TIENE_SELECTOLAX = False  # BeautifulSoup de siempre
 from geopy.geocoders import Nominatim, ArcGIS  # Convierte direcciones postales en coordenadas (Latitud, Longitud)
+from geopy.adapters import RequestsAdapter  # Adaptador HTTP de geopy basado en requests (admite pool propio)
 import pandas as pd  # Organiza los datos en tablas (DataFrames) y permite guardar en Excel/CSV
+import numpy as np  # Materializa las columnas del DataFrame final sin inferencia fila a fila
+import requests  # Petición única por lotes al servicio REST de geocodificación de ArcGIS
+from requests.adapters import HTTPAdapter, Retry  # Pool de conexiones keep-alive para los geocodificadores
+import json  # Serializa el lote de direcciones al formato que espera la API
 import time  # Controla el tiempo (hacer pausas para que cargue la web)
-import re  # "Expresiones Regulares": busca y limpia patrones de texto (quitar símbolos, buscar números)
+# "Expresiones Regulares": busca y limpia patrones de texto (quitar símbolos, buscar números).
+# Si la librería `regex` está instalada la usamos como sustituta directa: misma API pero
+# inmune al retroceso catastrófico en títulos de anuncio malformados; si no, re de siempre
+try:
+    import regex as re  # Motor alternativo sin degradación O(n²) en entradas patológicas
+except ImportError:  # Si `regex` no está instalada
+    import re  # El módulo estándar funciona exactamente igual para nuestros patrones
 import random  # Genera números aleatorios (útil para tiempos de espera variables y parecer humano)
+import functools  # Caché LRU para no repetir geocodificaciones de la misma dirección
+import atexit  # Cierra el Chrome persistente al terminar el programa
+from bisect import bisect_right  # Búsqueda binaria en C sobre las opciones de precio ordenadas
+from decimal import Decimal  # Conversión exacta de precios con separadores españoles
+from concurrent.futures import ThreadPoolExecutor  # Geocodificación de varias tarjetas en paralelo (I/O de red)
+
+# Patrones precompilados UNA sola vez al importar el módulo: evita el coste de
+# compilación/búsqueda en caché de re en cada una de las N tarjetas procesadas
+PATRON_ESPACIOS = re.compile(r'\s+')  # Espacios múltiples
+PATRON_DIGITOS = re.compile(r'[0-9]')  # Dígitos sueltos (limpieza drástica de direcciones)
+PATRON_PRECIO = re.compile(r'([\d.,]+)\s?€')  # Precio con separadores españoles ("1.250.000" o "1.250,50") y símbolo €
+
+# Todas las limpiezas de dirección fusionadas en UNA alternativa con grupos con
+# nombre: un único barrido del texto en vez de seis pasadas independientes
+PATRON_LIMPIEZA = re.compile(
+    r"(?P<prefijo>^(?:local comercial|oficina|edificio|nave|almacén|local).*?\s+en\s+)"  # Prefijos de anuncio
+    r"|(?P<carrer>calle\s+carrer)"  # Redundancia "Calle Carrer"
+    r"|(?P<avenida>calle\s+avenida)"  # Redundancia "Calle Avenida"
+    r"|(?P<comillas>'')"  # Comillas dobladas
+    r"|(?P<num>nº\.?)"  # Abreviatura de número
+    r"|(?P<sn>s/n)"  # "sin número"
+    r"|(?P<paren>\([^)]*\))",  # Paréntesis y su contenido
+    re.IGNORECASE)
+REEMPLAZOS_LIMPIEZA = {'prefijo': '', 'carrer': 'Carrer', 'avenida': 'Avenida',  # Qué poner en el hueco de cada grupo
+                       'comillas': "'", 'num': '', 'sn': '', 'paren': ''}
+
+# Valores de filtro de precio que ofrece pisos.com, ya ordenados: así el ajuste
+# al presupuesto es una bisección en C en vez de un bucle lineal con ramas
+_OPC_ALQUILER = (150, 250, 350, 450, 600, 750, 900, 1100, 1300, 1500,   # posibles valores de filtro del alquiler
+                 1800, 2300, 3000, 5000, 10000, 20000, 30000)
+_OPC_VENTA = (10000, 30000, 60000, 90000, 120000, 150000, 180000,   # posibles valores de filtro de compra
+              210000, 240000, 270000, 300000, 360000, 420000, 480000,
+              600000, 1050000, 2050000, 3050000, 4050000, 6000000,
+              10000000, 20000000)
 
 def calcular_filtro_precio(presupuesto, es_alquiler):  # Define la función `calcular_filtro_precio`
     """Calcula el valor del precio más cercano al presupuesto."""  # Instrucción ejecutable
-    if es_alquiler:     # posibles valores de filtro del alquiler en pisos.com
-        opciones = [150, 250, 350, 450, 600, 750, 900, 1100, 1300, 1500,   # Asigna un valor a una variable
-                    1800, 2300, 3000, 5000, 10000, 20000, 30000]  # Instrucción ejecutable
-    else:               # posibles valores de filtro de compra en pisos.com
-        opciones = [10000, 30000, 60000, 90000, 120000, 150000, 180000,   # Asigna un valor a una variable
-                    210000, 240000, 270000, 300000, 360000, 420000, 480000,   # Instrucción ejecutable
-                    600000, 1050000, 2050000, 3050000, 4050000, 6000000,   # Instrucción ejecutable
-                    10000000, 20000000]  # Instrucción ejecutable
-    elegido = opciones[0]  # Asigna un valor a una variable
-    for opcion in opciones:  # Bucle `for`: itera sobre una secuencia
-        if opcion <= presupuesto:  # Asigna un valor a una variable
-            elegido = opcion  # Asigna un valor a una variable
-        else:  # Instrucción ejecutable
-            break  # Instrucción ejecutable
-    return str(elegido)  # Devuelve el resultado desde la función
+    opciones = _OPC_ALQUILER if es_alquiler else _OPC_VENTA  # Asigna un valor a una variable
+    idx = max(0, bisect_right(opciones, presupuesto) - 1)  # Mayor opción <= presupuesto (o la mínima si ninguna)
+    return str(opciones[idx])  # Devuelve el resultado desde la función
 
+@functools.lru_cache(maxsize=2048)  # Direcciones repetidas (mismo edificio) se limpian una sola vez
 def limpiar_direccion(texto_sucio):  # Define la función `limpiar_direccion`
     ################################################################################
     # Aplica una serie de limpiezas agresivas mediante expresiones regulares sobre el
@@ -66,34 +107,23 @@ def limpiar_direccion(texto_sucio):  # Define la función `limpiar_direccion`
     # una cadena limpia que aumente la tasa de éxito de los geocodificadores.
     ################################################################################
 
-    # 1. Eliminar prefijos de anuncio
-    patron_inicio = r"^(local comercial|oficina|edificio|nave|almacén|local).*?\s+en\s+"   # Asigna un valor a una variable
-    texto = re.sub(patron_inicio, "", texto_sucio, flags=re.IGNORECASE).strip()   # Asigna un valor a una variable
-    
-    # 2. Corregir redundancias típicas (Ej: "Calle Carrer")
-    texto = re.sub(r'calle\s+carrer', 'Carrer', texto, flags=re.IGNORECASE)   # Asigna un valor a una variable
-    texto = re.sub(r'calle\s+avenida', 'Avenida', texto, flags=re.IGNORECASE)   # Asigna un valor a una variable
-    
-    # 3. Limpiar caracteres sucios (dobles comillas, nº, s/n)
-    texto = texto.replace("''", "'")   # Asigna un valor a una variable
-    texto = re.sub(r'nº\.?', '', texto, flags=re.IGNORECASE)   # Asigna un valor a una variable
-    texto = re.sub(r's/n', '', texto, flags=re.IGNORECASE)     # Asigna un valor a una variable
-    
-    # 4. Quitar paréntesis y su contenido (suelen ser zonas o aclaraciones que confunden)
-    texto = re.sub(r'\(.*?\)', '', texto).strip()   # Asigna un valor a una variable
-    
-    # 5. Quitar espacios múltiples y comas al inicio/final
-    texto = re.sub(r'\s+', ' ', texto).strip(" ,.-")   # Asigna un valor a una variable
-    
+    # 1. Un ÚNICO barrido que resuelve todas las limpiezas a la vez: el grupo que
+    # haya casado en cada coincidencia decide el reemplazo correspondiente
+    texto = PATRON_LIMPIEZA.sub(lambda m: REEMPLAZOS_LIMPIEZA[m.lastgroup], texto_sucio)
+
+    # 2. Colapsar espacios múltiples (incluidos los huecos que deja el paso 1) y recortar bordes
+    texto = PATRON_ESPACIOS.sub(' ', texto).strip(" ,.-")   # Colapsamos espacios y recortamos bordes
+
     return texto   # Devuelve el resultado desde la función
 
+# Tabla palabra clave -> subtipo normalizado, en el mismo orden de prioridad que
+# tenía la cadena de ifs: un único recorrido de la tupla en vez de cuatro ramas
+_MAPA_SUBTIPO = (("almacen", "nave"), ("comercial", "local"),
+                 ("oficina", "oficina"), ("edificio", "edificio"))
+
 def normalizar_subtipo(subtipo_input):  # Define la función `normalizar_subtipo`
     s = subtipo_input.lower()  # Asigna un valor a una variable
-    if "almacen" in s: return "nave"  # Instrucción ejecutable
-    if "comercial" in s: return "local"  # Instrucción ejecutable
-    if "oficina" in s: return "oficina"  # Instrucción ejecutable
-    if "edificio" in s: return "edificio"  # Instrucción ejecutable
-    return "local"  # Devuelve el resultado desde la función
+    return next((v for k, v in _MAPA_SUBTIPO if k in s), "local")  # Primera palabra clave que aparezca, o "local"
 
 def geocodificar_inteligente(direccion, ciudad, geo_osm, geo_arcgis):  # Define la función `geocodificar_inteligente`
     
@@ -107,22 +137,27 @@ def geocodificar_inteligente(direccion, ciudad, geo_osm, geo_arcgis):  # Define
         f"{direccion}, España",                       # Instrucción ejecutable
     ]  # Instrucción ejecutable
     
-    # ESTRATEGIA A: Intentar con ArcGIS 
+    # ESTRATEGIA A: Intentar con ArcGIS
+    arcgis_respondio = False   # Distingue "sin resultado" fiable de servicio caído
     for q in busquedas:   # Bucle `for`: itera sobre una secuencia
         try:   # Inicio de bloque `try` para capturar excepciones
             loc = geo_arcgis.geocode(q, timeout=5)   # Asigna un valor a una variable
+            arcgis_respondio = True   # El servicio contestó: su "no hay resultado" es definitivo
             if loc: return loc.latitude, loc.longitude   # Instrucción ejecutable
-        except: pass   # Captura una excepción si ocurre dentro del `try`
+        except: pass   # Timeout o red caída: ArcGIS no llegó a pronunciarse
 
-    # ESTRATEGIA B: Intentar con Nominatim (OSM)
-    for q in busquedas:   # Bucle `for`: itera sobre una secuencia
-        try:   # Inicio de bloque `try` para capturar excepciones
-            loc = geo_osm.geocode(q, timeout=5)   # Asigna un valor a una variable
-            if loc: return loc.latitude, loc.longitude   # Instrucción ejecutable
-        except: pass   # Captura una excepción si ocurre dentro del `try`
+    # ESTRATEGIA B: Intentar con Nominatim (OSM) SOLO si ArcGIS no estaba accesible.
+    # Si ArcGIS respondió sin resultados la dirección no parsea: repetirla contra
+    # Nominatim gasta hasta 10s de red para fallar igual; saltamos a la limpieza
+    if not arcgis_respondio:   # Instrucción ejecutable
+        for q in busquedas:   # Bucle `for`: itera sobre una secuencia
+            try:   # Inicio de bloque `try` para capturar excepciones
+                loc = geo_osm.geocode(q, timeout=5)   # Asigna un valor a una variable
+                if loc: return loc.latitude, loc.longitude   # Instrucción ejecutable
+            except: pass   # Captura una excepción si ocurre dentro del `try`
 
     # ESTRATEGIA C: Limpieza Drástica (Solo nombre de calle, sin números)
-    solo_letras = re.sub(r'[0-9]', '', direccion).strip(" ,")   # Asigna un valor a una variable
+    solo_letras = PATRON_DIGITOS.sub('', direccion).strip(" ,")   # Patrón precompilado: quitamos todos los dígitos
     if len(solo_letras) > 3:   # Instrucción ejecutable
         q_backup = f"{solo_letras}, {ciudad}, España"   # Asigna un valor a una variable
         try:   # Inicio de bloque `try` para capturar excepciones
@@ -132,49 +167,248 @@ def geocodificar_inteligente(direccion, ciudad, geo_osm, geo_arcgis):  # Define
     
     return 0.0, 0.0   # Devuelve el resultado desde la función
 
-def busqueda(ciudad, subtipo, operacion, presupuesto_max):  # Define la función `busqueda`
+class _AdaptadorConPool(RequestsAdapter):
+    ################################################################################
+    # Adaptador de geopy cuyo session monta un pool de conexiones keep-alive: sin
+    # él, cada geocode() paga TCP + TLS de cero (~3 RTT); con el pool, las llamadas
+    # sucesivas al mismo servicio reutilizan el socket ya abierto.
+    ################################################################################
+    def __init__(self, *args, **kwargs):  # Instrucción ejecutable
+        super().__init__(*args, **kwargs)  # Sesión requests creada por geopy
+        adaptador = HTTPAdapter(pool_connections=8, pool_maxsize=16,  # Pool pequeño: 4 hilos geocodificando
+                                max_retries=Retry(total=2, backoff_factor=0.3))  # Reintentos con espera creciente
+        self.session.mount("https://", adaptador)  # Instrucción ejecutable
+        self.session.mount("http://", adaptador)  # Instrucción ejecutable
+        self.session.headers['Connection'] = 'keep-alive'  # Mantener el socket abierto entre peticiones
+
+# Geocodificadores como singletons del módulo: se crean UNA vez y los comparte
+# la caché de abajo, en vez de instanciar un par nuevo en cada llamada a busqueda()
+_GEO_OSM = None  # Nominatim perezoso (se crea en el primer uso)
+_GEO_ARCGIS = None  # ArcGIS perezoso (se crea en el primer uso)
+
+def _obtener_geolocalizadores():  # Define la función `_obtener_geolocalizadores`
+    global _GEO_OSM, _GEO_ARCGIS  # Instancias compartidas a nivel de módulo
+    if _GEO_OSM is None:   # Primera llamada: inicializamos ambos servicios
+        _GEO_OSM = Nominatim(user_agent=f"geo_app_{random.randint(1000,9999)}", adapter_factory=_AdaptadorConPool)   # Asigna un valor a una variable
+        _GEO_ARCGIS = ArcGIS(adapter_factory=_AdaptadorConPool)   # Asigna un valor a una variable
+    return _GEO_OSM, _GEO_ARCGIS   # Devuelve el resultado desde la función
+
+@functools.lru_cache(maxsize=4096)  # Varios anuncios del mismo edificio comparten dirección: solo la primera paga la red
+def geocodificar_cacheado(direccion, ciudad):  # Define la función `geocodificar_cacheado`
 
     ################################################################################
-    # Realiza un scraping en pisos.com para extraer locales según los filtros 
+    # Envoltorio con caché LRU sobre geocodificar_inteligente: la clave es la pareja
+    # (dirección limpia, ciudad), de modo que direcciones repetidas dentro de la
+    # misma ejecución devuelven sus coordenadas al instante sin tocar la red.
+    #
+    # RECIBE: direccion (str ya limpia), ciudad (str).
+    # DEVUELVE: Tupla (lat, lon), o (0.0, 0.0) si ninguna estrategia acierta.
     ################################################################################
 
-    print(f"\n--- INICIANDO P1: Búsqueda de '{subtipo}' en '{ciudad}' ({operacion}) hasta {presupuesto_max}€ ---")  # Instrucción ejecutable
+    geo_osm, geo_arcgis = _obtener_geolocalizadores()   # Singletons compartidos del módulo
+    return geocodificar_inteligente(direccion, ciudad, geo_osm, geo_arcgis)   # Devuelve el resultado desde la función
+
+def _extraer_ofertas_jsonld(textos_script):
+
+    ################################################################################
+    # Recorre los bloques <script type="application/ld+json"> de la página y extrae
+    # las ofertas estructuradas (Product/Offer) que publica pisos.com: precio ya
+    # tipado y dirección postal, sin necesidad de regex ni limpieza de texto.
+    #
+    # RECIBE: textos_script (iterable de str con el contenido de cada bloque).
+    # DEVUELVE: dict {url del anuncio: (precio float, dirección o None)}.
+    ################################################################################
+
+    ofertas = {}   # Un registro por anuncio con datos estructurados
+    for texto in textos_script:   # Bucle `for`: itera sobre una secuencia
+        try: datos = json.loads(texto)   # El bloque puede ser un objeto o una lista anidada
+        except Exception: continue   # JSON malformado: lo ignoramos sin romper el parseo
+        pila = [datos]   # Recorrido iterativo de la estructura (dicts y listas anidadas)
+        while pila:   # Instrucción ejecutable
+            nodo = pila.pop()   # Asigna un valor a una variable
+            if isinstance(nodo, dict):   # Instrucción ejecutable
+                oferta = nodo.get('offers')   # Los anuncios exponen su precio en offers.price
+                url = nodo.get('url')   # La URL enlaza la oferta con su tarjeta
+                if url and isinstance(oferta, dict) and oferta.get('price') is not None:   # Oferta completa
+                    try:   # Inicio de bloque `try` para capturar excepciones
+                        direccion = (nodo.get('address') or {}).get('streetAddress')   # Dirección estructurada (puede faltar)
+                        ofertas[url] = (float(oferta['price']), direccion)   # Precio ya numérico
+                    except Exception: pass   # Precio no convertible: la tarjeta usará el texto
+                pila.extend(nodo.values())   # Seguimos bajando por la estructura
+            elif isinstance(nodo, list):   # Instrucción ejecutable
+                pila.extend(nodo)   # Instrucción ejecutable
+    return ofertas   # Devuelve el resultado desde la función
 
+# Selector unión de los tres campos de una tarjeta: permite extraerlos con UN solo
+# recorrido del subárbol en vez de una consulta independiente por campo
+SELECTOR_CAMPOS = ".ad-preview__title, .ad-preview__price, .ad-preview__location"
+
+def parsear_tarjetas(html):
+
+    ################################################################################
+    # Extrae de cada tarjeta de anuncio los campos crudos que necesita la fase de
+    # candidatos, con el motor de parseo más rápido disponible: selectolax (C)
+    # si está instalado, BeautifulSoup como respaldo. Ambos caminos devuelven la
+    # misma estructura, así que el resto del módulo no distingue el motor.
+    # Si la página publica datos estructurados JSON-LD, cada tarjeta incorpora
+    # además el precio tipado y la dirección postal oficiales del anuncio.
+    #
+    # RECIBE: html (str con el page_source completo de la página de resultados).
+    # DEVUELVE: Lista de dicts {titulo, href, texto_precio, ubicacion, texto,
+    #           precio_ld, direccion_ld}.
+    ################################################################################
+
+    tarjetas = []   # Lista de tarjetas ya reducidas a los campos útiles
+    if TIENE_SELECTOLAX:   # CAMINO RÁPIDO: árbol construido por lexbor en C
+        arbol = LexborHTMLParser(html)   # Un único árbol para tarjetas y bloques JSON-LD
+        ofertas = _extraer_ofertas_jsonld(s.text() for s in arbol.css('script[type="application/ld+json"]'))
+        for nodo in arbol.css("div.ad-preview"):   # Seleccionamos todas las tarjetas
+            # Un ÚNICO recorrido del subárbol con el selector unión, en vez de tres
+            # css_first independientes que vuelven a visitar los mismos nodos
+            tag_titulo = tag_precio = tag_ubicacion = None   # Se queda la primera aparición de cada campo
+            for sub in nodo.css(SELECTOR_CAMPOS):   # Una pasada, los tres campos
+                clases = sub.attributes.get('class') or ''   # Clase del nodo casado
+                if tag_titulo is None and 'ad-preview__title' in clases: tag_titulo = sub   # Instrucción ejecutable
+                elif tag_precio is None and 'ad-preview__price' in clases: tag_precio = sub   # Instrucción ejecutable
+                elif tag_ubicacion is None and 'ad-preview__location' in clases: tag_ubicacion = sub   # Instrucción ejecutable
+            if tag_titulo is None: continue   # Sin título no hay anuncio procesable
+            tarjetas.append({
+                "titulo": tag_titulo.text().strip(),
+                "href": tag_titulo.attributes.get('href'),
+                "texto_precio": tag_precio.text().strip() if tag_precio else "",
+                "ubicacion": tag_ubicacion.text().strip() if tag_ubicacion else None,
+                "texto": nodo.text(),   # Texto completo para el patrón de precio de respaldo
+            })
+    else:   # CAMINO CLÁSICO: BeautifulSoup con el parser de la librería estándar
+        soup = BeautifulSoup(html, "html.parser")   # Construimos el árbol HTML
+        ofertas = _extraer_ofertas_jsonld(s.string or "" for s in soup.find_all("script", type="application/ld+json"))
+        for nodo in soup.find_all("div", class_="ad-preview"):   # Seleccionamos todas las tarjetas
+            # Mismo esquema de pasada única: select con el selector unión
+            tag_titulo = tag_precio = tag_ubicacion = None   # Se queda la primera aparición de cada campo
+            for sub in nodo.select(SELECTOR_CAMPOS):   # Una pasada, los tres campos
+                clases = sub.get('class') or []   # Lista de clases del nodo casado
+                if tag_titulo is None and 'ad-preview__title' in clases: tag_titulo = sub   # Instrucción ejecutable
+                elif tag_precio is None and 'ad-preview__price' in clases: tag_precio = sub   # Instrucción ejecutable
+                elif tag_ubicacion is None and 'ad-preview__location' in clases: tag_ubicacion = sub   # Instrucción ejecutable
+            if tag_titulo is None: continue   # Sin título no hay anuncio procesable
+            tarjetas.append({
+                "titulo": tag_titulo.text.strip(),
+                "href": tag_titulo.get('href'),
+                "texto_precio": tag_precio.text.strip() if tag_precio else "",
+                "ubicacion": tag_ubicacion.text.strip() if tag_ubicacion else None,
+                "texto": nodo.text,   # Texto completo para el patrón de precio de respaldo
+            })
+    # Casamos cada tarjeta con su oferta estructurada a través de la URL del anuncio:
+    # si hay dato JSON-LD la fase de candidatos se ahorra regex y limpieza de texto
+    for tarjeta in tarjetas:   # Bucle `for`: itera sobre una secuencia
+        href = tarjeta["href"] or ""   # Enlace relativo de la tarjeta
+        precio_ld, direccion_ld = next(((p, d) for url, (p, d) in ofertas.items() if href and href in url),
+                                       (None, None))   # Primera oferta cuya URL contenga el enlace
+        tarjeta["precio_ld"] = precio_ld   # Precio ya numérico (o None si no hay dato estructurado)
+        tarjeta["direccion_ld"] = direccion_ld   # Dirección postal estructurada (o None)
+    return tarjetas   # Misma estructura con cualquiera de los dos motores
+
+URL_ARCGIS_LOTE = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/geocodeAddresses"  # Endpoint por lotes
+UMBRAL_SCORE_LOTE = 80  # Confianza mínima (0-100) para aceptar un resultado del lote sin reintento individual
+
+def geocodificar_lote(direcciones, ciudad):
+
+    ################################################################################
+    # Geocodifica TODAS las direcciones en una única petición POST al servicio
+    # geocodeAddresses de ArcGIS, en vez de una petición HTTPS por dirección.
+    # Solo acepta los resultados con score alto; el resto se deja para que el
+    # camino individual (ArcGIS + Nominatim) los reintente con más estrategias.
+    #
+    # RECIBE: direcciones (lista de str limpias), ciudad (str).
+    # DEVUELVE: dict {índice en la lista: (lat, lon)} con los aciertos fiables.
+    ################################################################################
+
+    registros = [{"attributes": {"OBJECTID": i, "SingleLine": f"{d}, {ciudad}, España"}}   # Un registro por dirección
+                 for i, d in enumerate(direcciones)]   # El OBJECTID nos permite recolocar cada respuesta
+    try:   # Un fallo del lote no es crítico: el camino individual lo cubre
+        resp = requests.post(URL_ARCGIS_LOTE,   # Una única petición con todo el lote
+                             data={'f': 'json', 'addresses': json.dumps({"records": registros})},   # Payload JSON del servicio
+                             timeout=30)   # Margen amplio: es una sola petición grande
+        if resp.status_code == 200:   # Respuesta correcta del servicio
+            aciertos = {}   # Diccionario de resultados fiables
+            for loc in resp.json().get('locations', []):   # Recorremos las ubicaciones devueltas
+                attrs = loc.get('attributes', {})   # Atributos de la respuesta (incluye el identificador)
+                oid = attrs.get('ResultID', attrs.get('OBJECTID'))   # El servicio devuelve el id como ResultID
+                punto = loc.get('location') or {}   # Coordenadas del resultado
+                if oid is not None and loc.get('score', 0) >= UMBRAL_SCORE_LOTE and punto:   # Solo aciertos con confianza alta
+                    aciertos[oid] = (punto.get('y'), punto.get('x'))   # ArcGIS da x=lon, y=lat
+            return aciertos   # Devolvemos los aciertos del lote
+    except Exception as e:   # Error de red o de parseo del lote
+        print(f"  Lote ArcGIS no disponible ({e}). Geocodificando una a una...")
+    return {}   # Sin lote: todas las direcciones irán por el camino individual
+
+def _construir_opciones():  # Define la función `_construir_opciones`
     options = webdriver.ChromeOptions()   # Asigna un valor a una variable
     options.add_argument("--headless")    # Instrucción ejecutable
     options.add_argument("--window-size=1920,1080")    # Asigna un valor a una variable
     options.add_argument("--log-level=3")    # Asigna un valor a una variable
     ua = f"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{random.randint(90,110)}.0.0.0 Safari/537.36"   # Asigna un valor a una variable
     options.add_argument(f"user-agent={ua}")   # Asigna un valor a una variable
+    # Solo leemos el marcado de las tarjetas: bloqueamos imágenes y notificaciones
+    # para no descargar miniaturas ni píxeles de seguimiento (≈80% de los bytes).
+    # El CSS se mantiene activo porque is_displayed() depende de los estilos
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,   # Sin imágenes
+        "profile.default_content_setting_values.notifications": 2,   # Sin avisos de notificaciones
+    })   # Instrucción ejecutable
+    options.add_argument("--blink-settings=imagesEnabled=false")   # Refuerzo del bloqueo a nivel del motor de render
+    options.add_argument("--disable-features=IsolateOrigins,site-per-process")   # Un solo proceso de render: menos arranques
+    return options   # Devuelve el resultado desde la función
+
+# Chrome persistente: arrancar el navegador y el handshake de DevTools cuestan
+# ~1-2s por llamada, así que reutilizamos una única instancia entre búsquedas
+_DRIVER = None  # Instancia compartida (se crea en el primer uso)
+
+def _obtener_driver():  # Define la función `_obtener_driver`
+    global _DRIVER  # Instancia compartida a nivel de módulo
+    if _DRIVER is None:   # Primera búsqueda: arrancamos Chrome una única vez
+        _DRIVER = webdriver.Chrome(options=_construir_opciones())   # Asigna un valor a una variable
+    return _DRIVER   # Devuelve el resultado desde la función
+
+def _cerrar_driver():  # Define la función `_cerrar_driver`
+    if _DRIVER is not None:   # Solo si llegó a arrancarse
+        try: _DRIVER.quit()   # Cierre ordenado del navegador
+        except: pass   # Captura una excepción si ocurre dentro del `try`
+
+atexit.register(_cerrar_driver)  # El Chrome compartido se cierra al salir del programa
+
+def busqueda(ciudad, subtipo, operacion, presupuesto_max):  # Define la función `busqueda`
+
+    ################################################################################
+    # Realiza un scraping en pisos.com para extraer locales según los filtros
+    ################################################################################
+
+    print(f"\n--- INICIANDO P1: Búsqueda de '{subtipo}' en '{ciudad}' ({operacion}) hasta {presupuesto_max}€ ---")  # Instrucción ejecutable
+
+    driver = _obtener_driver()   # Chrome reutilizado: sin coste de arranque en búsquedas sucesivas
 
-    driver = webdriver.Chrome(options=options)   # Asigna un valor a una variable
-    
     resultados_dict = {}   # Asigna un valor a una variable
-    
-    # Inicializamos DOS geocodificadores
-    geolocator_osm = Nominatim(user_agent=f"geo_app_{random.randint(1000,9999)}")   # Asigna un valor a una variable
-    geolocator_arcgis = ArcGIS()   # Asigna un valor a una variable
-    
+
     try:   # Inicio de bloque `try` para capturar excepciones
         driver.get("https://www.pisos.com/")    # Instrucción ejecutable
-        time.sleep(2)   # Instrucción ejecutable
-        try: driver.find_element(By.ID, "didomi-notice-agree-button").click()   # Inicio de bloque `try` para capturar excepciones
+        # Esperas explícitas: aguardamos SOLO lo que la página tarde de verdad,
+        # en vez de dormir un peor-caso fijo con time.sleep aunque ya esté lista
+        try: WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.ID, "didomi-notice-agree-button"))).click()   # Aceptar cookies en cuanto aparezca el botón
         except: pass   # Captura una excepción si ocurre dentro del `try`
 
         try:   # Inicio de bloque `try` para capturar excepciones
-            sel_elem = driver.find_element(By.ID, "familyType")    # Asigna un valor a una variable
+            sel_elem = WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.ID, "familyType")))    # Asigna un valor a una variable
             Select(sel_elem).select_by_visible_text("Locales y oficinas")    # Instrucción ejecutable
-            time.sleep(1)   # Instrucción ejecutable
         except: pass   # Captura una excepción si ocurre dentro del `try`
 
         print(f"Ubicando zona: {ciudad}...")   # Instrucción ejecutable
-        caja = driver.find_element(By.NAME, "searchText")    # Asigna un valor a una variable
+        caja = WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.NAME, "searchText")))    # Asigna un valor a una variable
         caja.click(); caja.clear(); caja.send_keys(ciudad)                # Instrucción ejecutable
-        time.sleep(1); caja.send_keys(Keys.RETURN); time.sleep(3)   # Instrucción ejecutable
+        time.sleep(1); caja.send_keys(Keys.RETURN)   # Pausa corta: el autocompletado necesita registrar el texto
 
         try:   # Inicio de bloque `try` para capturar excepciones
-            driver.find_element(By.CSS_SELECTOR, "a.button__primary--darkblue").click()   # Instrucción ejecutable
-            time.sleep(4)   # Instrucción ejecutable
+            WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a.button__primary--darkblue"))).click()   # Instrucción ejecutable
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, ".ad-preview")))   # Hasta que haya tarjetas en el DOM
         except: pass   # Captura una excepción si ocurre dentro del `try`
 
         print("Aplicando filtros...")   # Instrucción ejecutable
@@ -184,7 +418,7 @@ def busqueda(ciudad, subtipo, operacion, presupuesto_max):  # Define la función
                 if "alquiler" not in driver.current_url:   # Instrucción ejecutable
                     # CAMBIO 1: Reemplazo de XPath por PARTIAL_LINK_TEXT
                     driver.find_element(By.PARTIAL_LINK_TEXT, "Alquiler").click()   # Instrucción ejecutable
-                    time.sleep(4)             # Instrucción ejecutable
+                    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, ".ad-preview")))   # Resultados de alquiler cargados
             except: pass   # Captura una excepción si ocurre dentro del `try`
 
         keyword_filtro = normalizar_subtipo(subtipo)   # Asigna un valor a una variable
@@ -197,121 +431,137 @@ def busqueda(ciudad, subtipo, operacion, presupuesto_max):  # Define la función
             except: btn_abrir = driver.find_element(By.CSS_SELECTOR, "div.filters__select-tag")   # Captura una excepción si ocurre dentro del `try`
             
             driver.execute_script("arguments[0].click();", btn_abrir)   # Instrucción ejecutable
-            time.sleep(1.5)   # Instrucción ejecutable
+            WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CSS_SELECTOR, ".filters__multioption")))   # Panel de opciones desplegado
 
             try:   # Inicio de bloque `try` para capturar excepciones
                 chk_todos = driver.find_element(By.ID, "ck0")   # Asigna un valor a una variable
                 if chk_todos.is_selected():   # Instrucción ejecutable
                     driver.execute_script("arguments[0].click();", chk_todos)   # Instrucción ejecutable
-                    time.sleep(1)   # Instrucción ejecutable
             except: pass   # Captura una excepción si ocurre dentro del `try`
 
-            # CAMBIO 3: Reemplazo de XPath por CSS Selector para las opciones
-            css_opciones = ".filters__multioption .filters__char"  # Asigna un valor a una variable
-            opciones = driver.find_elements(By.CSS_SELECTOR, css_opciones)   # Asigna un valor a una variable
-            
-            for op in opciones:   # Bucle `for`: itera sobre una secuencia
-                try:   # Inicio de bloque `try` para capturar excepciones
-                    texto = op.text.strip().lower()   # Asigna un valor a una variable
-                    input_chk = op.find_element(By.TAG_NAME, "input")   # Asigna un valor a una variable
-                    if keyword_filtro in texto:   # Instrucción ejecutable
-                        if not input_chk.is_selected():   # Instrucción ejecutable
-                            driver.execute_script("arguments[0].click();", input_chk)   # Instrucción ejecutable
-                except: pass   # Captura una excepción si ocurre dentro del `try`
-            
-            time.sleep(1)   # Instrucción ejecutable
-            driver.execute_script("arguments[0].click();", driver.find_element(By.CSS_SELECTOR, "div[data-id='subAdType'] button.js-accept"))   # Asigna un valor a una variable
-            time.sleep(4)   # Instrucción ejecutable
+            # CAMBIO 3: Todo el bucle de opciones se resuelve en UNA sola llamada JS.
+            # Cada op.text / find_element / is_selected era un viaje de ida y vuelta
+            # al navegador (~14ms); ahora el recorrido completo ocurre dentro de Chrome
+            driver.execute_script("""
+                const kw = arguments[0];
+                document.querySelectorAll('.filters__multioption .filters__char').forEach(op => {
+                    if (op.textContent.trim().toLowerCase().includes(kw)) {
+                        const inp = op.querySelector('input');
+                        if (inp && !inp.checked) inp.click();
+                    }
+                });
+            """, keyword_filtro)   # El navegador marca las casillas del subtipo en un único round-trip
+
+            driver.execute_script("arguments[0].click();", WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CSS_SELECTOR, "div[data-id='subAdType'] button.js-accept"))))   # Asigna un valor a una variable
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, ".ad-preview")))   # Resultados refrescados con el subtipo aplicado
         except Exception as e:    # Captura una excepción si ocurre dentro del `try`
             print(f"Advertencia aplicando subtipo: {e}")  # Instrucción ejecutable
 
         try:   # Inicio de bloque `try` para capturar excepciones
             val_precio = calcular_filtro_precio(presupuesto_max, es_alquiler)   # Asigna un valor a una variable
             Select(driver.find_element(By.NAME, "ddPrecioMax")).select_by_value(val_precio)   # Instrucción ejecutable
-            time.sleep(2)   # Instrucción ejecutable
             try:   # Inicio de bloque `try` para capturar excepciones
-                btn_final = driver.find_element(By.CSS_SELECTOR, "button.js-seeResultsFilters")   # Asigna un valor a una variable
+                btn_final = WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button.js-seeResultsFilters")))   # Asigna un valor a una variable
                 if btn_final.is_displayed(): btn_final.click()   # Instrucción ejecutable
             except: pass   # Captura una excepción si ocurre dentro del `try`
-            time.sleep(4)                     # Instrucción ejecutable
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, ".ad-preview")))   # Listado final con el precio aplicado
         except: pass   # Captura una excepción si ocurre dentro del `try`
 
         print("Extrayendo datos y Geocodificando (Modo Reforzado)...")  # Instrucción ejecutable
         
-        soup = BeautifulSoup(driver.page_source, "html.parser")   # Asigna un valor a una variable
-        tarjetas = soup.find_all("div", class_="ad-preview")   # Asigna un valor a una variable
-        
+        tarjetas = parsear_tarjetas(driver.page_source)   # Parseo con el motor más rápido disponible (selectolax o bs4)
+
         if not tarjetas:   # Instrucción ejecutable
             print("No se encontraron tarjetas de anuncios.")  # Instrucción ejecutable
 
+        # FASE 1: Parseo síncrono de todas las tarjetas (solo CPU, muy rápido)
+        candidatos = []   # Tarjetas que pasan el filtro de precio, pendientes de geocodificar
+        enlaces_vistos = set()   # URLs ya procesadas: el mismo anuncio puede republicarse con otro título
         for i, tarjeta in enumerate(tarjetas):   # Bucle `for`: itera sobre una secuencia
             try:   # Inicio de bloque `try` para capturar excepciones
-                tag_titulo = tarjeta.select_one(".ad-preview__title")   # Asigna un valor a una variable
-                if not tag_titulo: continue   # Instrucción ejecutable
-                
-                titulo = tag_titulo.text.strip()   # Asigna un valor a una variable
-                enlace_relativo = tag_titulo.get('href')   # Asigna un valor a una variable
-                link_completo = f"https://www.pisos.com{enlace_relativo}"   # Asigna un valor a una variable
-                
+                # Deduplicado ANTES de geocodificar: la URL identifica el anuncio
+                # mejor que el título, y así el duplicado no paga red ninguna
+                if tarjeta["href"] in enlaces_vistos: continue   # Anuncio repetido: fuera sin coste
+                enlaces_vistos.add(tarjeta["href"])   # Primera vez que vemos este anuncio
+                titulo = tarjeta["titulo"]   # Título del anuncio ya extraído por el parser
+                link_completo = f"https://www.pisos.com{tarjeta['href']}"   # Asigna un valor a una variable
+
                 precio_num = 0   # Asigna un valor a una variable
-                tag_precio = tarjeta.select_one(".ad-preview__price")   # Asigna un valor a una variable
-                texto_precio = tag_precio.text.strip() if tag_precio else ""   # Asigna un valor a una variable
-                if not texto_precio:   # Instrucción ejecutable
-                    match = re.search(r'([\d\.]+)\s?€', tarjeta.text)   # Asigna un valor a una variable
-                    if match: texto_precio = match.group(1)   # Asigna un valor a una variable
-                
-                digitos = "".join(filter(str.isdigit, texto_precio))   # Asigna un valor a una variable
-                if digitos: precio_num = int(digitos)   # Asigna un valor a una variable
-
-                tag_ubicacion = tarjeta.select_one(".ad-preview__location")  # Asigna un valor a una variable
-                direccion_raw = tag_ubicacion.text.strip() if tag_ubicacion else titulo   # Asigna un valor a una variable
-                
+                if tarjeta["precio_ld"] is not None:   # Dato estructurado JSON-LD: precio ya tipado
+                    precio_num = int(tarjeta["precio_ld"])   # Sin regex ni limpieza de texto
+                else:   # Sin dato estructurado: extracción textual con formato español
+                    # Un solo patrón para el precio de la tarjeta o, en su defecto, el
+                    # texto completo; "1.250,50" son 1250€, no los 125050 que daba el
+                    # antiguo filtrado de dígitos que ignoraba los separadores
+                    match = PATRON_PRECIO.search(tarjeta["texto_precio"]) or PATRON_PRECIO.search(tarjeta["texto"])
+                    if match:   # Instrucción ejecutable
+                        valor = match.group(1).replace('.', '').replace(',', '.')   # Separadores españoles -> notación decimal
+                        precio_num = int(Decimal(valor))   # Parte entera del precio
+
+                direccion_raw = tarjeta["direccion_ld"] or tarjeta["ubicacion"] or titulo   # Dirección estructurada, ubicación textual o título
+
                 # --- NUEVA LIMPIEZA ---
                 direccion_limpia = limpiar_direccion(direccion_raw)   # Asigna un valor a una variable
 
                 if 0 < precio_num <= presupuesto_max:   # Asigna un valor a una variable
-                    
-                    # --- NUEVA GEOCODIFICACIÓN ---
-                    lat, lon = geocodificar_inteligente(direccion_limpia, ciudad, geolocator_osm, geolocator_arcgis)   # Asigna un valor a una variable
-
-                    if lat != 0.0 and lon != 0.0:   # Asigna un valor a una variable
-                        clave = titulo if titulo not in resultados_dict else f"{titulo}_{i}"   # Asigna un valor a una variable
-                        resultados_dict[clave] = {   # Asigna un valor a una variable
-                            "nombre": titulo,  # Instrucción ejecutable
-                            "direccion": direccion_limpia,  # Instrucción ejecutable
-                            "precio": precio_num,  # Instrucción ejecutable
-                            "coords": (lat, lon),   # Instrucción ejecutable
-                            "link": link_completo  # Instrucción ejecutable
-                        }  # Instrucción ejecutable
-                        print(f"  > Ubicación OK: {direccion_limpia[:30]}... ({precio_num}€)")  # Instrucción ejecutable
-                    else:   # Instrucción ejecutable
-                        print(f"  > Descartado (No ubi): {direccion_limpia[:30]}...")  # Instrucción ejecutable
-                        
+                    candidatos.append((i, titulo, direccion_limpia, precio_num, link_completo))   # Guardamos el candidato para la fase 2
+
             except Exception as e:   # Captura una excepción si ocurre dentro del `try`
                 print(f"Error procesando tarjeta {i}: {e}")  # Instrucción ejecutable
 
+        # FASE 2: Geocodificación. Primero UN único POST con todas las direcciones al
+        # servicio por lotes de ArcGIS (una petición en vez de N); lo que el lote no
+        # resuelva con confianza cae al camino individual concurrente de siempre
+        aciertos = geocodificar_lote([c[2] for c in candidatos], ciudad) if candidatos else {}   # c[2] = dirección limpia
+        pendientes = [j for j in range(len(candidatos)) if j not in aciertos]   # Índices sin resultado fiable del lote
+
+        if pendientes:   # Reintento individual solo para los huecos
+            with ThreadPoolExecutor(max_workers=4) as executor:   # Pool acotado: 4 peticiones en vuelo como máximo
+                resueltos = list(executor.map(   # map conserva el orden de los pendientes
+                    lambda j: geocodificar_cacheado(candidatos[j][2], ciudad),
+                    pendientes))   # Una tarea por candidato pendiente; las repetidas salen de la caché
+            aciertos.update(zip(pendientes, resueltos))   # Completamos el diccionario de coordenadas
+
+        coordenadas = [aciertos.get(j, (0.0, 0.0)) for j in range(len(candidatos))]   # Lista alineada con los candidatos
+
+        # FASE 3: Montaje del diccionario de resultados con las coordenadas ya resueltas
+        for (i, titulo, direccion_limpia, precio_num, link_completo), (lat, lon) in zip(candidatos, coordenadas):
+            if lat != 0.0 and lon != 0.0:   # Solo aceptamos candidatos bien geolocalizados
+                clave = titulo if titulo not in resultados_dict else f"{titulo}_{i}"   # Asigna un valor a una variable
+                resultados_dict[clave] = {   # Asigna un valor a una variable
+                    "nombre": titulo,  # Instrucción ejecutable
+                    "direccion": direccion_limpia,  # Instrucción ejecutable
+                    "precio": precio_num,  # Instrucción ejecutable
+                    "coords": (lat, lon),   # Instrucción ejecutable
+                    "link": link_completo  # Instrucción ejecutable
+                }  # Instrucción ejecutable
+                print(f"  > Ubicación OK: {direccion_limpia[:30]}... ({precio_num}€)")  # Instrucción ejecutable
+            else:   # Instrucción ejecutable
+                print(f"  > Descartado (No ubi): {direccion_limpia[:30]}...")  # Instrucción ejecutable
+
     except Exception as e:   # Captura una excepción si ocurre dentro del `try`
         print(f"Error crítico en selenium: {e}")  # Instrucción ejecutable
     finally:   # Bloque que se ejecuta siempre (haya o no error)
-        driver.quit()  # Instrucción ejecutable
+        # No cerramos el navegador: lo dejamos limpio para la siguiente búsqueda
+        try:   # Inicio de bloque `try` para capturar excepciones
+            driver.delete_all_cookies()   # Sesión limpia entre búsquedas
+            driver.get("about:blank")   # Soltamos la página para liberar memoria del render
+        except: pass   # Captura una excepción si ocurre dentro del `try`
 
     print("Módulo P1 finalizado.\n")  # Instrucción ejecutable
-    lista_para_df = []   # Asigna un valor a una variable
-    contador = 1   # Asigna un valor a una variable
-    
-    for key, info in resultados_dict.items():     # Bucle `for`: itera sobre una secuencia
-        fila = {  # Asigna un valor a una variable
-            "NUMERO": f"{contador:03d}",  # Instrucción ejecutable
-            "NOMBRE": info["nombre"],  # Instrucción ejecutable
-            "DIRECCION": info["direccion"],  # Instrucción ejecutable
-            "COORDENADAS": info["coords"],  # Instrucción ejecutable
-            "PRECIO": info["precio"],  # Instrucción ejecutable
-            "LINK": info["link"]  # Instrucción ejecutable
-        }  # Instrucción ejecutable
-        lista_para_df.append(fila)    # Instrucción ejecutable
-        contador += 1  # Asigna un valor a una variable
-            
-    df = pd.DataFrame(lista_para_df, columns=["NUMERO", "NOMBRE", "DIRECCION", "COORDENADAS", "PRECIO", "LINK"])  # Asigna un valor a una variable
+
+    # Montamos el DataFrame columna a columna: un array por columna en vez de una
+    # lista de dicts fila a fila, que obliga a pandas a inferir tipos por celda
+    n = len(resultados_dict)   # Número de locales aceptados
+    valores = list(resultados_dict.values())   # Orden de inserción = orden de aparición
+    df = pd.DataFrame({   # Cada columna llega ya materializada con su tipo
+        "NUMERO": np.char.mod('%03d', np.arange(1, n + 1)),   # "001", "002"... sin contador manual
+        "NOMBRE": np.fromiter((v["nombre"] for v in valores), dtype=object, count=n),   # Instrucción ejecutable
+        "DIRECCION": np.fromiter((v["direccion"] for v in valores), dtype=object, count=n),   # Instrucción ejecutable
+        "COORDENADAS": np.fromiter((v["coords"] for v in valores), dtype=object, count=n),   # Tuplas (lat, lon)
+        "PRECIO": np.fromiter((v["precio"] for v in valores), dtype=np.int64, count=n),   # Instrucción ejecutable
+        "LINK": np.fromiter((v["link"] for v in valores), dtype=object, count=n),   # Instrucción ejecutable
+    }, copy=False)  # Asigna un valor a una variable
     return df  # Devuelve el resultado desde la función
 
 if __name__ == "__main__":  # Punto de entrada cuando se ejecuta el script directamente
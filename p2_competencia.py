@@ -28,142 +28,207 @@
 
 import requests  # Realiza peticiones HTTP para conectarse a APIs externas
 import time  # Gestiona pausas en la ejecución (sleep) para evitar saturar los servidores y ser bloqueado
+import asyncio  # Procesa varias filas a la vez: el tiempo de espera de red se solapa entre locales
+import functools  # Caché LRU para no repetir geocodificaciones inversas de coordenadas ya vistas
+import math  # Distancia haversine para atribuir cada hit del lote Overpass a su local de origen
+from ast import literal_eval  # Parseo seguro de tuplas en texto: solo literales, sin ejecutar código
+import random  # Jitter aleatorio en el backoff: evita que los reintentos se sincronicen entre hilos
 import re  # "Expresiones Regulares": permite buscar, extraer y limpiar patrones complejos de texto
 from geopy.geocoders import ArcGIS  # Servicio de geolocalización robusto para convertir coordenadas en direcciones (y viceversa)
+from geopy.extra.rate_limiter import RateLimiter  # Limitador de ritmo por servicio: espera solo lo que falte, no un sleep fijo
 
 MAPEO_CATEGORIAS = {
-    "pizzería":       [("cuisine", "pizza")],
-    "hamburgueseria": [("cuisine", "burger"), ("cuisine", "hamburger")],
-    "hamburguesería": [("cuisine", "burger"), ("cuisine", "hamburger")],
-    "sushi":          [("cuisine", "sushi"), ("cuisine", "japanese")],
-    "japones":        [("cuisine", "japanese")],
-    "chino":          [("cuisine", "chinese")],
-    "asiatico":       [("cuisine", "asian")],
-    "mexicano":       [("cuisine", "mexican"), ("cuisine", "tex-mex")],
-    "indio":          [("cuisine", "indian")],
-    "italiano":       [("cuisine", "italian")],
-    "kebab":          [("cuisine", "kebab")],
-    "tapas":          [("cuisine", "tapas")],
-    "marisqueria":    [("cuisine", "seafood")],
-    "asador":         [("cuisine", "steak_house"), ("cuisine", "bbq")],
-    "vegetariano":    [("cuisine", "vegetarian"), ("diet:vegetarian", "yes")],
-    "vegano":         [("cuisine", "vegan"), ("diet:vegan", "yes")],
-    "pollo":          [("cuisine", "chicken")],
-    "bocadilleria":   [("cuisine", "sandwich")],
-    "wok":            [("cuisine", "wok")],
-    "ramen":          [("cuisine", "ramen")],
-    "tacos":          [("cuisine", "tacos")],
+    "pizzería":       (("cuisine", "pizza"),),
+    "hamburgueseria": (("cuisine", "burger"), ("cuisine", "hamburger"),),
+    "hamburguesería": (("cuisine", "burger"), ("cuisine", "hamburger"),),
+    "sushi":          (("cuisine", "sushi"), ("cuisine", "japanese"),),
+    "japones":        (("cuisine", "japanese"),),
+    "chino":          (("cuisine", "chinese"),),
+    "asiatico":       (("cuisine", "asian"),),
+    "mexicano":       (("cuisine", "mexican"), ("cuisine", "tex-mex"),),
+    "indio":          (("cuisine", "indian"),),
+    "italiano":       (("cuisine", "italian"),),
+    "kebab":          (("cuisine", "kebab"),),
+    "tapas":          (("cuisine", "tapas"),),
+    "marisqueria":    (("cuisine", "seafood"),),
+    "asador":         (("cuisine", "steak_house"), ("cuisine", "bbq"),),
+    "vegetariano":    (("cuisine", "vegetarian"), ("diet:vegetarian", "yes"),),
+    "vegano":         (("cuisine", "vegan"), ("diet:vegan", "yes"),),
+    "pollo":          (("cuisine", "chicken"),),
+    "bocadilleria":   (("cuisine", "sandwich"),),
+    "wok":            (("cuisine", "wok"),),
+    "ramen":          (("cuisine", "ramen"),),
+    "tacos":          (("cuisine", "tacos"),),
 
     # ------------------- CAFÉ, COPAS Y OCIO -------------------
-    "cafeteria":      [("amenity", "cafe")],
-    "café":           [("amenity", "cafe")],
-    "teteria":        [("shop", "tea")],
-    "bar":            [("amenity", "bar"), ("amenity", "pub")],
-    "pub":            [("amenity", "pub")],
-    "discoteca":      [("amenity", "nightclub")],
-    "cerveceria":     [("amenity", "biergarten")],
-    "heladeria":      [("amenity", "ice_cream"), ("shop", "ice_cream")],
-    "churreria":      [("cuisine", "churro")],
-    "shisha":         [("amenity", "hookah_lounge")],
+    "cafeteria":      (("amenity", "cafe"),),
+    "café":           (("amenity", "cafe"),),
+    "teteria":        (("shop", "tea"),),
+    "bar":            (("amenity", "bar"), ("amenity", "pub"),),
+    "pub":            (("amenity", "pub"),),
+    "discoteca":      (("amenity", "nightclub"),),
+    "cerveceria":     (("amenity", "biergarten"),),
+    "heladeria":      (("amenity", "ice_cream"), ("shop", "ice_cream"),),
+    "churreria":      (("cuisine", "churro"),),
+    "shisha":         (("amenity", "hookah_lounge"),),
 
     # ------------------- ALIMENTACIÓN (Retail) -------------------
-    "supermercado":   [("shop", "supermarket"), ("shop", "convenience")],
-    "hipermercado":   [("shop", "supermarket")],
-    "tienda":         [("shop", "convenience")],
-    "panaderia":      [("shop", "bakery")],
-    "pasteleria":     [("shop", "pastry"), ("shop", "confectionery")],
-    "fruteria":       [("shop", "greengrocer")],
-    "carniceria":     [("shop", "butcher")],
-    "pescaderia":     [("shop", "seafood")],
-    "charcuteria":    [("shop", "deli")],
-    "herbolario":     [("shop", "herbalist")],
-    "congelados":     [("shop", "frozen_food")],
-    "vinoteca":       [("shop", "wine")],
-    "licoreria":      [("shop", "alcohol")],
+    "supermercado":   (("shop", "supermarket"), ("shop", "convenience"),),
+    "hipermercado":   (("shop", "supermarket"),),
+    "tienda":         (("shop", "convenience"),),
+    "panaderia":      (("shop", "bakery"),),
+    "pasteleria":     (("shop", "pastry"), ("shop", "confectionery"),),
+    "fruteria":       (("shop", "greengrocer"),),
+    "carniceria":     (("shop", "butcher"),),
+    "pescaderia":     (("shop", "seafood"),),
+    "charcuteria":    (("shop", "deli"),),
+    "herbolario":     (("shop", "herbalist"),),
+    "congelados":     (("shop", "frozen_food"),),
+    "vinoteca":       (("shop", "wine"),),
+    "licoreria":      (("shop", "alcohol"),),
 
     # ------------------- SALUD Y BELLEZA -------------------
-    "farmacia":       [("amenity", "pharmacy")],
-    "parafarmacia":   [("shop", "chemist")],
-    "gimnasio":       [("leisure", "fitness_centre"), ("sport", "fitness")],
-    "yoga":           [("leisure", "fitness_centre")],
-    "pilates":        [("leisure", "fitness_centre")],
-    "crossfit":       [("leisure", "fitness_centre")],
-    "peluqueria":     [("shop", "hairdresser")],
-    "barberia":       [("shop", "hairdresser")],
-    "estetica":       [("shop", "beauty"), ("shop", "cosmetics")],
-    "uñas":           [("shop", "beauty")],
-    "tatuajes":       [("shop", "tattoo")],
-    "dentista":       [("amenity", "dentist"), ("healthcare", "dentist")],
-    "clinica":        [("amenity", "clinic")],
-    "veterinario":    [("amenity", "veterinary")],
-    "optica":         [("shop", "optician")],
-    "fisioterapia":   [("healthcare", "physiotherapist")],
+    "farmacia":       (("amenity", "pharmacy"),),
+    "parafarmacia":   (("shop", "chemist"),),
+    "gimnasio":       (("leisure", "fitness_centre"), ("sport", "fitness"),),
+    "yoga":           (("leisure", "fitness_centre"),),
+    "pilates":        (("leisure", "fitness_centre"),),
+    "crossfit":       (("leisure", "fitness_centre"),),
+    "peluqueria":     (("shop", "hairdresser"),),
+    "barberia":       (("shop", "hairdresser"),),
+    "estetica":       (("shop", "beauty"), ("shop", "cosmetics"),),
+    "uñas":           (("shop", "beauty"),),
+    "tatuajes":       (("shop", "tattoo"),),
+    "dentista":       (("amenity", "dentist"), ("healthcare", "dentist"),),
+    "clinica":        (("amenity", "clinic"),),
+    "veterinario":    (("amenity", "veterinary"),),
+    "optica":         (("shop", "optician"),),
+    "fisioterapia":   (("healthcare", "physiotherapist"),),
 
     # ------------------- COMERCIO (Tiendas) -------------------
-    "ropa":           [("shop", "clothes"), ("shop", "boutique"), ("shop", "fashion")],
-    "zapateria":      [("shop", "shoes")],
-    "joyeria":        [("shop", "jewelry"), ("shop", "watches")],
-    "floristeria":    [("shop", "florist")],
-    "ferreteria":     [("shop", "hardware"), ("shop", "doityourself")],
-    "bricolaje":      [("shop", "doityourself")],
-    "electronica":    [("shop", "electronics"), ("shop", "computer")],
-    "moviles":        [("shop", "mobile_phone")],
-    "reparacion moviles": [("shop", "mobile_phone")],
-    "libreria":       [("shop", "books")],
-    "papeleria":      [("shop", "stationery")],
-    "estanco":        [("shop", "tobacco")],
-    "kiosco":         [("shop", "kiosk"), ("shop", "newsagent")],
-    "jugueteria":     [("shop", "toys")],
-    "deportes":       [("shop", "sports")],
-    "bicicletas":     [("shop", "bicycle")],
-    "musica":         [("shop", "musical_instrument")],
-    "animales":       [("shop", "pet")],
-    "mascotas":       [("shop", "pet")],
-    "muebles":        [("shop", "furniture")],
-    "decoracion":     [("shop", "interior_decoration")],
-    "segunda mano":   [("shop", "second_hand")],
-    "fotografia":     [("shop", "photo")],
+    "ropa":           (("shop", "clothes"), ("shop", "boutique"), ("shop", "fashion"),),
+    "zapateria":      (("shop", "shoes"),),
+    "joyeria":        (("shop", "jewelry"), ("shop", "watches"),),
+    "floristeria":    (("shop", "florist"),),
+    "ferreteria":     (("shop", "hardware"), ("shop", "doityourself"),),
+    "bricolaje":      (("shop", "doityourself"),),
+    "electronica":    (("shop", "electronics"), ("shop", "computer"),),
+    "moviles":        (("shop", "mobile_phone"),),
+    "reparacion moviles": (("shop", "mobile_phone"),),
+    "libreria":       (("shop", "books"),),
+    "papeleria":      (("shop", "stationery"),),
+    "estanco":        (("shop", "tobacco"),),
+    "kiosco":         (("shop", "kiosk"), ("shop", "newsagent"),),
+    "jugueteria":     (("shop", "toys"),),
+    "deportes":       (("shop", "sports"),),
+    "bicicletas":     (("shop", "bicycle"),),
+    "musica":         (("shop", "musical_instrument"),),
+    "animales":       (("shop", "pet"),),
+    "mascotas":       (("shop", "pet"),),
+    "muebles":        (("shop", "furniture"),),
+    "decoracion":     (("shop", "interior_decoration"),),
+    "segunda mano":   (("shop", "second_hand"),),
+    "fotografia":     (("shop", "photo"),),
 
     # ------------------- SERVICIOS Y OFICINAS -------------------
-    "banco":          [("amenity", "bank")],
-    "cajero":         [("amenity", "atm")],
-    "inmobiliaria":   [("office", "estate_agent")],
-    "seguros":        [("office", "insurance")],
-    "abogado":        [("office", "lawyer")],
-    "gestoria":       [("office", "accountant"), ("office", "tax_advisor")],
-    "coworking":      [("office", "coworking")],
-    "correos":        [("amenity", "post_office")],
-    "mensajeria":     [("office", "courier")],
-    "tintoreria":     [("shop", "dry_cleaning")],
-    "lavanderia":     [("shop", "laundry")],
-    "autoescuela":    [("amenity", "driving_school")],
-    "agencia viajes": [("shop", "travel_agency")],
+    "banco":          (("amenity", "bank"),),
+    "cajero":         (("amenity", "atm"),),
+    "inmobiliaria":   (("office", "estate_agent"),),
+    "seguros":        (("office", "insurance"),),
+    "abogado":        (("office", "lawyer"),),
+    "gestoria":       (("office", "accountant"), ("office", "tax_advisor"),),
+    "coworking":      (("office", "coworking"),),
+    "correos":        (("amenity", "post_office"),),
+    "mensajeria":     (("office", "courier"),),
+    "tintoreria":     (("shop", "dry_cleaning"),),
+    "lavanderia":     (("shop", "laundry"),),
+    "autoescuela":    (("amenity", "driving_school"),),
+    "agencia viajes": (("shop", "travel_agency"),),
 
     # ------------------- AUTOMOCIÓN -------------------
-    "taller":         [("shop", "car_repair")],
-    "mecanico":       [("shop", "car_repair")],
-    "gasolinera":     [("amenity", "fuel")],
-    "lavado":         [("amenity", "car_wash")],
-    "concesionario":  [("shop", "car"), ("shop", "motorcycle")],
-    "parking":        [("amenity", "parking")],
-    "alquiler coches": [("amenity", "car_rental")],
+    "taller":         (("shop", "car_repair"),),
+    "mecanico":       (("shop", "car_repair"),),
+    "gasolinera":     (("amenity", "fuel"),),
+    "lavado":         (("amenity", "car_wash"),),
+    "concesionario":  (("shop", "car"), ("shop", "motorcycle"),),
+    "parking":        (("amenity", "parking"),),
+    "alquiler coches": (("amenity", "car_rental"),),
 
     # ------------------- EDUCACIÓN Y CULTURA -------------------
-    "colegio":        [("amenity", "school")],
-    "instituto":      [("amenity", "school")],
-    "universidad":    [("amenity", "university")],
-    "guarderia":      [("amenity", "kindergarten"), ("amenity", "childcare")],
-    "academia":       [("amenity", "language_school"), ("amenity", "music_school"), ("amenity", "prep_school")],
-    "biblioteca":     [("amenity", "library")],
-    "cine":           [("amenity", "cinema")],
-    "teatro":         [("amenity", "theatre")],
+    "colegio":        (("amenity", "school"),),
+    "instituto":      (("amenity", "school"),),
+    "universidad":    (("amenity", "university"),),
+    "guarderia":      (("amenity", "kindergarten"), ("amenity", "childcare"),),
+    "academia":       (("amenity", "language_school"), ("amenity", "music_school"), ("amenity", "prep_school"),),
+    "biblioteca":     (("amenity", "library"),),
+    "cine":           (("amenity", "cinema"),),
+    "teatro":         (("amenity", "theatre"),),
 
     # ------------------- ALOJAMIENTO -------------------
-    "hotel":          [("tourism", "hotel")],
-    "hostal":         [("tourism", "hostel"), ("tourism", "guest_house")],
-    "apartamento":    [("tourism", "apartment")]
+    "hotel":          (("tourism", "hotel"),),
+    "hostal":         (("tourism", "hostel"), ("tourism", "guest_house"),),
+    "apartamento":    (("tourism", "apartment"),)
 }
 
+# Cliente HTTP y geocodificador como singletons del módulo: abrir TCP+TLS por
+# fila dominaba la latencia; con la sesión keep-alive el socket se reutiliza
+_SESION = requests.Session() # Conexiones persistentes para las llamadas a Overpass
+_SESION.headers['User-Agent'] = 'businessExplorer/1.0' # Identificación educada ante las APIs
+_GEO_ARCGIS = ArcGIS(timeout=5) # Un único cliente de geocodificación inversa para todas las filas
+# El RateLimiter descuenta del intervalo el tiempo que ya tardó la petición: si la
+# llamada duró 1.2s no añade espera ninguna, donde el sleep fijo sumaba 0.5s siempre
+_REVERSE_LIMITADO = RateLimiter(_GEO_ARCGIS.reverse, min_delay_seconds=1.0, max_retries=2,
+                                error_wait_seconds=5, swallow_exceptions=True) # Ritmo educado con el servicio World de ArcGIS
+_CACHE_COMPETENCIA = {} # Respuestas de Overpass por zona cuantizada: la misma manzana no se repregunta
+_ZONAS_CONSULTADAS = [] # Anillos ya pedidos a Overpass: (lat, lon, radio, negocio, hits) para reutilización espacial
+PATRON_CP = re.compile(r'\b(\d{5})\b') # CP español: compilado UNA vez, no por cada dirección devuelta
+URL_OVERPASS = "https://overpass-api.de/api/interpreter" # Endpoint único de la API Overpass
+
+def _peticion_overpass(http, query, timeout):
+
+    ################################################################################
+    # Envía la query a Overpass con reintentos ante saturación (429) o timeout de
+    # pasarela (504): backoff exponencial 1, 2, 4s con jitter, o el Retry-After
+    # que indique el propio servidor si viene en la respuesta. Antes, un 429
+    # dormía 2s y se rendía sin reintentar, desperdiciando la espera.
+    ################################################################################
+
+    response = None # Última respuesta recibida
+    for intento in range(4): # Hasta 4 intentos en total
+        response = http.get(URL_OVERPASS, params={'data': query}, timeout=timeout) # Petición a la API
+        if response.status_code not in (429, 504): # Respuesta definitiva (éxito o error no recuperable)
+            return response # La devolvemos tal cual
+        espera = response.headers.get('Retry-After') # El servidor puede decirnos cuánto esperar
+        try: espera = float(espera) # Preferimos la indicación explícita del servidor
+        except (TypeError, ValueError): espera = (2 ** intento) + random.random() # Backoff exponencial con jitter
+        time.sleep(espera) # Esperamos antes del siguiente intento
+    return response # Agotados los reintentos: devolvemos la última respuesta
+
+@functools.lru_cache(maxsize=100_000) # Coordenadas repetidas devuelven su CP sin tocar la red
+def _cp_cacheado(lat_q, lon_q): # Trabajo real sobre coordenadas YA cuantizadas
+
+    # CAMINO PRINCIPAL: Nominatim con addressdetails devuelve el CP como campo
+    # estructurado (address.postcode): sin parsear direcciones libres ni regex
+    try: # Intentamos la consulta estructurada
+        r = _SESION.get("https://nominatim.openstreetmap.org/reverse", # Endpoint de geocodificación inversa de OSM
+                        params={'lat': lat_q, 'lon': lon_q, 'format': 'jsonv2',
+                                'zoom': 18, 'addressdetails': 1}, # Máximo detalle en el punto exacto
+                        timeout=5) # Margen corto: hay respaldo
+        if r.status_code == 200: # Respuesta correcta del servicio
+            cp = r.json().get('address', {}).get('postcode', '') # CP ya tipado en la respuesta
+            match = PATRON_CP.search(cp) # Validamos el formato español de 5 dígitos
+            if match: return match.group(1) # CP directo, sin análisis de texto libre
+    except Exception: pass # Red caída o respuesta rara: probamos el respaldo
+
+    # RESPALDO: ArcGIS vía geopy, extrayendo el CP de la dirección en texto libre
+    try: # Intentamos conectar con el servicio de geocodificación
+        location = _REVERSE_LIMITADO((lat_q, lon_q)) # Cliente compartido con ritmo limitado (reintentos incluidos)
+        if location and location.address: # Verificamos si hemos recibido una respuesta con dirección válida
+            match = PATRON_CP.search(location.address) # Patrón de 5 dígitos consecutivos (formato CP español) ya compilado
+            if match: return match.group(1) # Si encontramos el patrón, devolvemos los dígitos capturados
+    except Exception: pass # Si ocurre cualquier error de conexión o búsqueda, lo ignoramos
+    return "00000" # Devolvemos un código postal por defecto si no encontramos nada
+
 def obtener_cp_latlon(lat, lon):
 
     ################################################################################
@@ -171,6 +236,8 @@ def obtener_cp_latlon(lat, lon):
     # obtener la dirección postal correspondiente a un par de coordenadas (latitud,
     # longitud). Busca específicamente un patrón de 5 dígitos en la dirección
     # devuelta para extraer el Código Postal, retornando "00000" si falla.
+    # Las coordenadas se cuantizan a 4 decimales (~11 m, menor que cualquier
+    # polígono de CP) para que dos locales de la misma calle compartan caché.
     #
     # RECIBE:
     # - lat (float): Latitud.
@@ -180,14 +247,22 @@ def obtener_cp_latlon(lat, lon):
     # - str: Código Postal detectado o "00000".
     ################################################################################
 
-    try: # Intentamos conectar con el servicio de geocodificación
-        geo_service = ArcGIS(timeout=5) # Inicializamos el servicio de ArcGIS con un tiempo de espera de 5 segundos
-        location = geo_service.reverse((lat, lon)) # Solicitamos la dirección correspondiente a las coordenadas dadas
-        if location and location.address: # Verificamos si hemos recibido una respuesta con dirección válida
-            match = re.search(r'\b(\d{5})\b', location.address) # Buscamos un patrón de 5 dígitos consecutivos (formato CP español) usando regex
-            if match: return match.group(1) # Si encontramos el patrón, devolvemos los dígitos capturados
-    except Exception: pass # Si ocurre cualquier error de conexión o búsqueda, lo ignoramos
-    return "00000" # Devolvemos un código postal por defecto si no encontramos nada
+    return _cp_cacheado(round(lat, 4), round(lon, 4)) # Dos locales pegados = una sola llamada a ArcGIS
+
+def _cabecera_bbox(puntos, radio):
+
+    ################################################################################
+    # Calcula la cláusula global [bbox:sur,oeste,norte,este] que cubre todos los
+    # puntos con su radio. Sin ella, las búsquedas `around` con regex de nombre
+    # pueden escanear el planeta entero y agotar el timeout; con el bbox, Overpass
+    # usa su índice espacial y la misma query baja de decenas de segundos a <1s.
+    ################################################################################
+
+    lats = [p[0] for p in puntos] # Latitudes de todos los centros
+    lons = [p[1] for p in puntos] # Longitudes de todos los centros
+    dlat = radio / 111320 # Metros a grados de latitud
+    dlon = radio / (111320 * max(math.cos(math.radians(max(lats, key=abs))), 1e-6)) # Grados de longitud en la latitud más desfavorable
+    return f"[bbox:{min(lats)-dlat},{min(lons)-dlon},{max(lats)+dlat},{max(lons)+dlon}]" # sur,oeste,norte,este
 
 def construir_query(lat, lon, radio, negocio):
 
@@ -207,33 +282,178 @@ def construir_query(lat, lon, radio, negocio):
     ################################################################################
 
     kw_normalizada = negocio.lower().strip() # Limpiamos y normalizamos la palabra clave a minúsculas
-    
+
     # Parte A: Búsqueda por etiquetas técnicas (Si existe en el mapeo)
-    query_tags = "" # Inicializamos la cadena de consulta de etiquetas vacía
-    if kw_normalizada in MAPEO_CATEGORIAS: # Comprobamos si la palabra clave existe en nuestro diccionario maestro
-        tags = MAPEO_CATEGORIAS[kw_normalizada] # Recuperamos la lista de etiquetas técnicas asociadas
-        for k, v in tags: # Iteramos sobre cada par clave-valor de las etiquetas
-            query_tags += f'node(around:{radio},{lat},{lon})["{k}"="{v}"];' # Añadimos la búsqueda de nodos con esa etiqueta
-            query_tags += f'way(around:{radio},{lat},{lon})["{k}"="{v}"];' # Añadimos la búsqueda de vías/caminos con esa etiqueta
-            
-    # Parte B: Búsqueda por Nombre (Siempre activa como respaldo)
-    # Esto encuentra "Pizzeria Luigi" aunque no tenga la etiqueta cuisine=pizza
-    query_name = f""" 
-      node(around:{radio},{lat},{lon})[~"name"~"{kw_normalizada}", i];
-      way(around:{radio},{lat},{lon})[~"name"~"{kw_normalizada}", i];
-    """ # Construimos la consulta de respaldo que busca la palabra clave dentro del nombre del local (insensible a mayúsculas)
+    partes = [] # Cláusulas acumuladas en lista: un único join al final, sin reconstruir la cadena en cada +=
+    tags = MAPEO_CATEGORIAS.get(kw_normalizada, ()) # Una sola consulta al dict, sin el doble `in` + []
+    for k, v in tags: # Iteramos sobre cada par clave-valor de las etiquetas
+        partes.append(f'node(around:{radio},{lat},{lon})["{k}"="{v}"];') # Añadimos la búsqueda de nodos con esa etiqueta
+        partes.append(f'way(around:{radio},{lat},{lon})["{k}"="{v}"];') # Añadimos la búsqueda de vías/caminos con esa etiqueta
+
+    # Parte B: Búsqueda por Nombre SOLO cuando no hay etiquetas mapeadas. La regex
+    # sin anclar junto a `around` fuerza a Overpass a escanear el índice global de
+    # nombres; con mapeo, la parte A ya cubre los competidores con precisión
+    if not tags: # Palabra clave desconocida: respaldo por nombre, anclado y escapado
+        partes.append(f'node(around:{radio},{lat},{lon})[~"name"~"^{re.escape(kw_normalizada)}", i];') # Solo nodos: ahí viven los nombres
 
     final_query = f"""
-    [out:json][timeout:25];
+    [out:json][timeout:25]{_cabecera_bbox([(lat, lon)], radio)}[maxsize:536870912];
     (
-      {query_tags}
-      {query_name}
+      {"".join(partes)}
     );
     out center;
-    """ # Ensamblamos la query final uniendo las búsquedas por etiquetas y por nombre en un solo bloque
+    """ # Ensamblamos la query final con las cláusulas que correspondan
     return final_query # Devolvemos la query completa
 
-def obtener_competencia(lat, lon, radio, negocio, cp_local_principal):
+def _extraer_competidor(tags, cp_defecto):
+
+    ################################################################################
+    # Convierte las etiquetas OSM de un elemento en la tupla (nombre, cp) que usa
+    # el resto de la pipeline, con el mismo nombre de respaldo por categoría que
+    # se aplicaba antes elemento a elemento.
+    ################################################################################
+
+    nombre = tags.get("name", "") # Intentamos extraer el nombre del negocio
+    if not nombre: # Si no tiene nombre definido
+        # Nombre fallback basado en etiqueta
+        cat = tags.get("amenity") or tags.get("shop") or tags.get("cuisine") or "Local" # Buscamos una categoría genérica para identificarlo
+        nombre = f"({cat})" # Asignamos la categoría entre paréntesis como nombre provisional
+    return nombre, tags.get("addr:postcode", cp_defecto) # CP del competidor, o el de referencia si falta
+
+def _cp_del_competidor(tags, e_lat, e_lon, cp_referencia):
+
+    ################################################################################
+    # Decide el CP por defecto de un competidor: si no declara addr:postcode pero
+    # conocemos sus coordenadas, resolvemos SU código postal real con la caché de
+    # geocodificación inversa, en vez de atribuirle el del local analizado (que
+    # puede ser de otra zona). La caché cuantizada absorbe el coste: competidores
+    # de la misma manzana comparten entrada.
+    ################################################################################
+
+    if "addr:postcode" in tags: return cp_referencia # Tiene CP propio: el defecto no se usará
+    if e_lat is not None and e_lon is not None: # Sin CP declarado pero con posición conocida
+        cp_real = obtener_cp_latlon(e_lat, e_lon) # CP real del punto, servido desde la caché si repite zona
+        if cp_real != "00000": return cp_real # Solo si la resolución tuvo éxito
+    return cp_referencia # Último recurso: el CP del local analizado, como antes
+
+def _distancia_m(lat1, lon1, lat2, lon2):
+
+    ################################################################################
+    # Distancia haversine en metros entre dos coordenadas; sirve para atribuir
+    # cada resultado de la query por lotes al local del que está a menos de
+    # `radio` metros.
+    ################################################################################
+
+    rlat1, rlat2 = math.radians(lat1), math.radians(lat2) # Latitudes en radianes
+    dlat = rlat2 - rlat1 # Diferencia de latitudes
+    dlon = math.radians(lon2 - lon1) # Diferencia de longitudes en radianes
+    a = math.sin(dlat / 2)**2 + math.cos(rlat1) * math.cos(rlat2) * math.sin(dlon / 2)**2 # Fórmula haversine
+    return 6371000 * 2 * math.asin(math.sqrt(a)) # Radio terrestre medio en metros
+
+def _merece_consulta(negocio):
+
+    ################################################################################
+    # Decide si una palabra clave justifica una petición a Overpass: vacía no, y
+    # si no está en el mapeo debe tener al menos 3 caracteres para que la búsqueda
+    # por nombre tenga alguna posibilidad de acertar (y no dispare escaneos caros).
+    ################################################################################
+
+    kw = negocio.lower().strip() # Normalizamos igual que los constructores de queries
+    return bool(kw) and (kw in MAPEO_CATEGORIAS or len(kw) >= 3) # Mapeada, o nombre con sustancia
+
+def construir_query_lote(puntos, radio, negocio):
+
+    ################################################################################
+    # Versión por lotes de construir_query: une las cláusulas `around` de TODOS
+    # los puntos en una única consulta Overpass, de modo que N locales cuestan
+    # una sola petición HTTP en vez de N. Cada resultado se atribuye después a
+    # su local de origen por distancia haversine.
+    #
+    # RECIBE:
+    # - puntos (lista de tuplas (lat, lon)): Centros de búsqueda.
+    # - radio (int): Distancia en metros.
+    # - negocio (str): Término de búsqueda (negocio).
+    #
+    # DEVUELVE:
+    # - str: Query lista para ser enviada a la API.
+    ################################################################################
+
+    kw_normalizada = negocio.lower().strip() # Limpiamos y normalizamos la palabra clave a minúsculas
+    tags = MAPEO_CATEGORIAS.get(kw_normalizada, ()) # Etiquetas técnicas asociadas (una sola consulta al dict)
+
+    partes = [] # Cláusulas acumuladas en lista (un join al final, sin += cuadrático)
+    for lat, lon in puntos: # Una tanda de cláusulas por cada local del lote
+        for k, v in tags: # Iteramos sobre cada par clave-valor de las etiquetas
+            partes.append(f'node(around:{radio},{lat},{lon})["{k}"="{v}"];') # Nodos con esa etiqueta
+            partes.append(f'way(around:{radio},{lat},{lon})["{k}"="{v}"];') # Vías/caminos con esa etiqueta
+        if not tags: # Sin mapeo: respaldo por nombre anclado y escapado (ver construir_query)
+            partes.append(f'node(around:{radio},{lat},{lon})[~"name"~"^{re.escape(kw_normalizada)}", i];') # Solo nodos
+
+    return f"""
+    [out:json][timeout:120]{_cabecera_bbox(puntos, radio)}[maxsize:536870912];
+    (
+      {"".join(partes)}
+    );
+    out center;
+    """ # Una única query con la unión de todas las zonas del lote
+
+def obtener_competencia_lote(filas, radio, negocio, cps, session=None):
+
+    ################################################################################
+    # Obtiene la competencia de TODAS las filas con una petición Overpass por cada
+    # lote de 25 locales, en vez de una petición por local. Los elementos de la
+    # respuesta se reparten entre los locales midiendo la distancia haversine a
+    # cada centro (un competidor puede aparecer en varios locales cercanos).
+    # Si el lote falla, las filas afectadas caen a obtener_competencia individual.
+    #
+    # RECIBE:
+    # - filas (lista): Tuplas (lat, lon, numero) o None por fila inválida.
+    # - radio (int): Radio de búsqueda en metros.
+    # - negocio (str): Tipo de negocio a buscar.
+    # - cps (lista de str): CP de referencia de cada fila (mismo orden).
+    # - session: requests.Session compartida (opcional).
+    #
+    # DEVUELVE:
+    # - list: Una lista de tuplas (nombre, cp) por fila, alineada con `filas`.
+    ################################################################################
+
+    resultados = [[] for _ in filas] # Una lista de competidores por fila, vacía por defecto
+    if not _merece_consulta(negocio): # Palabra clave inútil: ni una petición
+        return resultados # Columnas vacías sin tocar la red
+    validos = [(idx, f[0], f[1]) for idx, f in enumerate(filas) if f is not None] # Filas con coordenadas útiles
+    http = session if session is not None else _SESION # Sesión keep-alive a usar
+
+    for inicio in range(0, len(validos), 25): # Lotes de 25 locales por petición
+        lote = validos[inicio:inicio + 25] # Sublote actual
+        try: # Un fallo del lote no es crítico: esas filas se reintentan una a una
+            query = construir_query_lote([(la, lo) for _, la, lo in lote], radio, negocio) # Query con la unión de zonas
+            response = _peticion_overpass(http, query, timeout=120) # Una petición para todo el lote, con backoff
+            if response.status_code != 200: # Respuesta no válida (saturación, rechazo...)
+                raise RuntimeError(f"HTTP {response.status_code}") # Forzamos el camino de respaldo
+            elementos = response.json().get("elements", []) # Todos los hits de todas las zonas juntos
+
+            # Precalculamos la posición de cada elemento (los way usan su centro)
+            posiciones = [] # (lat, lon, tags) por elemento con coordenadas conocidas
+            for elem in elementos: # Recorremos los hits del lote
+                centro = elem.get("center", {}) # Los way devuelven su centro con `out center`
+                e_lat = elem.get("lat", centro.get("lat")) # Latitud del nodo o del centro
+                e_lon = elem.get("lon", centro.get("lon")) # Longitud del nodo o del centro
+                if e_lat is not None and e_lon is not None: # Solo elementos localizables
+                    posiciones.append((e_lat, e_lon, elem.get("tags", {}))) # Listo para el reparto
+
+            for idx, la, lo in lote: # Atribuimos cada hit a los locales que lo tienen dentro del radio
+                cercanos = [(e_lat, e_lon, tags) for e_lat, e_lon, tags in posiciones
+                            if _distancia_m(la, lo, e_lat, e_lon) <= radio] # Hits de ESTE local
+                pares = [_extraer_competidor(tags, _cp_del_competidor(tags, e_lat, e_lon, cps[idx]))
+                         for e_lat, e_lon, tags in cercanos[:15]] # Primeros 15, con su CP real si se resuelve
+                resultados[idx] = list(dict.fromkeys(pares)) # Sin duplicados y con orden estable entre ejecuciones
+        except Exception as e: # El lote entero falló: respaldo individual para sus filas
+            print(f"  Lote Overpass no disponible ({e}). Consultando una a una...")
+            for idx, la, lo in lote: # Camino clásico por local
+                resultados[idx] = obtener_competencia(la, lo, radio, negocio, cps[idx], session)
+    return resultados # Una lista por fila, en el mismo orden
+
+def obtener_competencia(lat, lon, radio, negocio, cp_local_principal, session=None):
 
     ################################################################################
     # Ejecuta la petición HTTP a la API de Overpass para obtener los competidores
@@ -243,46 +463,67 @@ def obtener_competencia(lat, lon, radio, negocio, cp_local_principal):
     # RECIBE:
     # - lat, lon, radio, negocio: Parámetros de búsqueda.
     # - cp_local_principal: CP de referencia por si el competidor no tiene uno.
+    # - session: requests.Session compartida (keep-alive); si falta, se usa requests.
     #
     # DEVUELVE:
     # - list: Lista de tuplas [(Nombre, CP), ...] únicas.
     ################################################################################
 
+    if not _merece_consulta(negocio): # Palabra clave vacía o demasiado ambigua
+        return [] # Nos ahorramos la petición completa (y el posible escaneo global)
+
+    # Caché en memoria por zona cuantizada (~110 m): la misma manzana con el mismo
+    # negocio y radio devuelve la respuesta de Overpass ya procesada, sin red
+    clave = (round(lat, 3), round(lon, 3), radio, negocio) # Clave de la consulta
+    if clave in _CACHE_COMPETENCIA: # Zona ya consultada en esta ejecución
+        return _CACHE_COMPETENCIA[clave] # Respuesta instantánea desde la caché
+
+    # Reutilización espacial: si un anillo YA consultado (mismo negocio y radio)
+    # tiene su centro a menos de radio/2, sus hits cubren casi toda nuestra zona;
+    # los filtramos por distancia en vez de repetir la petición a Overpass
+    for c_lat, c_lon, c_radio, c_neg, posiciones in _ZONAS_CONSULTADAS: # Escaneo lineal: hay pocas zonas por ciudad
+        if c_neg == negocio and c_radio == radio and _distancia_m(lat, lon, c_lat, c_lon) <= radio / 2:
+            cercanos = [(e_lat, e_lon, tags) for e_lat, e_lon, tags in posiciones
+                        if _distancia_m(lat, lon, e_lat, e_lon) <= radio] # Hits de la zona vecina dentro de NUESTRO radio
+            pares = [_extraer_competidor(tags, _cp_del_competidor(tags, e_lat, e_lon, cp_local_principal))
+                     for e_lat, e_lon, tags in cercanos[:15]] # Mismo formato y límite que el camino normal
+            return list(dict.fromkeys(pares)) # Resultado sin red, con orden estable
+
     try: # Iniciamos el bloque de manejo de errores de red
-        url = "https://overpass-api.de/api/interpreter" # Definimos la URL del endpoint de la API Overpass
         query = construir_query(lat, lon, radio, negocio) # Llamamos a la función auxiliar para construir la query
-        
-        response = requests.get(url, params={'data': query}, timeout=30) # Enviamos la petición GET a la API con un timeout de 30 segundos
-        
+
+        http = session if session is not None else _SESION # Sesión de la pipeline o, en su defecto, la sesión keep-alive del módulo
+        response = _peticion_overpass(http, query, timeout=30) # Petición con reintentos y backoff ante saturación
+
         if response.status_code == 200: # Verificamos si la petición fue exitosa
             data = response.json() # Parseamos la respuesta a formato JSON
             lista = [] # Inicializamos la lista para guardar competidores
             elementos = data.get("elements", []) # Extraemos la lista de elementos encontrados
-            
-            for elem in elementos[:15]:  # Iteramos solo sobre los primeros 15 resultados para no saturar
-                tags = elem.get("tags", {}) # Obtenemos las etiquetas del elemento
-                
-                nombre = tags.get("name", "") # Intentamos extraer el nombre del negocio
-                if not nombre: # Si no tiene nombre definido
-                    # Nombre fallback basado en etiqueta
-                    cat = tags.get("amenity") or tags.get("shop") or tags.get("cuisine") or "Local" # Buscamos una categoría genérica para identificarlo
-                    nombre = f"({cat})" # Asignamos la categoría entre paréntesis como nombre provisional
-
-                cp = tags.get("addr:postcode", cp_local_principal) # Intentamos obtener el CP del competidor o usamos el del local principal si falta
-                lista.append((nombre, cp)) # Añadimos la tupla con los datos a la lista
-            
-            return list(set(lista)) # Devolvemos la lista eliminando duplicados mediante un set
-        
-        elif response.status_code == 429: # Si recibimos un error de "Demasiadas peticiones"
-            time.sleep(2) # Esperamos 2 segundos antes de continuar
-            
+            zona = [] # Hits localizables de TODA la respuesta, para reutilización espacial
+
+            for elem in elementos: # Recorremos todos los hits (los primeros 15 alimentan el resultado)
+                tags = elem.get("tags", {}) # Etiquetas del elemento
+                centro = elem.get("center", {}) # Los way traen su centro gracias a `out center`
+                e_lat = elem.get("lat", centro.get("lat")) # Posición real del competidor
+                e_lon = elem.get("lon", centro.get("lon")) # Posición real del competidor
+                if e_lat is not None and e_lon is not None: # Guardamos los localizables para zonas vecinas
+                    zona.append((e_lat, e_lon, tags)) # Posición + etiquetas del hit
+                if len(lista) < 15: # Solo los primeros 15 entran en el resultado, como siempre
+                    cp_defecto = _cp_del_competidor(tags, e_lat, e_lon, cp_local_principal) # CP propio si se puede resolver
+                    lista.append(_extraer_competidor(tags, cp_defecto)) # Tupla (nombre, cp) del elemento
+
+            resultado = list(dict.fromkeys(lista)) # Sin duplicados Y conservando el orden de llegada (determinista)
+            _CACHE_COMPETENCIA[clave] = resultado # Solo cacheamos respuestas correctas del servicio
+            _ZONAS_CONSULTADAS.append((lat, lon, radio, negocio, zona)) # El anillo queda disponible para vecinos
+            return resultado # Devolvemos la lista de competidores
+
     except Exception as e: # Capturamos cualquier otro error de conexión
         print(f"Error conexión OSM: {e}") # Imprimimos el error (permitido excepcionalmente para debug)
         pass # Continuamos la ejecución
         
     return [] # Devolvemos una lista vacía si falló la búsqueda
 
-def busqueda_competencia(df_1, radio=500, negocio=""):
+def busqueda_competencia(df_1, radio=500, negocio="", session=None):
 
     ################################################################################
     # Analiza la competencia iterando sobre el DataFrame de inmuebles.
@@ -294,6 +535,7 @@ def busqueda_competencia(df_1, radio=500, negocio=""):
     # - df_1 (DataFrame): Datos de entrada del módulo 1.
     # - radio (int): Radio de búsqueda en metros.
     # - negocio (str): Tipo de negocio para buscar rivales.
+    # - session: requests.Session compartida para reutilizar conexiones (opcional).
     #
     # DEVUELVE:
     # - DataFrame: df_1 enriquecido con columnas CODIGO_POSTAL y COMPETENCIA.
@@ -304,38 +546,63 @@ def busqueda_competencia(df_1, radio=500, negocio=""):
     df_2 = df_1.copy() # Creamos una copia del DataFrame para no modificar el original
     if df_2.empty: return df_2 # Si el DataFrame está vacío, lo devolvemos tal cual
 
-    lista_cps = [] # Inicializamos la lista para guardar los Códigos Postales
-    lista_comp = [] # Inicializamos la lista para guardar las listas de competidores
-    
-    for index, row in df_2.iterrows(): # Recorremos cada fila del DataFrame
-        try: # Intentamos procesar cada local
-            coords = row['COORDENADAS'] # Extraemos las coordenadas de la fila actual
-            if isinstance(coords, str): # Si las coordenadas vienen como texto
-                try: coords = eval(coords) # Intentamos convertirlas a tupla evaluando el string
+    # Preparación síncrona: validamos y desempaquetamos las coordenadas de cada fila.
+    # Las dos columnas se extraen UNA vez como arrays y se recorren con zip: sin el
+    # coste de iterrows, que construye una Series nueva por cada fila del DataFrame
+    filas = [] # (lat, lon, numero) por fila válida; None si las coordenadas no sirven
+    for coords, numero in zip(df_2['COORDENADAS'].to_numpy(), df_2['NUMERO'].to_numpy()): # Tuplas planas, sin Series
+        if isinstance(coords, str): # Si las coordenadas vienen como texto
+            try: # Camino rápido para el caso común "(lat, lon)": split + float, sin parser
+                izquierda, derecha = coords.strip("() ").split(",", 1) # Dos mitades de la tupla
+                coords = (float(izquierda), float(derecha)) # Conversión directa
+            except Exception: # Formato menos habitual: parser de literales (seguro, sin ejecutar código)
+                try: coords = literal_eval(coords) # Solo acepta estructuras literales, a diferencia de eval
                 except: coords = (0,0) # Si falla, asignamos coordenadas nulas
-            
-            if not isinstance(coords, (tuple, list)) or len(coords) < 2: # Verificamos si el formato de coordenadas es válido
-                lista_cps.append("00000"); lista_comp.append([]) # Si no es válido, añadimos valores vacíos
-                continue # Saltamos a la siguiente fila
-                
-            lat, lon = coords[0], coords[1] # Desempaquetamos latitud y longitud
-            
-            # 1. CP
-            cp_zona = obtener_cp_latlon(lat, lon) # Llamamos a la función para obtener el CP de esas coordenadas
-            lista_cps.append(cp_zona) # Guardamos el CP encontrado
-            
-            # 2. Competencia (Solo si hay negocio definido)
-            competidores = [] # Inicializamos la lista de competidores local
-            if negocio: # Si el usuario definió un negocio a buscar
-                competidores = obtener_competencia(lat, lon, radio, negocio, cp_zona) # Buscamos la competencia usando la función auxiliar
-            
-            lista_comp.append(competidores) # Añadimos la lista de competidores encontrada a la lista general
-            print(f"  > Local {row['NUMERO']}: CP {cp_zona} | {len(competidores)} competidores encontrados")
-            time.sleep(0.5) # Hacemos una pequeña pausa para no saturar las APIs
-            
+        if not isinstance(coords, (tuple, list)) or len(coords) < 2: # Verificamos si el formato de coordenadas es válido
+            filas.append(None) # Fila sin coordenadas útiles: recibirá los valores por defecto
+        else:
+            filas.append((coords[0], coords[1], numero)) # Fila lista para consultar las APIs
+
+    def _procesar_fila(fila): # Trabajo de red de UNA fila: su CP (la competencia va por lotes)
+        if fila is None: return "00000" # Sin coordenadas no hay nada que consultar
+        lat, lon, numero = fila # Desempaquetamos latitud, longitud e identificador
+        try: # Intentamos procesar cada local
+            return obtener_cp_latlon(lat, lon) # El ritmo lo marca el RateLimiter del servicio, no un sleep fijo
         except Exception as e: # Capturamos errores en el procesamiento de la fila
-            print(f"  Error fila {index}: {e}") # Imprimimos el error específico
-            lista_cps.append("00000"); lista_comp.append([]) # Añadimos valores vacíos para mantener la integridad de las columnas
+            print(f"  Error local {numero}: {e}") # Imprimimos el error específico
+            return "00000" # Valor por defecto para mantener la integridad de la columna
+
+    async def _procesar_todas(filas): # Orquestación: varias filas en vuelo a la vez
+        sem = asyncio.Semaphore(4) # Máximo 4 peticiones simultáneas (límite de la instancia pública de Overpass)
+        async def _una(fila): # Una tarea por fila, acotada por el semáforo
+            async with sem: # Respetamos el límite de concurrencia
+                return await asyncio.to_thread(_procesar_fila, fila) # El trabajo bloqueante va a un hilo
+        return await asyncio.gather(*[_una(f) for f in filas]) # gather conserva el orden de las filas
+
+    async def _ejecutar_fases(): # CPs y competencia en paralelo: son independientes entre sí
+        # El CP del local solo actúa como ÚLTIMO recurso para competidores sin código
+        # postal resoluble, así que la fase Overpass arranca con None como marcador
+        # y el hueco se rellena cuando ambas fases han terminado
+        tarea_comp = asyncio.to_thread(obtener_competencia_lote, filas, radio, negocio,
+                                       [None] * len(filas), session) # Lote(s) Overpass en su propio hilo
+        return await asyncio.gather(_procesar_todas(filas), tarea_comp) # Las dos fases a la vez
+
+    if filas and negocio: # Ambas fases tienen trabajo: las solapamos
+        lista_cps, comp_cruda = asyncio.run(_ejecutar_fases()) # Resultados de ambas fases
+        lista_cps = list(lista_cps) # CPs alineados con el DataFrame
+        # Sustituimos el marcador None por el CP del local, ya conocido
+        lista_comp = [[(nombre, cp if cp is not None else cp_zona) for nombre, cp in comp]
+                      for comp, cp_zona in zip(comp_cruda, lista_cps)] # Último recurso aplicado a posteriori
+    else: # Sin negocio (o sin filas): solo hace falta la fase de CPs
+        lista_cps = list(asyncio.run(_procesar_todas(filas))) if filas else [] # CPs alineados con el DataFrame
+        lista_comp = [[] for _ in filas] # Una lista vacía por fila
+
+    # Informe por fila acumulado y volcado en UNA escritura: cada print suelto
+    # fuerza un flush síncrono de stdout, que en terminales lentas cuesta ms/línea
+    lineas = [f"  > Local {fila[2]}: CP {cp_zona} | {len(competidores)} competidores encontrados"
+              for fila, cp_zona, competidores in zip(filas, lista_cps, lista_comp)
+              if fila is not None] # Solo las filas que llegaron a consultarse
+    if lineas: print("\n".join(lineas)) # Un único volcado con todo el informe
 
     df_2['CODIGO_POSTAL'] = lista_cps # Asignamos la lista de CPs a una nueva columna
     df_2['COMPETENCIA'] = lista_comp # Asignamos la lista de competidores a una nueva columna
@@ -26,41 +26,139 @@
 # - Math: Cálculos de geometría esférica (Fórmula de Haversine) para distancias.
 ################################################################################
 
-from selenium import webdriver # Importamos el controlador principal de Selenium para automatizar el navegador
-from selenium.webdriver.common.by import By # Importamos la herramienta para localizar elementos en el DOM (HTML)
+import requests # Importamos requests para descargar las páginas de resultados por HTTP plano
+from requests.adapters import HTTPAdapter, Retry # Importamos el adaptador para dimensionar el pool de conexiones y reintentar fallos transitorios
+import asyncio # Importamos asyncio para lanzar las búsquedas de varios locales en paralelo
+import functools # Importamos functools para memoizar las notas de competidores repetidos (cadenas, franquicias)
+import threading # Importamos threading para proteger la caché persistente frente a los hilos concurrentes
+import pickle # Importamos pickle para guardar las notas entre ejecuciones
+import os # Importamos os para construir la ruta de la caché en disco
 import time # Importamos la librería de tiempo para gestionar pausas y esperas
 import ast # Importamos AST para evaluar cadenas de texto que contienen listas de forma segura
 import random # Importamos random para generar esperas aleatorias y parecer humanos
 import re # Importamos expresiones regulares para buscar patrones de notas en el texto
+import numpy as np # Importamos numpy para el conteo vectorizado de notas por local
+# selectolax es OPCIONAL: parser HTML5 en C (lexbor) que extrae el texto visible sin renderizar nada
+try:
+    from selectolax.lexbor import LexborHTMLParser # Motor nativo de parseo HTML
+    TIENE_SELECTOLAX = True # Podemos reducir la SERP a su texto visible antes del regex
+except ImportError: # Si selectolax no está instalado
+    TIENE_SELECTOLAX = False # El regex trabaja sobre el HTML crudo
 
 UMBRAL_BUENO = 3.8 # Definimos la nota de corte para considerar un local como "buena competencia"
 
-def iniciar_driver():
+# User Agent de navegador real para evitar que nos den versiones "móviles" reducidas
+_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36" # Definimos un User-Agent legítimo
+
+_SESION = requests.Session() # Creamos una sesión compartida para reutilizar conexiones HTTP (keep-alive)
+_SESION.headers.update({"User-Agent": _UA, "Accept-Language": "es-ES,es;q=0.9"}) # Forzamos UA real e idioma español para que los patrones "x de 5" funcionen
+# Dimensionamos el pool de conexiones al número de hilos concurrentes: cada worker
+# reutiliza su conexión TLS viva en vez de renegociar el handshake en cada petición
+_ADAPTADOR = HTTPAdapter(pool_connections=4, pool_maxsize=8, # Pool acorde al Semaphore(4) del procesamiento concurrente
+                         max_retries=Retry(total=2, backoff_factor=0.3)) # Reintentamos fallos transitorios con espera creciente
+_SESION.mount("https://", _ADAPTADOR) # Aplicamos el adaptador a todo el tráfico seguro
+_SESION.mount("http://", _ADAPTADOR) # Y también al tráfico plano por si alguna URL lo usa
+
+# --- CACHÉ PERSISTENTE DE NOTAS ---
+# Las notas de un negocio cambian muy despacio: las guardamos en disco (misma
+# carpeta que la caché de P1 en app.py) para que ejecuciones sucesivas solo
+# scrapeen competidores nuevos
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "business_explorer") # Carpeta de caché compartida con app.py
+_RUTA_NOTAS = os.path.join(_CACHE_DIR, "p3_notas.pkl") # Archivo con el diccionario {(nombre, cp): (nota, timestamp)}
+_TTL_NOTA = 30 * 86400 # Una nota encontrada vale 30 días
+_TTL_FALLO = 86400 # Un None (no encontrada) se reintenta al día siguiente
+_CANDADO_NOTAS = threading.Lock() # Candado para escrituras desde los hilos concurrentes
+
+# --- LIMITADOR DE RITMO (cubo de fichas) ---
+# Sustituye a la espera fija de 1-1.5s por petición: permitimos hasta _RITMO_MAX
+# peticiones/segundo al buscador y solo dormimos cuando el cubo se queda vacío,
+# de modo que los hilos aprovechan el ancho de banda real sin martillear a DDG
+_RITMO_MAX = 4.0 # Peticiones por segundo permitidas contra el buscador
+_CAPACIDAD_CUBO = 4.0 # Ráfaga máxima acumulable cuando llevamos tiempo sin pedir
+_CANDADO_RITMO = threading.Lock() # Candado del estado del cubo (lo tocan varios hilos)
+_fichas = _CAPACIDAD_CUBO # Fichas disponibles ahora mismo
+_ultimo_relleno = time.monotonic() # Instante del último rellenado del cubo
+
+def _esperar_turno():
 
     ################################################################################
-    # Configura e inicializa una instancia del navegador Chrome controlada por
-    # Selenium. Establece parámetros críticos como el modo "headless" (sin interfaz
-    # gráfica), el tamaño de ventana y un "User-Agent" rotatorio o realista para
-    # reducir el riesgo de bloqueo por parte de los buscadores.
+    # Bloquea el hilo llamante solo el tiempo imprescindible para respetar el
+    # ritmo máximo de peticiones: rellena el cubo según el tiempo transcurrido,
+    # consume una ficha si la hay y, si no, duerme justo hasta la siguiente.
+    #
+    # RECIBE: nada
+    #
+    # DEVUELVE: nada
+    ################################################################################
+
+    global _fichas, _ultimo_relleno # Estado compartido del cubo
+    while True: # Repetimos hasta conseguir ficha
+        with _CANDADO_RITMO: # Solo un hilo toca el cubo a la vez
+            ahora = time.monotonic() # Reloj monótono: inmune a cambios de hora del sistema
+            _fichas = min(_CAPACIDAD_CUBO, _fichas + (ahora - _ultimo_relleno) * _RITMO_MAX) # Rellenamos según el tiempo transcurrido
+            _ultimo_relleno = ahora # Actualizamos el instante del relleno
+            if _fichas >= 1.0: # Si hay ficha disponible
+                _fichas -= 1.0 # La consumimos
+                return # Y dejamos pasar la petición sin dormir
+            falta = (1.0 - _fichas) / _RITMO_MAX # Tiempo exacto hasta que habrá una ficha
+        time.sleep(falta) # Dormimos fuera del candado para no bloquear al resto
+
+def _cargar_notas():
+
+    ################################################################################
+    # Lee la caché persistente de notas descartando las entradas caducadas.
     #
     # RECIBE: nada
     #
     # DEVUELVE:
-    # - driver (WebDriver): Instancia del navegador lista para navegar.
+    # - dict: {(nombre, cp): (nota | None, timestamp)} con entradas aún vigentes.
+    ################################################################################
+
+    try: # La lectura de caché nunca debe tumbar el programa
+        with open(_RUTA_NOTAS, "rb") as f: # Abrimos el archivo de caché
+            crudo = pickle.load(f) # Recuperamos el diccionario guardado
+        ahora = time.time() # Momento actual para comparar caducidades
+        return {clave: (nota, ts) for clave, (nota, ts) in crudo.items() # Conservamos solo entradas vigentes
+                if ahora - ts < (_TTL_NOTA if nota is not None else _TTL_FALLO)} # TTL corto para fallos, largo para aciertos
+    except Exception: # Archivo inexistente o corrupto
+        return {} # Empezamos con la caché vacía
+
+_NOTAS_DISCO = _cargar_notas() # Cargamos la caché persistente una vez al importar el módulo
+
+def _guardar_notas():
+
+    ################################################################################
+    # Vuelca la caché de notas a disco. Se llama una sola vez al final del módulo
+    # para no pagar una escritura por competidor.
+    #
+    # RECIBE: nada
+    #
+    # DEVUELVE: nada
     ################################################################################
 
-    options = webdriver.ChromeOptions() # Creamos el objeto de configuración para Chrome
-    options.add_argument("--headless") # Activamos el modo invisible para que no se abra la ventana
-    options.add_argument("--log-level=3") # Silenciamos los logs técnicos del driver para limpiar la salida
-    options.add_argument("--window-size=1920,1080") # Establecemos una resolución estándar para evitar versiones móviles de webs
-    # User Agent de navegador real para evitar que nos den versiones "móviles" reducidas
-    ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36" # Definimos un User-Agent legítimo
-    options.add_argument(f"user-agent={ua}") # Asignamos el User-Agent a la configuración
-    options.add_argument("--lang=es-ES") # Forzamos el idioma español para que los patrones "x de 5" funcionen
-    
-    driver = webdriver.Chrome(options=options) # Inicializamos el navegador con las opciones configuradas
-    return driver # Devolvemos la instancia del navegador lista para usar
+    try: # El guardado de caché nunca debe tumbar el programa
+        os.makedirs(_CACHE_DIR, exist_ok=True) # Nos aseguramos de que la carpeta exista
+        with open(_RUTA_NOTAS, "wb") as f: # Abrimos el archivo en modo escritura binaria
+            pickle.dump(_NOTAS_DISCO, f) # Guardamos el diccionario completo
+    except Exception: # Disco lleno, permisos, etc.
+        pass # Seguimos sin caché persistente
+
+# --- PATRÓN DE NOTA FUSIONADO ---
+# Fusionamos los ocho patrones (6 de base 5 + 2 de base 10) en una sola alternativa
+# con grupos nombrados: el texto se recorre UNA vez en lugar de ocho, y el prefijo
+# del grupo que dispara (b10/b5) nos dice si hay que dividir entre 2
+_PATRON_NOTA = re.compile( # Compilamos una única expresión con todas las variantes de nota
+    r"(?P<b10a>\d[.,]\d)\s?/\s?10"          # Buscamos formato "9.2/10" (antes que /5 para no cortar el 10)
+    r"|(?P<b10b>\d[.,]\d)\s?de\s?10"        # Buscamos formato "9.2 de 10"
+    r"|(?P<b5a>\d[.,]\d)\s?/\s?5"           # Buscamos formato "4.5/5"
+    r"|(?P<b5b>\d[.,]\d)\s?de\s?5"          # Buscamos formato "4,5 de 5"
+    r"|Puntuación:\s?(?P<b5c>\d[.,]\d)"     # Buscamos formato "Puntuación: 4.5"
+    r"|Valoración:\s?(?P<b5d>\d[.,]\d)"     # Buscamos formato "Valoración: 4.5"
+    r"|(?P<b5e>\d[.,]\d)\s?estrellas"       # Buscamos formato "4.5 estrellas"
+    r"|Rating:\s?(?P<b5f>\d[.,]\d)",        # Buscamos formato inglés "Rating: 4.5"
+    re.IGNORECASE) # Ignoramos mayúsculas igual que hacían los patrones sueltos
 
+@functools.lru_cache(maxsize=8192) # Los mismos nombres se normalizan una y otra vez: memoizamos el resultado
 def limpiar_nombre_busqueda(nombre):
 
     ################################################################################
@@ -76,168 +174,228 @@ def limpiar_nombre_busqueda(nombre):
     # - str: Nombre optimizado para la query de búsqueda.
     ################################################################################
 
-    n = nombre.lower() # Convertimos el nombre a minúsculas para analizarlo
-    if len(n.split()) < 2: # Si el nombre tiene menos de 2 palabras (es muy corto)
+    if " " not in nombre.strip(): # Sin espacios interiores = una sola palabra (nos ahorramos la lista temporal de .split())
         return f"{nombre} restaurante" # Le añadimos la palabra "restaurante" para dar contexto
     return nombre # Si es largo, lo devolvemos tal cual
 
-def buscar_nota_duckduckgo(driver, nombre, cp):
-    
+@functools.lru_cache(maxsize=4096) # Memoizamos por (nombre normalizado, cp): las cadenas repetidas en varias zonas solo se consultan una vez
+def _nota_cacheada(nombre_busqueda, cp, session=None):
+
     ################################################################################
-    # Ejecuta una búsqueda específica en DuckDuckGo combinando nombre, código postal
-    # y palabras clave. Analiza el texto visible de la página de resultados (SERP)
-    # buscando patrones de puntuación (ej: "4.5/5", "9 de 10") mediante expresiones
-    # regulares. Normaliza cualquier escala encontrada a un rango estándar de 0 a 5.
+    # Resuelve la nota de una query ya normalizada con dos niveles de caché:
+    # primero el diccionario persistente en disco (ejecuciones anteriores) y,
+    # si no está, la red. Memoizada además con lru_cache para que cada par
+    # (nombre normalizado, CP) se resuelva como máximo una vez por ejecución.
     #
     # RECIBE:
-    # - driver: Instancia del navegador activa.
-    # - nombre (str): Nombre del competidor.
+    # - nombre_busqueda (str): Nombre ya limpiado y en minúsculas.
     # - cp (str): Código Postal para acotar geográficamente.
+    # - session (requests.Session | None): Sesión HTTP a reutilizar (opcional).
+    #
+    # DEVUELVE:
+    # - float: Nota normalizada (0.0 - 5.0) o None si no se encuentra.
+    ################################################################################
+
+    entrada = _NOTAS_DISCO.get((nombre_busqueda, cp)) # Primer nivel: caché persistente de ejecuciones anteriores
+    if entrada is not None: # Si la nota ya está en disco y vigente
+        return entrada[0] # La devolvemos sin tocar la red
+
+    nota = _nota_en_red(nombre_busqueda, cp, session) # Segundo nivel: scraping real de la SERP
+    with _CANDADO_NOTAS: # Protegemos la escritura frente a otros hilos
+        _NOTAS_DISCO[(nombre_busqueda, cp)] = (nota, time.time()) # Guardamos el resultado (incluso None, con TTL corto)
+    return nota # Devolvemos la nota recién obtenida
+
+def _nota_en_red(nombre_busqueda, cp, session=None):
+
+    ################################################################################
+    # Descarga y analiza la SERP de DuckDuckGo para una query ya normalizada.
+    #
+    # RECIBE:
+    # - nombre_busqueda (str): Nombre ya limpiado y en minúsculas.
+    # - cp (str): Código Postal para acotar geográficamente.
+    # - session (requests.Session | None): Sesión HTTP a reutilizar (opcional).
     #
     # DEVUELVE:
     # - float: Nota normalizada (0.0 - 5.0) o None si no se encuentra.
     ################################################################################
 
     try: # Iniciamos el bloque de manejo de errores
-        nombre_busqueda = limpiar_nombre_busqueda(nombre) # Limpiamos el nombre antes de buscar
+        http = session if session is not None else _SESION # Usamos la sesión recibida o la compartida del módulo
         # Búsqueda: Nombre + CP + "opiniones"
         query = f"{nombre_busqueda} {cp} opiniones" # Construimos la cadena de búsqueda con intención de encontrar reseñas
-        url = f"https://duckduckgo.com/?q={query}&kl=es-es" # Construimos la URL de DuckDuckGo forzando región España
-        
-        driver.get(url) # Navegamos a la URL construida
-        time.sleep(random.uniform(1.0, 1.5)) # Esperamos un tiempo aleatorio para simular comportamiento humano
-        
-        # Obtenemos todo el texto visible
-        try: cuerpo = driver.find_element(By.TAG_NAME, "body").text # Intentamos extraer todo el texto del cuerpo de la página
-        except: return None # Si falla la extracción del body, devolvemos None
-            
-        # --- PATRONES DE NOTA AMPLIADOS ---
-        # El orden importa: primero los más específicos
-        patrones = [ # Definimos una lista de expresiones regulares para cazar la nota
-            r"(\d[.,]\d)\s?/\s?5",          # Buscamos formato "4.5/5"
-            r"(\d[.,]\d)\s?de\s?5",         # Buscamos formato "4,5 de 5"
-            r"Puntuación:\s?(\d[.,]\d)",    # Buscamos formato "Puntuación: 4.5"
-            r"Valoración:\s?(\d[.,]\d)",    # Buscamos formato "Valoración: 4.5"
-            r"(\d[.,]\d)\s?estrellas",      # Buscamos formato "4.5 estrellas"
-            r"Rating:\s?(\d[.,]\d)"         # Buscamos formato inglés "Rating: 4.5"
-        ]
-        
-        for patron in patrones: # Iteramos sobre cada patrón definido
-            match = re.search(patron, cuerpo, re.IGNORECASE) # Buscamos el patrón en el texto de la web ignorando mayúsculas
-            if match: # Si encontramos una coincidencia
-                texto_nota = match.group(1).replace(",", ".") # Extraemos el número y normalizamos decimales (coma a punto)
-                nota = float(texto_nota) # Convertimos el texto a número decimal
-                if 0.0 <= nota <= 5.0: # Verificamos que la nota sea coherente (rango 0-5)
-                    return nota # Devolvemos la nota encontrada
-        
-        # INTENTO SECUNDARIO: Si falla lo anterior, buscar patrones de TripAdvisor/TheFork
-        # A veces sale "9.2/10". Lo convertimos a base 5.
-        patrones_base10 = [ # Definimos patrones para escalas sobre 10
-            r"(\d[.,]\d)\s?/\s?10", # Buscamos formato "9.2/10"
-            r"(\d[.,]\d)\s?de\s?10" # Buscamos formato "9.2 de 10"
-        ]
-        for patron in patrones_base10: # Iteramos sobre los patrones de base 10
-            match = re.search(patron, cuerpo, re.IGNORECASE) # Buscamos coincidencia en el texto
-            if match: # Si encontramos coincidencia
-                texto_nota = match.group(1).replace(",", ".") # Normalizamos el formato numérico
-                nota = float(texto_nota) / 2 # Convertimos la nota de base 10 a base 5
-                if 0.0 <= nota <= 5.0: # Verificamos la coherencia del resultado
-                    return nota # Devolvemos la nota convertida
+        url = "https://lite.duckduckgo.com/lite/" # Endpoint "lite": HTML mínimo renderizado en servidor, sin JavaScript ni anuncios pesados
+
+        for intento in range(3): # Hasta 3 intentos si el buscador nos pide calma
+            _esperar_turno() # Respetamos el ritmo máximo de peticiones (cubo de fichas)
+            respuesta = http.get(url, params={"q": query, "kl": "es-es"}, timeout=5) # Descargamos la SERP forzando región España
+            if respuesta.status_code in (429, 503): # Si nos limitan o el servicio está saturado
+                try: espera = float(respuesta.headers.get("Retry-After", "")) # Respetamos la espera que pida el servidor
+                except ValueError: espera = (2 ** intento) + random.random() # Si no la indica, backoff exponencial con jitter
+                time.sleep(espera) # Esperamos antes de reintentar
+                continue # Reintentamos la descarga
+            break # Cualquier otra respuesta sale del bucle de reintentos
+        if respuesta.status_code != 200: # Si el buscador no responde correctamente
+            return None # No hay nada que analizar
+        if TIENE_SELECTOLAX: # CAMINO RÁPIDO: reducimos la página a su texto visible con lexbor (C)
+            cuerpo = LexborHTMLParser(respuesta.text).root.text(separator=" ") # Texto plano sin etiquetas ni atributos (menos bytes y menos falsos positivos)
+        else: # Sin selectolax
+            cuerpo = respuesta.text # Usamos el HTML plano como texto donde cazar la nota
+
+        for match in _PATRON_NOTA.finditer(cuerpo): # Recorremos el texto UNA sola vez cazando cualquier variante de nota
+            grupo = match.group(match.lastgroup) # El grupo que disparó es siempre "dígito-separador-dígito" (3 caracteres)
+            nota = (ord(grupo[0]) - 48) + (ord(grupo[2]) - 48) * 0.1 # Aritmética directa sobre los dos dígitos: sin replace ni parser de float
+            if match.lastgroup.startswith("b10"): # Si el grupo es de escala sobre 10 (TripAdvisor/TheFork)
+                nota = nota / 2 # Convertimos la nota de base 10 a base 5
+            if 0.0 <= nota <= 5.0: # Verificamos que la nota sea coherente (rango 0-5)
+                return nota # Devolvemos la primera nota válida encontrada
 
         return None # Si no encontramos ningún patrón válido, devolvemos None
 
     except Exception: # Capturamos cualquier error durante el proceso
         return None # Devolvemos None en caso de fallo
 
-def analizar_reputacion(df_2):
-    
+@functools.lru_cache(maxsize=None) # Los barrios colindantes comparten cadenas idénticas: cada una se parsea una sola vez
+def _parsear_competencia(texto):
+
+    ################################################################################
+    # Evalúa de forma segura la representación en texto de una lista de
+    # competidores. Memoizada: el parseo AST (caro para listas largas) se paga
+    # como máximo una vez por cadena distinta.
+    #
+    # RECIBE:
+    # - texto (str): Representación tipo "[('Nombre', 'CP'), ...]".
+    #
+    # DEVUELVE:
+    # - tuple: Tupla de competidores, vacía si el texto no es evaluable.
+    ################################################################################
+
+    try: return tuple(ast.literal_eval(texto)) # Evaluamos una vez y congelamos en tupla (cacheable)
+    except Exception: return () # Si falla, asumimos que no hay competidores
+
+def buscar_nota_duckduckgo(nombre, cp, session=None):
+
+    ################################################################################
+    # Fachada de búsqueda de notas: normaliza el nombre del competidor y delega en
+    # la versión cacheada. Así la clave de caché es estable aunque el mismo negocio
+    # llegue escrito con mayúsculas distintas desde OSM.
+    #
+    # RECIBE:
+    # - nombre (str): Nombre del competidor.
+    # - cp (str): Código Postal para acotar geográficamente.
+    # - session (requests.Session | None): Sesión HTTP a reutilizar (opcional).
+    #
+    # DEVUELVE:
+    # - float: Nota normalizada (0.0 - 5.0) o None si no se encuentra.
+    ################################################################################
+
+    return _nota_cacheada(limpiar_nombre_busqueda(nombre).lower(), cp, session) # Normalizamos la clave y delegamos en la caché
+
+def analizar_reputacion(df_2, session=None):
+
     ################################################################################
     # Función principal del módulo que orquesta la auditoría de reputación.
     # Recorre el DataFrame de inmuebles y, para cada lista de competidores detectada
-    # en el paso anterior, lanza búsquedas web para extraer sus valoraciones.
+    # en el paso anterior, lanza búsquedas web concurrentes (las peticiones HTTP son
+    # puro I/O, así que varios locales se consultan a la vez con asyncio.to_thread).
     # Clasifica a los rivales en "Buenos" o "Malos" según un umbral definido y
     # calcula la nota media del entorno competitivo.
     #
     # RECIBE:
     # - df_2 (DataFrame): DataFrame con la columna 'COMPETENCIA' poblada.
+    # - session (requests.Session | None): Sesión HTTP a reutilizar (opcional).
     #
     # DEVUELVE:
     # - DataFrame: Copia del original con la nueva columna 'NUM_COMPETENCIA'.
     ################################################################################
 
     print(f"\n--- INICIANDO P3: Análisis de Reputación (Búsqueda Mejorada) ---") # Imprimimos mensaje de inicio
-    
+
     df_3 = df_2.copy() # Creamos una copia del DataFrame recibido para no alterar el original
     if df_3.empty: # Si el DataFrame está vacío
         df_3['NUM_COMPETENCIA'] = [] # Añadimos la columna vacía
         return df_3 # Devolvemos el DataFrame vacío
 
-    driver = iniciar_driver() # Iniciamos el navegador automatizado
-    resultados_metricas = [] # Inicializamos la lista donde guardaremos las tuplas de resultados
-    
+    # Pre-asignamos un array estructurado (SoA) en vez de acumular tuplas de Python:
+    # escritura indexada sin realocaciones y, si el usuario cancela a medias, las
+    # filas no procesadas ya valen (0, 0, 0, 0.0) sin relleno posterior
+    metricas_locales = np.zeros(len(df_3), dtype=[('total', 'i4'), ('buenos', 'i4'), # Contadores enteros compactos
+                                                  ('malos', 'i4'), ('nota_media', 'f4')]) # Media en float32 (app.py ya la convierte a float32)
+
     try: # Iniciamos el bloque principal de procesamiento
-        for index, row in df_3.iterrows(): # Iteramos por cada fila (local) del DataFrame
-            competencia_raw = row['COMPETENCIA'] # Extraemos los datos crudos de la columna competencia
-            lista_competidores = [] # Inicializamos la lista de competidores para esta fila
-            
+        filas = [] # Lista de (numero, lista_competidores) ya parseada, en el orden del DataFrame
+        # zip sobre los arrays de numpy evita construir una Series temporal por fila (iterrows)
+        for numero, competencia_raw in zip(df_3['NUMERO'].to_numpy(), df_3['COMPETENCIA'].to_numpy()): # Iteramos por cada fila (local) del DataFrame
             if isinstance(competencia_raw, list): # Si ya es una lista
                 lista_competidores = competencia_raw # La usamos directamente
             elif isinstance(competencia_raw, str): # Si es una cadena de texto (representación de lista)
-                try: lista_competidores = ast.literal_eval(competencia_raw) # Intentamos evaluarla de forma segura
-                except: lista_competidores = [] # Si falla, asumimos lista vacía
+                lista_competidores = _parsear_competencia(competencia_raw) # La parseamos una sola vez (memoizado)
+            else: # Cualquier otro tipo (NaN, None...)
+                lista_competidores = [] # Asumimos que no hay competidores
+            filas.append((numero, lista_competidores)) # Guardamos la fila preparada para las fases de scraping y conteo
+
+        def _es_valido(comp): # Filtro rápido de competidores con formato o nombre inservible
+            return (comp and len(comp) >= 2 # El competidor debe ser una tupla (nombre, cp)
+                    and len(comp[0]) >= 2 and "Local" not in comp[0]) # Descartamos nombres demasiado genéricos o vacíos
+
+        # FASE 1: DEDUPLICACIÓN. Las cadenas (Domino's, McDonald's...) se repiten en
+        # varias zonas: reunimos los pares (nombre, cp) únicos de TODO el DataFrame
+        # y los scrapeamos exactamente una vez, en lugar de una vez por local vecino
+        pares = list(dict.fromkeys((comp[0], comp[1]) # dict.fromkeys deduplica conservando el orden de aparición
+                                   for _, lista_competidores in filas # Recorremos todos los locales
+                                   for comp in lista_competidores if _es_valido(comp))) # Solo pares que superan el filtro
+
+        if pares: # Solo informamos si hay algo que buscar
+            print(f"  > {len(pares)} competidores únicos a consultar...") # Informamos del tamaño real del trabajo de red
+
+        semaforo = asyncio.Semaphore(4) # Limitamos la concurrencia para no castigar al buscador
+
+        async def _consultar(nombre_comp, cp_comp): # Envuelve cada par único en una corrutina acotada por el semáforo
+            async with semaforo: # Respetamos el límite de peticiones simultáneas
+                return await asyncio.to_thread(buscar_nota_duckduckgo, nombre_comp, cp_comp, session) # Scrapeamos en un hilo (el I/O libera el GIL)
 
+        async def _consultar_todos(): # Lanza todos los pares únicos a la vez y espera los resultados en orden
+            return await asyncio.gather(*(_consultar(n, c) for n, c in pares)) # gather conserva el orden de los pares
+
+        notas = dict(zip(pares, asyncio.run(_consultar_todos()))) # Diccionario {(nombre, cp): nota | None} con todo lo scrapeado
+
+        # FASE 2: MÉTRICAS POR LOCAL. Sin red: puro conteo sobre el diccionario de notas
+        for i, (numero, lista_competidores) in enumerate(filas): # Recorremos los locales en su orden original
             total = len(lista_competidores) # Calculamos el total de competidores
-            buenos = 0 # Inicializamos contador de competidores buenos
-            malos = 0 # Inicializamos contador de competidores malos
-            suma_notas = 0.0 # Inicializamos acumulador para la media de notas
-            con_nota = 0 # Inicializamos contador de competidores que sí tienen nota
-            
-            # Solo imprimimos si hay competencia para no saturar la terminal
-            if total > 0: # Si hay competidores para este local
-                print(f"  > Local {row['NUMERO']}: {total} rivales. Buscando notas...") # Informamos al usuario
-
-            for comp in lista_competidores: # Iteramos sobre cada competidor de la lista
-                if not comp or len(comp) < 2: continue # Si el formato del competidor no es válido, saltamos
-                
-                nombre_comp = comp[0] # Extraemos el nombre del competidor
-                cp_comp = comp[1] # Extraemos el código postal del competidor
-                
-                # Filtro rápido de nombres inválidos
-                if len(nombre_comp) < 2 or "Local" in nombre_comp: continue # Descartamos nombres demasiado genéricos o vacíos
-
-                nota = buscar_nota_duckduckgo(driver, nombre_comp, cp_comp) # Llamamos a la función de scraping para obtener la nota
-                
-                if nota is not None: # Si hemos conseguido una nota válida
-                    con_nota += 1 # Incrementamos el contador de competidores con nota
-                    suma_notas += nota # Sumamos la nota al acumulador
-                    if nota > UMBRAL_BUENO: # Si la nota supera el umbral definido
-                        buenos += 1 # Lo contamos como competidor bueno
-                    else: # Si no supera el umbral
-                        malos += 1 # Lo contamos como competidor malo
-                    # print(f"    found: {nombre_comp} -> {nota}") # Descomentar para debug
-                
+            claves = [(comp[0], comp[1]) for comp in lista_competidores if _es_valido(comp)] # Claves válidas de esta fila
+
+            # Conteo vectorizado: volcamos las notas a un array (None -> NaN) y las
+            # comparaciones enmascaradas de numpy sustituyen al if/else por competidor
+            arr = np.fromiter((np.nan if notas.get(clave) is None else notas[clave] for clave in claves),
+                              dtype=np.float64, count=len(claves)) # Array de notas de la fila sin lista intermedia
+            valida = ~np.isnan(arr) # Máscara de competidores que sí tienen nota
+            con_nota = int(valida.sum()) # Contador de competidores con nota
+            buenos = int((arr[valida] > UMBRAL_BUENO).sum()) # Los que superan el umbral, contados de golpe
+            malos = con_nota - buenos # El resto de los que tienen nota son malos
+
             if con_nota > 0: # Si hemos encontrado notas para calcular media
-                nota_media = round(suma_notas / con_nota, 2) # Calculamos la media aritmética redondeada
+                nota_media = round(float(arr[valida].sum()) / con_nota, 2) # Calculamos la media aritmética redondeada
             else: # Si no hay notas
                 nota_media = 0.0 # La media es 0
-            
+
             metricas = (total, buenos, malos, nota_media) # Empaquetamos los resultados en una tupla
-            resultados_metricas.append(metricas) # Añadimos la tupla a la lista global
-            
+            metricas_locales[i] = metricas # Escritura indexada en el array preasignado
+
+            # Solo imprimimos si hay competencia para no saturar la terminal
             if total > 0: # Si había competencia
-                print(f"    -> Resultado: {metricas} (Notas encontradas: {con_nota}/{total})") # Imprimimos el resultado del análisis
+                print(f"  > Local {numero}: {metricas} (Notas encontradas: {con_nota}/{total})") # Imprimimos el resultado del análisis
+
+        info_cache = _nota_cacheada.cache_info() # Consultamos las estadísticas de la caché de notas
+        print(f"  > Caché de notas: {info_cache.hits} aciertos / {info_cache.misses} consultas reales") # Cuantificamos cuántas búsquedas nos hemos ahorrado
+        _guardar_notas() # Volcamos la caché persistente a disco una sola vez, al final
 
     except KeyboardInterrupt: # Si el usuario cancela la ejecución manualmente
         print("\nCancelado por usuario.") # Avisamos de la cancelación
     except Exception as e: # Si ocurre cualquier otro error crítico
         print(f"Error P3: {e}") # Imprimimos el error
-    finally: # Al finalizar (bien o mal)
-        driver.quit() # Cerramos el navegador obligatoriamente
 
-    while len(resultados_metricas) < len(df_3): # Si la lista de resultados es más corta que el DataFrame (por error o cancelación)
-        resultados_metricas.append((0,0,0,0.0)) # Rellenamos con ceros para cuadrar tamaños
-        
-    df_3['NUM_COMPETENCIA'] = resultados_metricas # Asignamos la lista de métricas a la nueva columna del DataFrame
+    # tolist() sobre el array estructurado devuelve tuplas (total, buenos, malos, media),
+    # el mismo contrato que app.py descompone después en columnas escalares
+    df_3['NUM_COMPETENCIA'] = metricas_locales.tolist() # Asignamos las métricas a la nueva columna del DataFrame
     print("Módulo P3 finalizado.") # Informamos del fin del módulo
     return df_3 # Devolvemos el DataFrame con los datos de reputación añadidos
 
@@ -27,14 +27,179 @@
 ################################################################################
 
 import requests  # Importamos para realizar peticiones HTTP a las APIs externas
+from requests.adapters import HTTPAdapter, Retry  # Importamos el adaptador para reutilizar conexiones y reintentar con cabeza
 import time  # Importamos para gestionar pausas y evitar saturar los servidores
+import asyncio  # Importamos asyncio para consultar el transporte de varios locales en paralelo
+import pickle  # Importamos pickle para guardar el catálogo de redes entre ejecuciones
+import os  # Importamos os para construir la ruta de la caché en disco
+import threading  # Importamos threading para el limitador de ritmo compartido entre hilos
+import functools  # Importamos functools para memorizar consultas de coordenadas repetidas
+import random  # Importamos random para el jitter de las esperas de reintento
+import csv  # Importamos csv para parsear la salida ligera de Overpass sin pasar por JSON
+import unicodedata  # Importamos unicodedata para comparar nombres de ciudad sin acentos
+import difflib  # Importamos difflib como emparejador difuso de respaldo para erratas leves
+import numpy as np  # Importamos numpy para vectorizar el conteo de estaciones cercanas
 from math import radians, cos, sin, asin, sqrt  # Importamos funciones matemáticas para el cálculo de distancias
 
+# numba es OPCIONAL: si está instalado compilamos el conteo de estaciones a código
+# máquina y si no lo está seguimos con la versión vectorizada de NumPy sin más cambios
+try:
+    from numba import njit  # Compilador JIT que traduce bucles numéricos a C
+    TIENE_NUMBA = True  # Marcamos que podemos usar el camino compilado
+except ImportError:  # Si numba no está instalado en el entorno
+    TIENE_NUMBA = False  # Nos quedamos con el camino NumPy puro
+
 # Configuración de radios de búsqueda en metros
 RADIO_BUS_METRO = 200  # Establecemos el radio de proximidad para transporte pesado
 RADIO_BICIS = 300  # Establecemos el radio de proximidad para estaciones de bicicletas
 MAX_RETRIES = 3  # Definimos el número máximo de reintentos para conexiones de red
 
+# Plantillas de consulta Overpass construidas UNA vez a nivel de módulo: por
+# llamada solo queda rellenar {lat}/{lon}, sin reconstruir la query entera
+_PLANTILLA_CLAUSULAS = (  # Las cinco categorías de transporte alrededor de un punto
+    f'node["highway"="bus_stop"](around:{RADIO_BUS_METRO},{{lat}},{{lon}});'
+    f'node["public_transport"="platform"]["bus"="yes"](around:{RADIO_BUS_METRO},{{lat}},{{lon}});'
+    f'node["railway"="subway_entrance"](around:{RADIO_BUS_METRO},{{lat}},{{lon}});'
+    f'node["railway"="station"](around:{RADIO_BUS_METRO},{{lat}},{{lon}});'
+    f'node["railway"="tram_stop"](around:{RADIO_BUS_METRO},{{lat}},{{lon}});'
+)  # Bloque de cláusulas reutilizado por la consulta individual y la de lote
+# Pedimos a Overpass salida CSV con SOLO las columnas que usa la clasificación:
+# la respuesta pesa una fracción del JSON (que arrastra todos los tags de cada
+# nodo) y se parsea con el módulo csv de la librería estándar
+_CABECERA_CSV = '[out:csv(::id,highway,bus,railway,station;false;",")]'  # Sin fila de cabecera y separado por comas
+PLANTILLA_QUERY = _CABECERA_CSV + "[timeout:25];(" + _PLANTILLA_CLAUSULAS + ");out body;"  # Consulta completa de un solo punto
+
+# Sesión compartida del módulo: reutiliza la conexión TLS con Overpass/CityBikes
+# (el handshake cuesta 100-300 ms) y reintenta sola los fallos transitorios
+# respetando la cabecera Retry-After que envía Overpass en los 429
+_SESION = requests.Session()  # Sesión con keep-alive para todas las llamadas del módulo
+_SESION.headers.update({'User-Agent': 'businessExplorer/1.0'})  # Nos identificamos para no parecer tráfico anónimo
+_ADAPTADOR = HTTPAdapter(pool_connections=8, pool_maxsize=8,  # Pool suficiente para las consultas concurrentes
+                         max_retries=Retry(total=MAX_RETRIES, backoff_factor=1.5,  # Reintentos con espera creciente
+                                           status_forcelist=[429, 502, 503, 504],  # Códigos transitorios que merecen reintento
+                                           respect_retry_after_header=True))  # Obedecemos la espera que pida el servidor
+_SESION.mount('https://', _ADAPTADOR)  # Aplicamos el pool a todas las URLs https (Overpass)
+_SESION.mount('http://', _ADAPTADOR)  # Y también a las http (CityBikes)
+
+# --- LIMITADOR DE RITMO (cubo de fichas) ---
+# Overpass publica un límite de ~2 peticiones/segundo por IP: en vez de pausas
+# fijas, un cubo de fichas deja pasar las consultas a ritmo máximo y solo
+# duerme cuando de verdad vamos demasiado rápido (mismo esquema que en p3)
+_RITMO_OSM = 2.0  # Peticiones por segundo permitidas contra Overpass
+_CANDADO_RITMO = threading.Lock()  # Candado del estado del cubo (lo tocan varios hilos)
+_fichas = _RITMO_OSM  # Fichas disponibles ahora mismo (ráfaga inicial)
+_ultimo_relleno = time.monotonic()  # Instante del último rellenado del cubo
+
+def _esperar_turno():
+
+    ################################################################################
+    # Bloquea el hilo llamante solo el tiempo imprescindible para respetar el
+    # ritmo máximo de consultas a Overpass: rellena el cubo según el tiempo
+    # transcurrido, consume una ficha si la hay y, si no, duerme justo hasta
+    # la siguiente.
+    #
+    # RECIBE: nada
+    #
+    # DEVUELVE: nada
+    ################################################################################
+
+    global _fichas, _ultimo_relleno  # Estado compartido del cubo
+    while True:  # Repetimos hasta conseguir ficha
+        with _CANDADO_RITMO:  # Solo un hilo toca el cubo a la vez
+            ahora = time.monotonic()  # Reloj monótono: inmune a cambios de hora del sistema
+            _fichas = min(_RITMO_OSM, _fichas + (ahora - _ultimo_relleno) * _RITMO_OSM)  # Rellenamos según el tiempo transcurrido
+            _ultimo_relleno = ahora  # Actualizamos el instante del relleno
+            if _fichas >= 1.0:  # Si hay ficha disponible
+                _fichas -= 1.0  # La consumimos
+                return  # Y dejamos pasar la consulta sin dormir
+            falta = (1.0 - _fichas) / _RITMO_OSM  # Tiempo exacto hasta que habrá una ficha
+        time.sleep(falta)  # Dormimos fuera del candado para no bloquear al resto
+
+# Caché en disco del catálogo global de CityBikes: cambia a ritmo de semanas,
+# así que lo guardamos 7 días en la misma carpeta de caché que app.py y p3
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "business_explorer")  # Carpeta de caché compartida
+_RUTA_REDES = os.path.join(_CACHE_DIR, "p4_redes.pkl")  # Archivo con el catálogo de redes de bicis
+_TTL_REDES = 7 * 86400  # Caducidad del catálogo en segundos (7 días)
+
+def _sin_acentos(texto):
+
+    ################################################################################
+    # Elimina los diacríticos de un texto ("Málaga" -> "Malaga") para que la
+    # comparación de nombres de ciudad no dependa de cómo acentúe cada fuente.
+    #
+    # RECIBE:
+    # - texto (str): Texto original.
+    #
+    # DEVUELVE:
+    # - str: Texto sin acentos ni caracteres no ASCII.
+    ################################################################################
+
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode()  # Descomponemos y descartamos los diacríticos
+
+def _catalogo_redes(http):
+
+    ################################################################################
+    # Devuelve el catálogo global de redes de CityBikes, sirviéndolo desde la
+    # caché en disco si tiene menos de 7 días y descargándolo (y guardándolo)
+    # en caso contrario.
+    #
+    # RECIBE:
+    # - http: Sesión HTTP con la que descargar el catálogo si hace falta.
+    #
+    # DEVUELVE:
+    # - list: Listado de redes ([] si la descarga falla).
+    ################################################################################
+
+    try:  # La lectura de caché nunca debe tumbar el programa
+        if os.path.exists(_RUTA_REDES) and (time.time() - os.path.getmtime(_RUTA_REDES)) < _TTL_REDES:  # Existe y no ha caducado
+            with open(_RUTA_REDES, 'rb') as f:  # Abrimos el archivo de caché
+                return pickle.load(f)  # Servimos el catálogo sin tocar la red
+    except Exception:  # Caché corrupta o ilegible
+        pass  # La ignoramos y descargamos
+
+    resp = http.get("http://api.citybik.es/v2/networks", timeout=10)  # Descargamos el catálogo global de redes
+    if resp.status_code != 200:  # Si CityBikes no responde correctamente
+        return []  # Catálogo vacío: el llamante lo gestiona
+    networks = resp.json().get('networks', [])  # Parseamos el listado de todas las redes mundiales
+
+    if networks:  # Solo cacheamos catálogos útiles
+        try:  # El guardado de caché nunca debe tumbar el programa
+            os.makedirs(_CACHE_DIR, exist_ok=True)  # Nos aseguramos de que la carpeta exista
+            with open(_RUTA_REDES, 'wb') as f:  # Abrimos el archivo en escritura binaria
+                pickle.dump(networks, f)  # Guardamos el catálogo completo
+        except Exception:  # Disco lleno, permisos, etc.
+            pass  # Seguimos sin caché
+    return networks  # Devolvemos el catálogo recién descargado
+
+def _contar_cercanas(lat_r, lon_r, lats, lons, radio_2, kx, ky):
+
+    ################################################################################
+    # Núcleo de conteo de puntos dentro de un radio sobre la proyección plana.
+    # Escrito como bucle simple para que numba (si está disponible) lo compile a
+    # código máquina sin arrays temporales; sin numba lo sustituye el camino
+    # vectorizado de NumPy del llamante.
+    #
+    # RECIBE:
+    # - lat_r, lon_r (float): Coordenadas del local en grados.
+    # - lats, lons (ndarray): Coordenadas de los candidatos en grados.
+    # - radio_2 (float): Radio de influencia al cuadrado, en metros cuadrados.
+    # - kx, ky (float): Metros por grado de longitud y latitud.
+    #
+    # DEVUELVE:
+    # - int: Número de candidatos dentro del radio.
+    ################################################################################
+
+    n = 0  # Contador de puntos dentro del radio
+    for i in range(lats.shape[0]):  # Recorremos los candidatos
+        dx = (lons[i] - lon_r) * kx  # Desplazamiento este-oeste en metros
+        dy = (lats[i] - lat_r) * ky  # Desplazamiento norte-sur en metros
+        if dx * dx + dy * dy <= radio_2:  # Comparación al cuadrado: sin raíces
+            n += 1  # El candidato cae dentro
+    return n  # Devolvemos el conteo
+
+if TIENE_NUMBA:  # Solo si numba está disponible
+    _contar_cercanas = njit(cache=True, fastmath=True)(_contar_cercanas)  # Compilamos el núcleo (cache=True evita recompilar en cada ejecución)
+
 ################################################################################
 # Implementa la fórmula del semiverseno (Haversine) para calcular la distancia
 # ortodrómica entre dos puntos de la superficie terrestre. Esta métrica es
@@ -61,7 +226,7 @@ def calcular_distancia(lat1, lon1, lat2, lon2):
         c = 2 * asin(sqrt(a))  # Calculamos el arco de distancia sobre la superficie
         r = 6371  # Definimos el radio promedio de la Tierra en kilómetros
         return c * r * 1000  # Multiplicamos por mil para obtener y devolver el valor final en metros
-    except:  # Capturamos cualquier excepción durante el cálculo
+    except (TypeError, ValueError):  # Solo los fallos reales de conversión o dominio matemático
         return 999999
 
 ################################################################################
@@ -75,43 +240,130 @@ def calcular_distancia(lat1, lon1, lat2, lon2):
 # DEVUELVE:
 # - tuple: (Nº de paradas de bus, Nº de paradas de metro/tren).
 ################################################################################
-def contar_osm(lat, lon):
+def contar_osm(lat, lon, session=None):
     url = "https://overpass-api.de/api/interpreter"  # Definimos el punto de acceso para el intérprete de Overpass
-    query = f"""
-    [out:json][timeout:25];
-    (
-      node["highway"="bus_stop"](around:{RADIO_BUS_METRO},{lat},{lon});
-      node["public_transport"="platform"]["bus"="yes"](around:{RADIO_BUS_METRO},{lat},{lon});
-      node["railway"="subway_entrance"](around:{RADIO_BUS_METRO},{lat},{lon});
-      node["railway"="station"](around:{RADIO_BUS_METRO},{lat},{lon});
-      node["railway"="tram_stop"](around:{RADIO_BUS_METRO},{lat},{lon});
-    );
-    out body;
-    """  # Construimos la query estructurada filtrando por radios y etiquetas de transporte
+    query = PLANTILLA_QUERY.format(lat=lat, lon=lon)  # Rellenamos la plantilla precompilada con las coordenadas del local
     try:  # Iniciamos la fase de comunicación con el servidor
-        response = requests.get(url, params={'data': query}, timeout=30)  # Lanzamos la petición GET con los datos de la consulta
+        http = session if session is not None else _SESION  # Usamos la sesión recibida o la compartida del módulo (keep-alive + reintentos)
+        # Reintentos explícitos por si la sesión del llamante no reintenta 429/504:
+        # Overpass manda una cabecera Retry-After precisa y la obedecemos
+        for intento in range(MAX_RETRIES):  # Hasta MAX_RETRIES intentos si el servidor pide calma
+            _esperar_turno()  # Respetamos el ritmo máximo de Overpass (cubo de fichas)
+            response = http.get(url, params={'data': query}, timeout=30)  # Lanzamos la petición GET con los datos de la consulta
+            if response.status_code in (429, 504):  # Si nos limitan o el dispatcher está saturado
+                try: espera = float(response.headers.get('Retry-After', ''))  # Respetamos la espera que indique el servidor
+                except ValueError: espera = (2 ** intento) + random.random()  # Si no la indica, backoff exponencial con jitter
+                time.sleep(espera)  # Esperamos antes de reintentar
+                continue  # Reintentamos la consulta
+            break  # Cualquier otra respuesta sale del bucle de reintentos
         if response.status_code == 200:  # Validamos que el servidor haya respondido correctamente
-            data = response.json()  # Extraemos la información en formato JSON
             ids_bus = set()  # Creamos un conjunto para contabilizar paradas de bus únicas
             ids_metro = set()  # Creamos un conjunto para contabilizar estaciones de metro únicas
-            
-            for elem in data.get("elements", []):  # Recorremos cada elemento geográfico encontrado en el radio
-                tags = elem.get("tags", {})  # Obtenemos las etiquetas descriptivas del nodo
-                eid = elem.get("id")  # Recuperamos su identificador único
-                
-                if tags.get("highway") == "bus_stop" or tags.get("bus") == "yes":  # Clasificamos el nodo si es una infraestructura de autobús
+
+            for fila in csv.reader(response.text.splitlines()):  # Recorremos el CSV plano (una fila por nodo, sin cabecera)
+                if len(fila) < 5:  # Filas incompletas o vacías
+                    continue  # Las descartamos
+                eid, highway, bus, railway, station = fila[:5]  # Desempaquetamos las columnas pedidas (vacías si el nodo no tiene el tag)
+
+                if highway == "bus_stop" or bus == "yes":  # Clasificamos el nodo si es una infraestructura de autobús
                     ids_bus.add(eid)  # Registramos el identificador en nuestro conjunto de buses
-                elif "railway" in tags or tags.get("station") in ["subway", "light_rail"]:  # Clasificamos el nodo si pertenece a la red ferroviaria
+                elif railway or station in ("subway", "light_rail"):  # Clasificamos el nodo si pertenece a la red ferroviaria
                     ids_metro.add(eid)  # Registramos el identificador en nuestro conjunto de metro
-                    
+
             return len(ids_bus), len(ids_metro)  # Devolvemos el conteo final de ambas categorías
-        elif response.status_code == 429:  # Controlamos el caso de recibir un error por exceso de peticiones
-            time.sleep(2)  # Pausamos la ejecución para respetar el límite de tráfico
-            
+
     except Exception:  # Evitamos que errores de red detengan el programa
         pass  
     return 0, 0  # Retornamos valores nulos si no pudimos obtener información fiable
 
+@functools.lru_cache(maxsize=1024)  # Dos locales en el mismo portal comparten resultado sin repetir la consulta
+def _contar_osm_cacheado(lat_q, lon_q, session=None):
+
+    ################################################################################
+    # Versión memorizada de contar_osm para el plan B local a local: las
+    # coordenadas llegan ya redondeadas a 4 decimales (~11 m), de modo que
+    # locales del mismo edificio o portal colapsan en una única consulta a
+    # Overpass y el resto se sirve de la caché en memoria.
+    #
+    # RECIBE:
+    # - lat_q, lon_q (float): Coordenadas redondeadas a 4 decimales.
+    # - session (requests.Session | None): Sesión HTTP compartida (opcional).
+    #
+    # DEVUELVE:
+    # - tuple: (Nº de paradas de bus, Nº de paradas de metro/tren).
+    ################################################################################
+
+    return contar_osm(lat_q, lon_q, session)  # Delegamos en la consulta real solo la primera vez por celda
+
+################################################################################
+# Cuenta el transporte pesado de VARIOS locales con una única consulta Overpass
+# por lote: concatena las cláusulas "around:" de todos los puntos en una unión
+# y después atribuye cada nodo devuelto a los locales que lo tienen dentro de
+# su radio, repitiendo en local la comprobación de cercanía. Así pagamos un
+# viaje HTTP (y un hueco del dispatcher de Overpass) por cada 25 locales en
+# lugar de uno por local.
+#
+# RECIBE:
+# - puntos (list): Lista de (lat, lon) o None por local, en orden.
+# - session (requests.Session | None): Sesión HTTP compartida (opcional).
+#
+# DEVUELVE:
+# - list: Una tupla (Nº bus, Nº metro/tren) por punto, en el mismo orden.
+#   Lanza RuntimeError si el servidor rechaza algún lote (el llamante decide
+#   el plan B por local).
+################################################################################
+def contar_osm_lote(puntos, session=None):
+    http = session if session is not None else _SESION  # Sesión recibida o la compartida del módulo (keep-alive + reintentos)
+    url = "https://overpass-api.de/api/interpreter"  # Punto de acceso del intérprete de Overpass
+    resultados = [(0, 0)] * len(puntos)  # Conteos neutros por defecto (locales sin coordenadas incluidos)
+    indices_validos = [i for i, p in enumerate(puntos) if p is not None]  # Posiciones con coordenadas reales
+
+    for inicio in range(0, len(indices_validos), 25):  # Troceamos en lotes de 25 puntos (query razonable para el servidor)
+        lote = indices_validos[inicio:inicio + 25]  # Índices de los locales de este lote
+        clausulas = []  # Cláusulas "around:" acumuladas de todos los puntos del lote
+        for i in lote:  # Recorremos los locales del lote
+            lat, lon = puntos[i]  # Coordenadas del local
+            clausulas.append(_PLANTILLA_CLAUSULAS.format(lat=lat, lon=lon))  # Las cinco categorías alrededor de este local, desde la plantilla
+        # Mismo CSV mínimo que la consulta individual, añadiendo ::lat/::lon
+        # porque aquí necesitamos la posición de cada nodo para atribuirlo
+        query = ('[out:csv(::id,::lat,::lon,highway,bus,railway,station;false;",")]'
+                 "[timeout:120];(" + "".join(clausulas) + ");out body;")  # Unión de todas las cláusulas en una sola consulta
+
+        _esperar_turno()  # Respetamos el ritmo máximo de Overpass también entre lotes
+        response = http.get(url, params={'data': query}, timeout=120)  # Lanzamos la consulta del lote completo
+        if response.status_code != 200:  # Si el servidor rechaza el lote
+            raise RuntimeError(f"Overpass lote: HTTP {response.status_code}")  # El llamante hará las consultas de una en una
+
+        # Pre-clasificamos cada nodo una sola vez (bus / metro / irrelevante)
+        nodos = []  # Lista de (id, lat, lon, tipo) ya clasificada
+        for fila in csv.reader(response.text.splitlines()):  # Recorremos el CSV plano con los nodos de TODO el lote
+            if len(fila) < 7:  # Filas incompletas o vacías
+                continue  # Las descartamos
+            eid, e_lat, e_lon, highway, bus, railway, station = fila[:7]  # Desempaquetamos las columnas pedidas
+            try:  # La posición llega como texto
+                e_lat, e_lon = float(e_lat), float(e_lon)  # Sin posición numérica no hay atribución posible
+            except ValueError:  # Coordenadas vacías o corruptas
+                continue  # Lo descartamos
+            if highway == "bus_stop" or bus == "yes":  # Infraestructura de autobús
+                nodos.append((eid, e_lat, e_lon, "bus"))  # Nodo de bus clasificado
+            elif railway or station in ("subway", "light_rail"):  # Red ferroviaria
+                nodos.append((eid, e_lat, e_lon, "metro"))  # Nodo de metro/tren clasificado
+
+        radio_2 = float(RADIO_BUS_METRO) ** 2  # Radio al cuadrado para comparar sin raíces
+        for i in lote:  # Atribuimos los nodos a cada local del lote
+            lat, lon = puntos[i]  # Coordenadas del local
+            kx = cos(radians(float(lat))) * 111320.0  # Metros por grado de longitud a esta latitud
+            ids_bus = set()  # Paradas de bus únicas dentro del radio
+            ids_metro = set()  # Estaciones de metro únicas dentro del radio
+            for eid, e_lat, e_lon, tipo in nodos:  # Revisamos cada nodo clasificado del lote
+                dx = (float(e_lon) - float(lon)) * kx  # Desplazamiento este-oeste en metros
+                dy = (float(e_lat) - float(lat)) * 111320.0  # Desplazamiento norte-sur en metros
+                if dx * dx + dy * dy <= radio_2:  # El nodo cae dentro del radio de este local
+                    (ids_bus if tipo == "bus" else ids_metro).add(eid)  # Lo contamos en su categoría
+            resultados[i] = (len(ids_bus), len(ids_metro))  # Conteo final de este local
+
+    return resultados  # Devolvemos los conteos en el orden original de los puntos
+
 ################################################################################
 # Identifica la red de bicicletas compartidas más pertinente. Prioriza la
 # coincidencia textual con el nombre de la ciudad para evitar errores en
@@ -124,59 +376,70 @@ def contar_osm(lat, lon):
 # DEVUELVE:
 # - list: Listado de todas las estaciones de la red detectada.
 ################################################################################
-def detectar_y_obtener_estaciones(lat_ref, lon_ref, ciudad_busqueda):
+def detectar_y_obtener_estaciones(lat_ref, lon_ref, ciudad_busqueda, session=None):
+    http = session if session is not None else _SESION  # Sesión recibida o la compartida del módulo (keep-alive + reintentos)
     print(f"  Buscando red de bicis para: '{ciudad_busqueda}'...")
     
-    url_networks = "http://api.citybik.es/v2/networks"  # Definimos la ruta para obtener el catálogo global de redes
-    
     mejor_red = None  # Inicializamos el contenedor para la red que mejor encaje
-    distancia_minima = float('inf')  # Empezamos con una distancia comparativa infinita
-    
-    ciudad_normalizada = ciudad_busqueda.lower().strip()  # Limpiamos el texto del usuario para una comparación más precisa
-    
-    for i in range(MAX_RETRIES):  # Iniciamos el bucle para intentar la conexión con la API
-        try:  # Intentamos recuperar el listado de redes disponibles
-            resp = requests.get(url_networks, timeout=10)  # Realizamos la llamada a CityBikes
-            if resp.status_code == 200:  # Comprobamos que la comunicación ha sido exitosa
-                networks = resp.json().get('networks', [])  # Parseamos el listado de todas las redes mundiales
-                
-                # FASE 1: Filtramos solo aquellas redes que operan dentro de España
-                redes_es = [n for n in networks if n.get('location', {}).get('country') == 'ES']  
-                
-                # FASE 2: Buscamos coincidencias por nombre para asegurar la precisión semántica
-                candidatos_nombre = []  # Inicializamos la lista de redes que coinciden por texto
-                
-                if len(ciudad_normalizada) > 2:  # Verificamos que el usuario haya introducido una ciudad válida
-                    for net in redes_es:  # Revisamos cada red española del catálogo
-                        loc_api = net.get('location', {})  # Extraemos los datos de ubicación de la red
-                        city_api = loc_api.get('city', '').lower()  # Obtenemos el nombre de la ciudad según la API
-                        name_api = net.get('name', '').lower()  # Obtenemos el nombre comercial de la red
-                        
-                        if ciudad_normalizada in city_api or ciudad_normalizada in name_api:  # Comparamos si existe coincidencia con el input del usuario
-                            candidatos_nombre.append(net)  # Registramos la red como candidata prioritaria
-                
-                # Lógica: Si encontramos redes por nombre, las priorizamos; si no, buscamos por cercanía física
-                pool_busqueda = candidatos_nombre if candidatos_nombre else redes_es  
-                
-                if candidatos_nombre:  
-                    print(f"    Prioridad: Se encontraron {len(candidatos_nombre)} redes por coincidencia de nombre.")
-                else:  
-                    print("    No hay coincidencia de nombre. Buscando la red más cercana por coordenadas...")
-
-                # FASE 3: Seleccionamos la red más cercana dentro del grupo filtrado
-                for net in pool_busqueda:  # Iteramos sobre las redes candidatas
-                    loc = net.get('location', {})  # Obtenemos las coordenadas centrales de la red
-                    d = calcular_distancia(lat_ref, lon_ref, loc.get('latitude'), loc.get('longitude'))  # Medimos la distancia a nuestro local de referencia
-                    
-                    if d < distancia_minima:  # Verificamos si esta red es la más cercana hasta el momento
-                        distancia_minima = d  # Actualizamos nuestra distancia de referencia
-                        mejor_red = net  # Designamos esta red como la opción ganadora
-                break  # Salimos del bucle al haber completado la selección
-                
-        except Exception as e:  # Manejamos posibles fallos en la consulta de redes
-            print(f"    Intento {i+1} fallido (Redes): {e}")
-            time.sleep(2)  # Esperamos antes de realizar un nuevo intento
-            
+
+    ciudad_normalizada = _sin_acentos(ciudad_busqueda.lower().strip())  # Limpiamos el texto del usuario (minúsculas y sin acentos)
+
+    # Los reintentos con espera creciente los gestiona ya el adaptador de la sesión
+    try:  # Intentamos recuperar el listado de redes disponibles
+        networks = _catalogo_redes(http)  # Catálogo global de redes (de caché si tiene menos de 7 días)
+        if networks:  # Comprobamos que tenemos catálogo con el que trabajar
+
+            # FASE 1: Una sola pasada por el catálogo construye el índice español
+            # con los textos ya en minúsculas y las coordenadas extraídas, para
+            # que las fases siguientes no repitan .get()/.lower() por iteración
+            indice_es = []  # Tuplas (red, ciudad_min, nombre_min, lat, lon) de las redes españolas
+            for net in networks:  # Recorremos el catálogo global una única vez
+                loc_api = net.get('location', {})  # Extraemos los datos de ubicación de la red
+                if loc_api.get('country') != 'ES':  # Solo nos interesan redes que operan en España
+                    continue  # Descartamos el resto del mundo
+                indice_es.append((net, _sin_acentos(loc_api.get('city', '').lower()), _sin_acentos(net.get('name', '').lower()),
+                                  loc_api.get('latitude'), loc_api.get('longitude')))  # Campos normalizados (minúsculas y sin acentos) y listos
+
+            # FASE 2: Buscamos coincidencias por nombre para asegurar la precisión semántica
+            candidatos_nombre = []  # Entradas del índice que coinciden por texto
+            if len(ciudad_normalizada) > 2:  # Verificamos que el usuario haya introducido una ciudad válida
+                candidatos_nombre = [t for t in indice_es  # Comparamos contra los textos ya minimizados del índice
+                                     if ciudad_normalizada in t[1] or ciudad_normalizada in t[2]]  # Coincidencia por ciudad o nombre comercial
+                if not candidatos_nombre:  # Plan B difuso: "Alacant"/"Alicante" o erratas leves del usuario
+                    parecidas = set(difflib.get_close_matches(ciudad_normalizada,  # Emparejamos contra las ciudades del índice
+                                                              [t[1] for t in indice_es], n=5, cutoff=0.8))  # Solo coincidencias muy próximas
+                    candidatos_nombre = [t for t in indice_es if t[1] in parecidas]  # Recuperamos las entradas de esas ciudades
+
+            # Lógica: Si encontramos redes por nombre, las priorizamos; si no, buscamos por cercanía física
+            pool_busqueda = candidatos_nombre if candidatos_nombre else indice_es
+
+            if candidatos_nombre:
+                print(f"    Prioridad: Se encontraron {len(candidatos_nombre)} redes por coincidencia de nombre.")
+            else:
+                print("    No hay coincidencia de nombre. Buscando la red más cercana por coordenadas...")
+
+            # FASE 3: Seleccionamos la red más cercana con un argmin vectorizado:
+            # empaquetamos las coordenadas candidatas y una sola pasada de numpy
+            # calcula todas las distancias (las redes sin coordenadas quedan a infinito)
+            if pool_busqueda:  # Solo si hay redes candidatas
+                lats_pool = np.array([t[3] if t[3] is not None else np.nan for t in pool_busqueda], dtype=np.float64)  # Latitudes candidatas (NaN si faltan)
+                lons_pool = np.array([t[4] if t[4] is not None else np.nan for t in pool_busqueda], dtype=np.float64)  # Longitudes candidatas (NaN si faltan)
+                lat_r = radians(float(lat_ref))  # Latitud de referencia en radianes
+                lon_r = radians(float(lon_ref))  # Longitud de referencia en radianes
+                lp = np.radians(lats_pool)  # Latitudes candidatas en radianes
+                lo = np.radians(lons_pool)  # Longitudes candidatas en radianes
+                a = np.sin((lp - lat_r) * 0.5)**2 + cos(lat_r) * np.cos(lp) * np.sin((lo - lon_r) * 0.5)**2  # Semiverseno de todas las candidatas
+                # arcsin, raíz y escalado a metros son monótonos: el argmin sobre
+                # el término "a" elige la MISMA red que el argmin sobre la
+                # distancia real, así que nos ahorramos toda esa trigonometría
+                a = np.where(np.isnan(a), np.inf, a)  # Las redes sin coordenadas nunca ganan
+                ganadora = int(np.argmin(a))  # Posición de la red más cercana
+                if np.isfinite(a[ganadora]):  # Solo si al menos una candidata tenía coordenadas
+                    mejor_red = pool_busqueda[ganadora][0]  # Designamos esa red como la opción ganadora
+
+    except Exception as e:  # Manejamos posibles fallos en la consulta de redes
+        print(f"    Consulta de redes fallida: {e}")
+
     if not mejor_red:  # Si tras los reintentos no encontramos ninguna red apta
         print("    No se detectó ninguna red compatible.")
         return []  # Retornamos una lista vacía
@@ -189,14 +452,13 @@ def detectar_y_obtener_estaciones(lat_ref, lon_ref, ciudad_busqueda):
     href = mejor_red.get('href')  # Tomamos el enlace específico para las estaciones de esa red
     url_estaciones = f"http://api.citybik.es{href}"  # Generamos la URL completa para la consulta
     
-    for i in range(MAX_RETRIES):  # Intentamos descargar el listado de estaciones
-        try:  # Realizamos la petición de los puntos de anclaje
-            resp = requests.get(url_estaciones, timeout=10)  # Llamamos al endpoint detallado de la red
-            if resp.status_code == 200:  # Si la respuesta es satisfactoria
-                return resp.json().get('network', {}).get('stations', [])  # Devolvemos la lista de estaciones encontradas
-        except Exception as e:  # Controlamos fallos en la descarga de estaciones
-            time.sleep(2)  # Pausamos antes del reintento
-            
+    try:  # Realizamos la petición de los puntos de anclaje (reintentos a cargo del adaptador)
+        resp = http.get(url_estaciones, timeout=10)  # Llamamos al endpoint detallado de la red
+        if resp.status_code == 200:  # Si la respuesta es satisfactoria
+            return resp.json().get('network', {}).get('stations', [])  # Devolvemos la lista de estaciones encontradas
+    except Exception:  # Controlamos fallos en la descarga de estaciones
+        pass  # El retorno vacío de abajo cubre el fallo
+
     return []  # Retornamos vacío ante un fallo crítico de descarga
 
 ################################################################################
@@ -207,11 +469,12 @@ def detectar_y_obtener_estaciones(lat_ref, lon_ref, ciudad_busqueda):
 # RECIBE:
 # - df_3: Datos de locales.
 # - ciudad: Ciudad de referencia.
+# - session: requests.Session compartida con el resto de la pipeline (opcional).
 #
 # DEVUELVE:
 # - DataFrame: Los datos originales con las nuevas métricas de transporte.
 ################################################################################
-def analizar_transporte(df_3, ciudad=""):
+def analizar_transporte(df_3, ciudad="", session=None):
     print(f"\n--- INICIANDO P4: Transporte Híbrido ---")
     
     df_4 = df_3.copy()  # Creamos una copia de trabajo para no alterar el DataFrame original
@@ -229,41 +492,116 @@ def analizar_transporte(df_3, ciudad=""):
     estaciones_bicis = []  # Inicializamos el contenedor para las estaciones de bicicletas
     if lat_ref != 0:  # Si hemos conseguido una ubicación de referencia válida
         # Descargamos la infraestructura de bicicletas compartidas de la ciudad
-        estaciones_bicis = detectar_y_obtener_estaciones(lat_ref, lon_ref, ciudad)  
+        estaciones_bicis = detectar_y_obtener_estaciones(lat_ref, lon_ref, ciudad, session)  
     else:  
         print("    No hay coordenadas válidas para buscar red de bicis.")
     
-    columna_transporte = []  # Inicializamos la lista donde acumularemos los resultados finales por local
-    
+    # Volcamos las coordenadas de las estaciones a arrays contiguos UNA sola vez:
+    # el conteo por local pasa de un bucle Python con trigonometría escalar a
+    # operaciones vectorizadas de numpy sobre toda la red de golpe
+    lat_est = lon_est = None  # Arrays de estaciones (None si no hay red de bicis)
+    margen_lat = RADIO_BICIS / 111320.0  # Grados de latitud que abarca el radio de bicis
+    if estaciones_bicis:  # Solo si hemos detectado estaciones
+        lat_est = np.fromiter((e['latitude'] for e in estaciones_bicis),
+                              dtype=np.float64, count=len(estaciones_bicis))  # Latitudes en grados
+        lon_est = np.fromiter((e['longitude'] for e in estaciones_bicis),
+                              dtype=np.float64, count=len(estaciones_bicis))  # Longitudes en grados
+        # Ordenamos las estaciones por latitud: cada local podrá acotar con dos
+        # búsquedas binarias la franja de estaciones candidatas y calcular
+        # distancias solo dentro de ella, en vez de contra toda la red
+        orden = np.argsort(lat_est)  # Permutación que ordena por latitud
+        lat_est = lat_est[orden]  # Latitudes ordenadas
+        lon_est = lon_est[orden]  # Longitudes en el mismo orden
+
+    # A 300 m de radio la curvatura terrestre es despreciable: proyectamos a un plano
+    # local ("cheap ruler") con un único cos(lat) por ciudad y comparamos distancias
+    # al cuadrado, ahorrándonos senos, arcosenos y raíces por estación
+    kx = cos(radians(lat_ref)) * 111320.0 if lat_ref != 0 else 111320.0  # Metros por grado de longitud a la latitud de la ciudad
+    ky = 111320.0  # Metros por grado de latitud (constante)
+    radio_bicis_2 = float(RADIO_BICIS) ** 2  # Radio al cuadrado: evita la raíz en cada comparación
+
+    # Estructura de arrays (SoA) preasignada: tres columnas int16 contiguas en
+    # lugar de una lista de tuplas Python (6 bytes por local frente a decenas);
+    # el .tolist() final reconstruye las tuplas que app.py descompone en
+    # BUS / METRO / BICI, así que el contrato de la columna no cambia
+    conteos_finales = np.zeros(len(df_4), dtype=[('bus', 'i2'), ('metro', 'i2'), ('bici', 'i2')])  # Conteos por local, neutros por defecto
+
     print("Calculando distancias transporte...")
-    for index, row in df_4.iterrows():  # Procesamos cada inmueble de forma individual
-        try:  # Iniciamos el análisis de conectividad por local
-            coords = row['COORDENADAS']  # Extraemos la ubicación específica del local
-            if not isinstance(coords, (tuple, list)) or len(coords) < 2 or coords == (0,0):  # Validamos los datos geográficos
-                columna_transporte.append((0, 0, 0))  # Asignamos valores nulos si los datos son corruptos
-                continue  
-                
-            lat, lon = coords[0], coords[1]  # Desempaquetamos latitud y longitud
-            
-            # A. Realizamos el recuento de transporte público pesado mediante OpenStreetMap
-            n_bus, n_tren = contar_osm(lat, lon)  
-            
-            # B. Calculamos la densidad de estaciones de bicicleta en el entorno inmediato
+
+    # FASE 1: VALIDACIÓN. Extraemos las coordenadas útiles de cada local (None si no valen)
+    puntos = []  # Lista de (lat, lon) o None, en el orden del DataFrame
+    # Solo leemos una columna: el array de numpy evita construir una Series por fila (iterrows)
+    for coords in df_4['COORDENADAS'].to_numpy():  # Procesamos cada inmueble de forma individual
+        if not isinstance(coords, (tuple, list)) or len(coords) < 2 or coords == (0,0):  # Validamos los datos geográficos
+            puntos.append(None)  # Marcamos el local como sin coordenadas fiables
+        else:  # Coordenadas correctas
+            puntos.append((coords[0], coords[1]))  # Guardamos latitud y longitud
+
+    # FASE 2: OVERPASS POR LOTES. Intentamos resolver todos los locales con una
+    # consulta unida cada 25 puntos (un viaje HTTP por lote); si el servidor
+    # rechaza los lotes, caemos al plan B de consultas por local en paralelo
+    # con el mismo patrón gather + to_thread + semáforo de app.py y p2
+    try:  # Plan A: lote único por cada 25 locales
+        conteos_osm = contar_osm_lote(puntos, session)  # Una consulta Overpass resuelve todo el lote
+    except Exception as e:  # El servidor ha rechazado algún lote
+        print(f"    Lote Overpass rechazado ({e}). Consultando local a local...")
+
+        semaforo = asyncio.Semaphore(4)  # Límite de consultas simultáneas al servidor
+
+        async def _contar(punto):  # Envuelve el conteo OSM de un local en una corrutina acotada
+            if punto is None:  # Locales sin coordenadas
+                return (0, 0)  # No hay nada que consultar
+            async with semaforo:  # Respetamos el límite de peticiones simultáneas
+                # Redondeamos a 4 decimales (~11 m): locales con coordenadas casi
+                # idénticas comparten la misma entrada de caché y una sola consulta
+                return await asyncio.to_thread(_contar_osm_cacheado, round(float(punto[0]), 4), round(float(punto[1]), 4), session)  # La petición corre en un hilo (el I/O libera el GIL)
+
+        async def _contar_todos():  # Lanza todos los locales a la vez y espera los resultados en orden
+            return await asyncio.gather(*(_contar(p) for p in puntos))  # gather conserva el orden original
+
+        try:  # El fallo de la fase de red no debe tumbar el módulo
+            conteos_osm = asyncio.run(_contar_todos())  # Ejecutamos todas las consultas Overpass concurrentes
+        except Exception as e:  # Error inesperado del bucle de eventos
+            print(f"    Error en consultas Overpass: {e}")
+            conteos_osm = [(0, 0)] * len(puntos)  # Continuamos con conteos neutros
+
+    # FASE 3: ENSAMBLADO. Bicis vectorizadas (CPU local) + resultados de red, por local
+    lineas = []  # Acumulamos el detalle por local y lo imprimimos de una sola vez al final
+    for i, (punto, (n_bus, n_tren)) in enumerate(zip(puntos, conteos_osm)):  # Recorremos los locales en su orden original
+        try:  # Evitamos que errores en un local específico detengan todo el ranking
+            if punto is None:  # Local sin coordenadas fiables
+                continue  # Su fila ya está a cero en el array preasignado
+
+            lat, lon = punto  # Desempaquetamos latitud y longitud
+
+            # Calculamos la densidad de estaciones de bicicleta en el entorno inmediato
             n_bicis = 0  # Inicializamos el contador local de bicicletas
-            for est in estaciones_bicis:  # Revisamos cada estación de la red descargada previamente
-                d = calcular_distancia(lat, lon, est['latitude'], est['longitude'])  # Medimos la distancia local-estación
-                if d <= RADIO_BICIS:  # Comprobamos si el servicio está dentro de nuestro radio de influencia
-                    n_bicis += 1  # Incrementamos el recuento de estaciones cercanas
-            
-            print(f"    -> Transporte detectado (Bus, Metro, Bici): {(n_bus, n_tren, n_bicis)}")
-            
-            columna_transporte.append((n_bus, n_tren, n_bicis))  # Almacenamos los resultados en la tupla de métricas
-            time.sleep(0.1)  # Realizamos una pausa mínima para evitar saturación en el procesamiento
-            
+            if lat_est is not None:  # Solo si hay red de bicis descargada
+                # Poda espacial: dos búsquedas binarias acotan la franja de latitud
+                # que puede contener estaciones dentro del radio; las demás ni se miran
+                izq = int(np.searchsorted(lat_est, float(lat) - margen_lat))  # Primera estación candidata
+                der = int(np.searchsorted(lat_est, float(lat) + margen_lat))  # Primera estación ya fuera de rango
+                if izq < der:  # Solo si la franja contiene estaciones
+                    if TIENE_NUMBA:  # CAMINO RÁPIDO: bucle compilado, sin arrays temporales
+                        n_bicis = int(_contar_cercanas(float(lat), float(lon), lat_est[izq:der], lon_est[izq:der], radio_bicis_2, kx, ky))  # Conteo en código máquina
+                    else:  # Camino NumPy puro
+                        # Proyección plana vectorizada sobre la franja candidata únicamente
+                        dx = (lon_est[izq:der] - float(lon)) * kx  # Desplazamiento este-oeste en metros
+                        dy = (lat_est[izq:der] - float(lat)) * ky  # Desplazamiento norte-sur en metros
+                        n_bicis = int(((dx * dx + dy * dy) <= radio_bicis_2).sum())  # Contamos las que caen dentro del radio de influencia
+
+            lineas.append(f"    -> Transporte detectado (Bus, Metro, Bici): {(n_bus, n_tren, n_bicis)}")  # Guardamos la línea en vez de imprimirla ya
+
+            conteos_finales[i] = (n_bus, n_tren, n_bicis)  # Escribimos las métricas en la fila preasignada del local
+
         except Exception:  # Evitamos que errores en un local específico detengan todo el ranking
-            columna_transporte.append((0, 0, 0))  # Rellenamos con datos neutros ante fallos inesperados
+            continue  # Su fila queda con los datos neutros del array preasignado
+
+    if lineas:  # Si hay detalle acumulado
+        print("\n".join(lineas))  # Una sola escritura en pantalla en lugar de una por local
+    print(f"    {len(conteos_finales)} locales analizados.")  # Resumen final del módulo
 
-    df_4['NUM_TRANS_PUB'] = columna_transporte  # Inyectamos la lista de resultados en la nueva columna del DataFrame
+    df_4['NUM_TRANS_PUB'] = conteos_finales.tolist()  # .tolist() entrega una tupla (bus, metro, bici) por local, como hasta ahora
     return df_4  # Devolvemos el DataFrame enriquecido y listo para el cálculo del ranking final
 
 if __name__ == "__main__":